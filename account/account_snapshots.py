@@ -0,0 +1,114 @@
+"""
+Short-lived cache of Plaid account data per item.
+Several views read the same accounts within seconds of each other (and of
+PlaidConnectView fetching them); they share one snapshot instead of each
+calling /accounts/get.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .plaid_archive import archiving_for
+from .plaid_service import PlaidService
+
+KEY_PREFIX = 'plaid-accounts:'
+
+
+class SnapshotStats:
+    """Thread-safe hit/miss counters for account snapshots."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.forced_refreshes = 0
+
+    def record(self, hit, forced=False):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+                if forced:
+                    self.forced_refreshes += 1
+
+    def snapshot(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'forced_refreshes': self.forced_refreshes,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+_stats = SnapshotStats()
+
+
+def _cache():
+    return caches[getattr(settings, 'PLAID_SNAPSHOT_CACHE_ALIAS', 'default')]
+
+
+def _as_dicts(accounts):
+    # Plaid SDK models don't pickle; callers only use dict-style access anyway
+    return [account.to_dict() if hasattr(account, 'to_dict') else account for account in accounts]
+
+
+def wants_fresh(request):
+    """True when the client asked to bypass the snapshot with ?fresh=1."""
+    return request.GET.get('fresh', '').lower() in ('1', 'true', 'yes')
+
+
+def store_account_snapshot(item_id, accounts):
+    """Cache accounts just fetched from Plaid (e.g. right after token exchange)."""
+    accounts = _as_dicts(accounts)
+    _cache().set(
+        f'{KEY_PREFIX}{item_id}',
+        {'accounts': accounts, 'fetched_at': time.time()},
+        getattr(settings, 'PLAID_SNAPSHOT_TTL', 300),
+    )
+    return accounts
+
+
+def invalidate_account_snapshot(item_id):
+    _cache().delete(f'{KEY_PREFIX}{item_id}')
+
+
+def get_account_snapshot(plaid_connection, fresh=False, plaid_service=None):
+    """
+    Returns (accounts, age_seconds) for a PlaidConnection.
+    Served from the snapshot while it is younger than PLAID_SNAPSHOT_TTL;
+    otherwise, or when `fresh` is set, fetched from Plaid and re-cached.
+    Accounts are plain dicts.
+    """
+    if not fresh:
+        snapshot = _cache().get(f'{KEY_PREFIX}{plaid_connection.item_id}')
+        if snapshot is not None:
+            _stats.record(hit=True)
+            return snapshot['accounts'], round(time.time() - snapshot['fetched_at'], 1)
+
+    _stats.record(hit=False, forced=fresh)
+    plaid_service = plaid_service or PlaidService()
+    with archiving_for(plaid_connection):
+        accounts = plaid_service.get_accounts(plaid_connection.access_token)
+    return store_account_snapshot(plaid_connection.item_id, accounts), 0.0
+
+
+def get_combined_account_snapshot(plaid_connections, fresh=False, plaid_service=None, deadline=None):
+    """
+    Returns (accounts, age_seconds) across all of an application's connections,
+    each item's snapshot fetched concurrently. The age is that of the oldest snapshot.
+    """
+    plaid_service = plaid_service or PlaidService()
+    results = plaid_service.fetch_per_connection(
+        plaid_connections, get_account_snapshot, fresh, plaid_service, deadline=deadline
+    )
+    accounts = [account for item_accounts, _ in results for account in item_accounts]
+    return accounts, max(age for _, age in results)
+
+
+def get_snapshot_stats():
+    return _stats.snapshot()
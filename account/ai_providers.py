@@ -0,0 +1,476 @@
+"""
+Model providers behind PreApprovalEngine.
+
+Each provider wraps one vendor/model with a pooled, process-wide HTTP client,
+its own circuit breaker and a latency histogram. The engine picks a primary
+provider and may hedge slow calls to an alternate one.
+"""
+import asyncio
+import bisect
+import math
+import threading
+from abc import ABC, abstractmethod
+import time
+import weakref
+from collections import deque
+
+import httpx
+from django.conf import settings
+
+from .resilience import get_breaker
+
+
+class _PoolStats:
+    """
+    Thread-safe counters for a shared HTTP connection pool.
+    A request sent without opening a TCP connection reused a kept-alive one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.new_connections = 0
+        self.reused_connections = 0
+        self.connect_seconds = 0.0
+
+    def record_new(self, seconds):
+        with self._lock:
+            self.new_connections += 1
+            self.connect_seconds += seconds
+
+    def record_reused(self):
+        with self._lock:
+            self.reused_connections += 1
+
+    def snapshot(self):
+        with self._lock:
+            avg_connect_ms = (self.connect_seconds / self.new_connections * 1000) if self.new_connections else 0.0
+            return {
+                'requests': self.new_connections + self.reused_connections,
+                'new_connections': self.new_connections,
+                'reused_connections': self.reused_connections,
+                'avg_connect_ms': round(avg_connect_ms, 2),
+                'estimated_saved_ms': round(self.reused_connections * avg_connect_ms, 2),
+            }
+
+
+_pool_stats = {}
+_clients = {}
+_async_clients = weakref.WeakKeyDictionary()
+_clients_lock = threading.RLock()
+
+
+def _get_pool_stats(vendor):
+    with _clients_lock:
+        return _pool_stats.setdefault(vendor, _PoolStats())
+
+
+def _connection_tracer(pool_stats):
+    """Build an httpx request hook that times TCP/TLS setup so new vs. reused connections can be counted."""
+
+    def hook(request):
+        state = {}
+        handshake_done = 'connection.start_tls.complete' if request.url.scheme == 'https' else 'connection.connect_tcp.complete'
+
+        def trace(event_name, info):
+            if event_name == 'connection.connect_tcp.started':
+                state['connect_started'] = time.perf_counter()
+            elif event_name == handshake_done and 'connect_started' in state:
+                pool_stats.record_new(time.perf_counter() - state.pop('connect_started'))
+                state['new_connection'] = True
+            elif event_name.endswith('.send_request_headers.started'):
+                if not state.pop('new_connection', False):
+                    pool_stats.record_reused()
+
+        request.extensions['trace'] = trace
+
+    return hook
+
+
+def _async_connection_tracer(pool_stats):
+    """Async counterpart of _connection_tracer; httpcore awaits trace callbacks on async clients."""
+    sync_hook = _connection_tracer(pool_stats)
+
+    async def hook(request):
+        sync_hook(request)
+        sync_trace = request.extensions['trace']
+
+        async def trace(event_name, info):
+            sync_trace(event_name, info)
+
+        request.extensions['trace'] = trace
+
+    return hook
+
+
+def _vendor_setting(vendor, name, default):
+    """A per-vendor client setting, e.g. OPENAI_POOL_SIZE or ANTHROPIC_POOL_SIZE."""
+    return getattr(settings, f'{vendor.upper()}_{name}', default)
+
+
+def _http_client_options(vendor):
+    pool_size = _vendor_setting(vendor, 'POOL_SIZE', 10)
+    return {
+        'limits': httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size,
+            keepalive_expiry=_vendor_setting(vendor, 'KEEPALIVE_EXPIRY', 60.0),
+        ),
+        'timeout': httpx.Timeout(
+            _vendor_setting(vendor, 'TIMEOUT', 30.0),
+            connect=_vendor_setting(vendor, 'CONNECT_TIMEOUT', 5.0),
+        ),
+    }
+
+
+def _build_sdk_client(vendor, api_key, async_client=False):
+    pool_stats = _get_pool_stats(vendor)
+    if async_client:
+        http_client = httpx.AsyncClient(
+            event_hooks={'request': [_async_connection_tracer(pool_stats)]}, **_http_client_options(vendor)
+        )
+    else:
+        http_client = httpx.Client(
+            event_hooks={'request': [_connection_tracer(pool_stats)]}, **_http_client_options(vendor)
+        )
+    max_retries = _vendor_setting(vendor, 'MAX_RETRIES', 0)
+
+    if vendor == 'openai':
+        import openai
+        client_class = openai.AsyncOpenAI if async_client else openai.OpenAI
+    elif vendor == 'anthropic':
+        import anthropic
+        client_class = anthropic.AsyncAnthropic if async_client else anthropic.Anthropic
+    else:
+        raise ValueError(f"Unknown AI provider vendor: {vendor}")
+    return client_class(api_key=api_key, http_client=http_client, max_retries=max_retries)
+
+
+def get_sdk_client(vendor, api_key):
+    """
+    Return the process-wide SDK client for this vendor and API key.
+    Created lazily on first use and shared by every thread in the worker, so
+    decisions reuse kept-alive HTTPS connections instead of paying a new handshake.
+    """
+    key = (vendor, api_key)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _build_sdk_client(vendor, api_key)
+            _clients[key] = client
+    return client
+
+
+def get_async_sdk_client(vendor, api_key):
+    """
+    Return the async SDK client for this vendor and API key on the running loop.
+    httpx async pools are bound to the loop that created them, so clients are
+    kept per loop; under an ASGI worker that is one shared client per process.
+    """
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        loop_clients = _async_clients.setdefault(loop, {})
+        client = loop_clients.get((vendor, api_key))
+        if client is None:
+            client = _build_sdk_client(vendor, api_key, async_client=True)
+            loop_clients[(vendor, api_key)] = client
+    return client
+
+
+def get_openai_client(api_key):
+    return get_sdk_client('openai', api_key)
+
+
+def get_async_openai_client(api_key):
+    return get_async_sdk_client('openai', api_key)
+
+
+def get_pool_stats():
+    """Connection reuse counters for every shared SDK client in this worker, by vendor."""
+    with _clients_lock:
+        vendors = dict(_pool_stats)
+        sync_clients = list(_clients)
+        async_clients = [key for loop_clients in list(_async_clients.values()) for key in loop_clients]
+    stats = {}
+    for vendor, pool_stats in vendors.items():
+        stats[vendor] = pool_stats.snapshot()
+        stats[vendor]['clients'] = sum(1 for key in sync_clients if key[0] == vendor)
+        stats[vendor]['async_clients'] = sum(1 for key in async_clients if key[0] == vendor)
+        stats[vendor]['pool_size'] = _vendor_setting(vendor, 'POOL_SIZE', 10)
+    return stats
+
+
+class LatencyHistogram:
+    """
+    Fixed-bucket latency histogram plus a window of recent samples for percentiles.
+    Only successful calls are recorded so p95 reflects real answer times.
+    """
+    BUCKETS_MS = [100, 250, 500, 1000, 2000, 3000, 5000, 10000, 30000]
+
+    def __init__(self, window=200):
+        self._lock = threading.Lock()
+        self.counts = [0] * (len(self.BUCKETS_MS) + 1)
+        self.samples = deque(maxlen=window)
+        self.total = 0
+        self.sum_ms = 0.0
+
+    def record(self, seconds):
+        ms = seconds * 1000
+        with self._lock:
+            self.counts[bisect.bisect_left(self.BUCKETS_MS, ms)] += 1
+            self.samples.append(ms)
+            self.total += 1
+            self.sum_ms += ms
+
+    def percentile(self, pct):
+        """Percentile of recent samples in milliseconds, or None without data."""
+        with self._lock:
+            samples = sorted(self.samples)
+        if not samples:
+            return None
+        index = min(int(round(pct / 100 * (len(samples) - 1))), len(samples) - 1)
+        return samples[index]
+
+    def sample_count(self):
+        with self._lock:
+            return len(self.samples)
+
+    def snapshot(self):
+        with self._lock:
+            labels = [f'le_{limit}ms' for limit in self.BUCKETS_MS] + ['gt_30000ms']
+            buckets = dict(zip(labels, self.counts))
+            total, sum_ms = self.total, self.sum_ms
+        percentiles = {f'p{pct}_ms': self.percentile(pct) for pct in (50, 95, 99)}
+        return {
+            'count': total,
+            'avg_ms': round(sum_ms / total, 1) if total else None,
+            **{name: round(value, 1) if value is not None else None for name, value in percentiles.items()},
+            'buckets': buckets,
+        }
+
+
+class DecisionProvider(ABC):
+    """
+    One vendor/model that can answer the pre-approval prompt.
+    `complete`/`acomplete` return (answer_text, confidence); breaker and
+    latency bookkeeping is done by `call`/`acall`.
+    """
+    vendor = None
+
+    def __init__(self, model, api_key):
+        self.model = model
+        self.api_key = api_key
+        self.name = f'{self.vendor}:{model}'
+        self.breaker = get_breaker(
+            self.name,
+            failure_threshold=getattr(settings, 'AI_BREAKER_FAILURE_THRESHOLD', 5),
+            recovery_timeout=getattr(settings, 'AI_BREAKER_RECOVERY_SECONDS', 30.0),
+        )
+        self.histogram = get_histogram(self.name)
+
+    @abstractmethod
+    def complete(self, prompt, timeout, logprobs=False):
+        """Return (answer_text, confidence); confidence is None unless logprobs are requested and supported."""
+
+    @abstractmethod
+    async def acomplete(self, prompt, timeout, logprobs=False):
+        """Async counterpart of complete."""
+
+    def call(self, prompt, timeout, logprobs=False):
+        """Call the model through the breaker; raises CircuitOpenError or the upstream error."""
+        self.breaker.before_call()
+        started = time.perf_counter()
+        try:
+            answer = self.complete(prompt, timeout, logprobs)
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.histogram.record(time.perf_counter() - started)
+        self.breaker.record_success()
+        return answer
+
+    async def acall(self, prompt, timeout, logprobs=False):
+        self.breaker.before_call()
+        started = time.perf_counter()
+        try:
+            answer = await self.acomplete(prompt, timeout, logprobs)
+        except asyncio.CancelledError:
+            # Lost a hedge race - neither a success nor a failure of the upstream
+            self.breaker.record_cancelled()
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.histogram.record(time.perf_counter() - started)
+        self.breaker.record_success()
+        return answer
+
+
+class OpenAIProvider(DecisionProvider):
+    vendor = 'openai'
+
+    def _kwargs(self, prompt, timeout, logprobs):
+        kwargs = {
+            'model': self.model,
+            'messages': [{"role": "user", "content": prompt}],
+            'temperature': 0,
+            'max_tokens': 5,
+            'timeout': timeout,
+        }
+        if logprobs:
+            kwargs['logprobs'] = True
+        return kwargs
+
+    def _answer(self, response, logprobs):
+        choice = response.choices[0]
+        confidence = None
+        if logprobs and choice.logprobs and choice.logprobs.content:
+            # The first token already separates "approve" from "dis-approve"
+            confidence = math.exp(choice.logprobs.content[0].logprob)
+        return choice.message.content, confidence
+
+    def complete(self, prompt, timeout, logprobs=False):
+        client = get_sdk_client(self.vendor, self.api_key)
+        response = client.chat.completions.create(**self._kwargs(prompt, timeout, logprobs))
+        return self._answer(response, logprobs)
+
+    async def acomplete(self, prompt, timeout, logprobs=False):
+        client = get_async_sdk_client(self.vendor, self.api_key)
+        response = await client.chat.completions.create(**self._kwargs(prompt, timeout, logprobs))
+        return self._answer(response, logprobs)
+
+
+class AnthropicProvider(DecisionProvider):
+    """Anthropic has no token logprobs, so confidence is always None."""
+    vendor = 'anthropic'
+
+    def _kwargs(self, prompt, timeout):
+        return {
+            'model': self.model,
+            'messages': [{"role": "user", "content": prompt}],
+            'temperature': 0,
+            'max_tokens': 5,
+            'timeout': timeout,
+        }
+
+    def complete(self, prompt, timeout, logprobs=False):
+        response = get_sdk_client(self.vendor, self.api_key).messages.create(**self._kwargs(prompt, timeout))
+        return response.content[0].text, None
+
+    async def acomplete(self, prompt, timeout, logprobs=False):
+        client = get_async_sdk_client(self.vendor, self.api_key)
+        response = await client.messages.create(**self._kwargs(prompt, timeout))
+        return response.content[0].text, None
+
+
+PROVIDER_CLASSES = {
+    'openai': OpenAIProvider,
+    'anthropic': AnthropicProvider,
+}
+
+
+class HedgeStats:
+    """How often the engine hedged to an alternate provider and which provider answered first."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedged = 0
+        self.wins = {}
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def record_hedge(self):
+        with self._lock:
+            self.hedged += 1
+
+    def record_win(self, provider_name):
+        with self._lock:
+            self.wins[provider_name] = self.wins.get(provider_name, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'hedged': self.hedged,
+                'hedge_rate': round(self.hedged / self.requests, 4) if self.requests else 0.0,
+                'wins': dict(self.wins),
+            }
+
+
+class CascadeStats:
+    """How often the small cascade model's answer was kept vs. escalated, and the latency that saved."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.accepted = 0
+        self.escalated = {}
+        self.saved_ms = 0.0
+
+    def record_accepted(self, saved_ms):
+        with self._lock:
+            self.requests += 1
+            self.accepted += 1
+            self.saved_ms += max(saved_ms, 0.0)
+
+    def record_escalated(self, reason):
+        with self._lock:
+            self.requests += 1
+            self.escalated[reason] = self.escalated.get(reason, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            escalated = sum(self.escalated.values())
+            return {
+                'requests': self.requests,
+                'answered_by_small_model': self.accepted,
+                'escalated': escalated,
+                'escalation_rate': round(escalated / self.requests, 4) if self.requests else 0.0,
+                'escalation_reasons': dict(self.escalated),
+                'estimated_saved_ms': round(self.saved_ms, 1),
+            }
+
+
+hedge_stats = HedgeStats()
+cascade_stats = CascadeStats()
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def get_histogram(name):
+    """Process-wide latency histogram per provider name, so stats survive across engine instances."""
+    with _histograms_lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = LatencyHistogram()
+            _histograms[name] = histogram
+        return histogram
+
+
+def get_latency_stats():
+    with _histograms_lock:
+        histograms = dict(_histograms)
+    return {name: histogram.snapshot() for name, histogram in histograms.items()}
+
+
+def build_provider(spec, api_keys=None):
+    """
+    Build a provider from a 'vendor:model' spec, e.g. 'anthropic:claude-3-5-haiku-latest'.
+    Returns None when the vendor has no API key configured.
+    """
+    vendor, _, model = spec.strip().partition(':')
+    provider_class = PROVIDER_CLASSES.get(vendor)
+    if provider_class is None or not model:
+        raise ValueError(f"Invalid AI provider spec: {spec!r}")
+
+    api_keys = api_keys or {}
+    api_key = api_keys.get(vendor) or getattr(settings, f'{vendor.upper()}_API_KEY', None)
+    if not api_key:
+        return None
+    return provider_class(model, api_key)
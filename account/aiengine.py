@@ -1,15 +1,94 @@
-import openai
+import asyncio
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+
+from .ai_providers import (
+    OpenAIProvider,
+    build_provider,
+    cascade_stats,
+    get_latency_stats,
+    get_pool_stats,
+    hedge_stats,
+)
+from .decision_cache import decision_fingerprint, get_decision_cache
+from .prescreen import get_prescreen_stats, prescreen, rule_lean
+from .resilience import get_breaker_stats
+
+
+class DecisionUnavailable(Exception):
+    """
+    The model could not answer in time: upstream error or timeout, request
+    deadline exhausted, or circuit breaker open. Callers fall back to their
+    own default decision instead of treating this as a denial.
+    """
+
+
+_hedge_executor = None
+_hedge_executor_lock = threading.Lock()
+
+
+def _get_hedge_executor():
+    """Threads that run provider calls when a request may be hedged."""
+    global _hedge_executor
+    if _hedge_executor is None:
+        with _hedge_executor_lock:
+            if _hedge_executor is None:
+                _hedge_executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'AI_HEDGE_MAX_WORKERS', 32),
+                    thread_name_prefix='ai-hedge',
+                )
+    return _hedge_executor
+
 
 class PreApprovalEngine:
     """
     AI-Powered Pre-Approval Engine using OpenAI GPT.
     Returns "approve" or "disapprove" based on user and Plaid financial data.
+
+    The primary provider is OpenAI `model`. Alternates from AI_HEDGE_PROVIDERS
+    (or `hedge_providers`) get a hedged copy of the request when the primary
+    has not answered within its recent p95 latency, or fails outright.
+
+    When the cascade is on for `endpoint` (AI_CASCADE_ENDPOINTS, or `cascade`
+    passed explicitly) the small AI_CASCADE_MODEL answers first and only
+    low-confidence answers, or ones the rule check disagrees with, escalate
+    to `model`.
     """
 
-    def __init__(self, openai_api_key: str, model: str = "gpt-4"):
+    def __init__(self, openai_api_key: str, model: str = "gpt-4", timeout: float = None, hedge_providers: list = None,
+                 endpoint: str = None, cascade: bool = None):
         self.api_key = openai_api_key
         self.model = model
-        openai.api_key = self.api_key
+        self.timeout = timeout if timeout is not None else getattr(settings, 'OPENAI_TIMEOUT', 30.0)
+        self.provider = OpenAIProvider(model, openai_api_key)
+
+        if cascade is None:
+            cascade = endpoint in getattr(settings, 'AI_CASCADE_ENDPOINTS', [])
+        cascade_model = getattr(settings, 'AI_CASCADE_MODEL', 'gpt-4o-mini')
+        self.small_provider = OpenAIProvider(cascade_model, openai_api_key) if cascade and cascade_model != model else None
+        # A cascade may answer with the small model, so its decisions are fingerprinted apart
+        self.decision_model = f"{cascade_model}>{model}" if self.small_provider else model
+
+        if hedge_providers is None:
+            hedge_providers = getattr(settings, 'AI_HEDGE_PROVIDERS', [])
+        alternates = [build_provider(spec, {'openai': openai_api_key}) for spec in hedge_providers]
+        self.alternates = [provider for provider in alternates if provider is not None]
+
+    @staticmethod
+    def stats():
+        """Runtime metrics for the engine, exposed by the AI engine stats endpoint."""
+        return {
+            'http_pools': get_pool_stats(),
+            'decision_cache': get_decision_cache().stats(),
+            'prescreen': get_prescreen_stats(),
+            'circuit_breakers': get_breaker_stats(),
+            'provider_latency': get_latency_stats(),
+            'hedging': hedge_stats.snapshot(),
+            'cascade': cascade_stats.snapshot(),
+        }
 
     def _safe_float(self, value):
         """Convert numbers like '$455,000' into float."""
@@ -18,24 +97,56 @@ class PreApprovalEngine:
         except:
             return 0.0
 
-    def analyze(self, user_input: dict, plaid_data: dict) -> str:
+    def _financial_inputs(self, user_input: dict, plaid_data: dict) -> dict:
+        """Normalized numbers the prompt and the decision cache key depend on."""
+        return {
+            'annual_income': self._safe_float(plaid_data["loan_application"].get("annual_income")),
+            'purchase_price': self._safe_float(plaid_data["loan_application"].get("purchase_price")),
+            'down_payment': self._safe_float(plaid_data["loan_application"].get("down_payment")),
+            'liquid_assets': self._safe_float(plaid_data.get("total_balance", "0")),
+            'loan_purpose': user_input.get('loan_purpose'),
+        }
+
+    def fingerprint(self, user_input: dict, plaid_data: dict) -> str:
+        """Key of the inputs a decision depends on; equal fingerprints get equal decisions."""
+        return decision_fingerprint(self._financial_inputs(user_input, plaid_data), self.decision_model)
+
+    @staticmethod
+    def _rules_decision(inputs: dict):
+        if getattr(settings, 'AI_PRESCREEN_ENABLED', True):
+            return prescreen(inputs)
+        return None
+
+    def _local_decision(self, inputs: dict, fingerprint: str):
         """
-        Returns 'approve' or 'disapprove'.
+        Answer without the model when possible.
+        Returns (decision, source); decision is None when the model is needed.
         """
+        fast_decision = self._rules_decision(inputs)
+        if fast_decision is not None:
+            return fast_decision, 'rules'
+
+        return get_decision_cache().get(fingerprint), 'cache'
 
-        # Extract numbers safely
-        annual_income = self._safe_float(plaid_data["loan_application"].get("annual_income"))
-        purchase_price = self._safe_float(plaid_data["loan_application"].get("purchase_price"))
-        down_payment = self._safe_float(plaid_data["loan_application"].get("down_payment"))
-        liquid_assets = self._safe_float(plaid_data.get("total_balance", "0"))
+    async def _local_decision_async(self, inputs: dict, fingerprint: str):
+        """Async counterpart of _local_decision; the shared cache is read without blocking the loop."""
+        fast_decision = self._rules_decision(inputs)
+        if fast_decision is not None:
+            return fast_decision, 'rules'
+
+        return await get_decision_cache().aget(fingerprint), 'cache'
+
+    def _build_prompt(self, user_input: dict, inputs: dict) -> str:
+        annual_income = inputs['annual_income']
+        purchase_price = inputs['purchase_price']
+        down_payment = inputs['down_payment']
+        liquid_assets = inputs['liquid_assets']
 
         # Derived metrics
         monthly_income = annual_income / 12 if annual_income > 0 else 0
         down_payment_percentage = (down_payment / purchase_price * 100) if purchase_price > 0 else 0
 
-
-        # Build prompt with correct fields
-        prompt = f"""
+        return f"""
 You are a professional mortgage advisor.
 Given the following user financial information, decide if the mortgage should be approved or disapproved.
 Return ONLY one word: "approve" or "disapprove".
@@ -63,19 +174,229 @@ Down Payment Percentage: {down_payment_percentage}%
 Liquid Assets: {liquid_assets}
 """
 
+    def _call_timeout(self, timeout: float = None, deadline=None) -> float:
+        """
+        Per-call timeout: the configured timeout, shrunk to what is left of the
+        request's deadline after reserving time to render the response.
+        """
+        timeout = timeout if timeout is not None else self.timeout
+        if deadline is not None:
+            timeout = deadline.timeout(cap=timeout, reserve=getattr(settings, 'AI_DEADLINE_RESERVE_SECONDS', 2.0))
+            if timeout <= 0:
+                raise DecisionUnavailable("Request deadline exhausted before calling the model")
+        return timeout
+
+    def _hedge_delay(self) -> float:
+        """Seconds to wait for the primary before hedging: its recent p95, once there is enough data."""
+        histogram = self.provider.histogram
+        if histogram.sample_count() >= getattr(settings, 'AI_HEDGE_MIN_SAMPLES', 20):
+            delay = histogram.percentile(95) / 1000
+        else:
+            delay = getattr(settings, 'AI_HEDGE_DEFAULT_DELAY', 2.0)
+        return max(delay, getattr(settings, 'AI_HEDGE_MIN_DELAY', 0.25))
+
+    def _hedging_enabled(self) -> bool:
+        return bool(self.alternates) and getattr(settings, 'AI_HEDGE_ENABLED', True)
+
+    def _ask(self, prompt: str, timeout: float):
+        """
+        Get (answer_text, provider_name) from the model, hedging to alternates when enabled.
+        Raises DecisionUnavailable if no provider answers within `timeout`.
+        """
+        hedge_stats.record_request()
+        if not self._hedging_enabled():
+            try:
+                text, _ = self.provider.call(prompt, timeout)
+                return text, self.provider.name
+            except Exception as e:
+                raise DecisionUnavailable(f"Model call failed: {e}") from e
+
+        executor = _get_hedge_executor()
+        started = time.monotonic()
+        alternates = list(self.alternates)
+        pending = {executor.submit(self.provider.call, prompt, timeout): self.provider}
+        errors = []
+
+        while pending:
+            remaining = timeout - (time.monotonic() - started)
+            if remaining <= 0:
+                break
+            wait_for = min(self._hedge_delay(), remaining) if alternates else remaining
+            done, _ = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                provider = pending.pop(future)
+                try:
+                    text, _ = future.result()
+                except Exception as e:
+                    errors.append(f"{provider.name}: {e}")
+                    continue
+                hedge_stats.record_win(provider.name)
+                return text, provider.name
+
+            # Nothing answered within the hedge delay, or everything in flight failed: launch the next alternate
+            if alternates and (not done or not pending):
+                alternate = alternates.pop(0)
+                pending[executor.submit(alternate.call, prompt, remaining)] = alternate
+                hedge_stats.record_hedge()
+
+        raise DecisionUnavailable("; ".join(errors) or f"No model answered within {timeout:.1f}s")
+
+    async def _ask_async(self, prompt: str, timeout: float):
+        """Async counterpart of _ask; losing hedged calls are cancelled."""
+        hedge_stats.record_request()
+        if not self._hedging_enabled():
+            try:
+                text, _ = await self.provider.acall(prompt, timeout)
+                return text, self.provider.name
+            except Exception as e:
+                raise DecisionUnavailable(f"Model call failed: {e}") from e
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        alternates = list(self.alternates)
+        pending = {asyncio.ensure_future(self.provider.acall(prompt, timeout)): self.provider}
+        errors = []
+
+        try:
+            while pending:
+                remaining = timeout - (loop.time() - started)
+                if remaining <= 0:
+                    break
+                wait_for = min(self._hedge_delay(), remaining) if alternates else remaining
+                done, _ = await asyncio.wait(pending, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    provider = pending.pop(task)
+                    try:
+                        text, _ = task.result()
+                    except Exception as e:
+                        errors.append(f"{provider.name}: {e}")
+                        continue
+                    hedge_stats.record_win(provider.name)
+                    return text, provider.name
+
+                if alternates and (not done or not pending):
+                    alternate = alternates.pop(0)
+                    pending[asyncio.ensure_future(alternate.acall(prompt, remaining))] = alternate
+                    hedge_stats.record_hedge()
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise DecisionUnavailable("; ".join(errors) or f"No model answered within {timeout:.1f}s")
+
+    def _small_model_timeout(self, timeout: float) -> float:
+        return min(timeout, getattr(settings, 'AI_CASCADE_TIMEOUT', 5.0))
+
+    def _judge_small_answer(self, text: str, confidence, inputs: dict, elapsed: float):
+        """Return the small model's decision if it can stand, or None to escalate."""
+        decision = (text or "").strip().lower()
+        if decision not in ["approve", "disapprove"]:
+            reason = 'invalid_answer'
+        elif confidence is None or confidence < getattr(settings, 'AI_CASCADE_MIN_CONFIDENCE', 0.90):
+            reason = 'low_confidence'
+        elif decision != rule_lean(inputs):
+            reason = 'disagrees_with_rules'
+        else:
+            # Saved: what the primary model typically takes, minus what the small one took
+            histogram = self.provider.histogram
+            primary_ms = histogram.percentile(50) if histogram.sample_count() else 0.0
+            cascade_stats.record_accepted(primary_ms - elapsed * 1000)
+            return decision
+
+        cascade_stats.record_escalated(reason)
+        return None
+
+    def _ask_small_model(self, prompt: str, inputs: dict, timeout: float):
+        started = time.perf_counter()
+        try:
+            text, confidence = self.small_provider.call(prompt, self._small_model_timeout(timeout), logprobs=True)
+        except Exception:
+            cascade_stats.record_escalated('error')
+            return None
+        return self._judge_small_answer(text, confidence, inputs, time.perf_counter() - started)
+
+    async def _ask_small_model_async(self, prompt: str, inputs: dict, timeout: float):
+        started = time.perf_counter()
         try:
-            response = openai.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0,
-                max_tokens=5
-            )
-
-            result = response.choices[0].message.content.strip().lower()
-            if result not in ["approve", "disapprove"]:
-                return "disapprove"
-            return result
-
-        except Exception as e:
-            print(f"Error in PreApprovalEngine: {e}")
+            text, confidence = await self.small_provider.acall(prompt, self._small_model_timeout(timeout), logprobs=True)
+        except Exception:
+            cascade_stats.record_escalated('error')
+            return None
+        return self._judge_small_answer(text, confidence, inputs, time.perf_counter() - started)
+
+    @staticmethod
+    def _valid_answer(text: str):
+        result = (text or "").strip().lower()
+        return result if result in ["approve", "disapprove"] else None
+
+    def _parse_response(self, text: str, cache_key: str) -> str:
+        result = self._valid_answer(text)
+        if result is None:
+            return "disapprove"
+        get_decision_cache().set(cache_key, result)
+        return result
+
+    async def _parse_response_async(self, text: str, cache_key: str) -> str:
+        result = self._valid_answer(text)
+        if result is None:
             return "disapprove"
+        await get_decision_cache().aset(cache_key, result)
+        return result
+
+    def analyze_with_details(self, user_input: dict, plaid_data: dict, timeout: float = None, deadline=None) -> dict:
+        """
+        Decide and report how: {'decision', 'source', 'fingerprint'}, where
+        source is 'rules', 'cache' or the 'vendor:model' that answered.
+        Clear-cut cases are decided by the local rule pre-screen and identical
+        financial inputs are answered from the decision cache; only the rest
+        reach the model (the small cascade model first, where enabled).
+        Raises DecisionUnavailable when the model cannot answer within
+        `timeout` / the request `deadline`, or while the breaker is open.
+        """
+        inputs = self._financial_inputs(user_input, plaid_data)
+        fingerprint = decision_fingerprint(inputs, self.decision_model)
+        decision, source = self._local_decision(inputs, fingerprint)
+
+        if decision is None:
+            prompt = self._build_prompt(user_input, inputs)
+            text = None
+            if self.small_provider is not None:
+                text = self._ask_small_model(prompt, inputs, self._call_timeout(timeout, deadline))
+                source = self.small_provider.name
+            if text is None:
+                text, source = self._ask(prompt, self._call_timeout(timeout, deadline))
+            decision = self._parse_response(text, fingerprint)
+
+        return {'decision': decision, 'source': source, 'fingerprint': fingerprint}
+
+    async def analyze_with_details_async(self, user_input: dict, plaid_data: dict, timeout: float = None,
+                                         deadline=None) -> dict:
+        """
+        Non-blocking variant of analyze_with_details() for async views.
+        The worker's event loop keeps serving other requests while the model answers.
+        """
+        inputs = self._financial_inputs(user_input, plaid_data)
+        fingerprint = decision_fingerprint(inputs, self.decision_model)
+        decision, source = await self._local_decision_async(inputs, fingerprint)
+
+        if decision is None:
+            prompt = self._build_prompt(user_input, inputs)
+            text = None
+            if self.small_provider is not None:
+                text = await self._ask_small_model_async(prompt, inputs, self._call_timeout(timeout, deadline))
+                source = self.small_provider.name
+            if text is None:
+                text, source = await self._ask_async(prompt, self._call_timeout(timeout, deadline))
+            decision = await self._parse_response_async(text, fingerprint)
+
+        return {'decision': decision, 'source': source, 'fingerprint': fingerprint}
+
+    def analyze(self, user_input: dict, plaid_data: dict, timeout: float = None, deadline=None) -> str:
+        """Returns 'approve' or 'disapprove'; see analyze_with_details()."""
+        return self.analyze_with_details(user_input, plaid_data, timeout, deadline)['decision']
+
+    async def analyze_async(self, user_input: dict, plaid_data: dict, timeout: float = None, deadline=None) -> str:
+        """Non-blocking variant of analyze() for async views."""
+        return (await self.analyze_with_details_async(user_input, plaid_data, timeout, deadline))['decision']
@@ -0,0 +1,258 @@
+"""
+Asset Reports for connected items (the product our link tokens request).
+A report is created right after the bank is connected; Plaid builds it
+asynchronously and says so with an ASSETS webhook, with a backoff poller
+as the fallback. The finished report is stored, and the PDF and decision
+endpoints read accounts and transactions from it instead of calling Plaid
+until it is older than PLAID_ASSET_REPORT_MAX_AGE; then a new one is requested.
+"""
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .account_snapshots import get_account_snapshot
+from .models import AssetReport, PlaidConnection
+from .plaid_rate_limits import is_retryable, plaid_error
+from .plaid_service import PlaidService
+
+logger = logging.getLogger(__name__)
+
+_poll_executor = None
+_fetch_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_poll_executor():
+    """Pollers sleep between checks, so they get threads of their own."""
+    global _poll_executor
+    if _poll_executor is None:
+        with _executor_lock:
+            if _poll_executor is None:
+                _poll_executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'PLAID_ASSET_REPORT_POLL_WORKERS', 4),
+                    thread_name_prefix='asset-report-poll',
+                )
+    return _poll_executor
+
+
+def _get_fetch_executor():
+    """Webhook-triggered downloads and report renewals; never queued behind sleeping pollers."""
+    global _fetch_executor
+    if _fetch_executor is None:
+        with _executor_lock:
+            if _fetch_executor is None:
+                _fetch_executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'PLAID_ASSET_REPORT_FETCH_WORKERS', 2),
+                    thread_name_prefix='asset-report-fetch',
+                )
+    return _fetch_executor
+
+
+def _is_current(report):
+    max_age = timedelta(seconds=getattr(settings, 'PLAID_ASSET_REPORT_MAX_AGE', 86400))
+    return report.completed_at is not None and timezone.now() - report.completed_at < max_age
+
+
+def request_asset_report(plaid_connection, plaid_service=None):
+    """
+    Create an Asset Report for the connection's current item, unless one is
+    already pending or ready and within PLAID_ASSET_REPORT_MAX_AGE, and start
+    the poller that waits for it. Returns the AssetReport.
+    """
+    existing = plaid_connection.asset_reports.filter(
+        item_id=plaid_connection.item_id, status__in=['pending', 'ready']
+    ).first()
+    if existing is not None and (existing.status == 'pending' or _is_current(existing)):
+        return existing
+
+    plaid_service = plaid_service or PlaidService()
+    created = plaid_service.create_asset_report(
+        plaid_connection.access_token,
+        getattr(settings, 'PLAID_ASSET_REPORT_DAYS', 60),
+        webhook=getattr(settings, 'PLAID_WEBHOOK_URL', None),
+    )
+    report = AssetReport.objects.create(
+        connection=plaid_connection,
+        item_id=plaid_connection.item_id,
+        asset_report_id=created['asset_report_id'],
+        asset_report_token=created['asset_report_token'],
+        days_requested=getattr(settings, 'PLAID_ASSET_REPORT_DAYS', 60),
+    )
+    logger.info(f"Requested asset report {report.asset_report_id} for item {report.item_id}")
+    _get_poll_executor().submit(poll_asset_report, report.id)
+    return report
+
+
+def fetch_asset_report(report, plaid_service=None):
+    """
+    Try to download a pending report. True once it is stored (or has failed
+    for good); False if Plaid is still building it or the call should be retried.
+    """
+    plaid_service = plaid_service or PlaidService()
+    try:
+        data = plaid_service.get_asset_report(report.asset_report_token)
+    except Exception as e:
+        # Only a definite Plaid error fails the report; timeouts, queueing etc. are tried again later
+        not_ready = plaid_error(e).get('error_code') == 'PRODUCT_NOT_READY'
+        if getattr(e, 'status', None) is None or not_ready or is_retryable(e):
+            return False
+        _mark_failed(report, str(e))
+        return True
+
+    # Another poller/webhook may have stored it meanwhile; either copy is fine
+    AssetReport.objects.filter(id=report.id).update(status='ready', report=data, completed_at=timezone.now())
+    report.refresh_from_db()
+    logger.info(f"Asset report {report.asset_report_id} ready")
+    _on_ready(report)
+    return True
+
+
+def _mark_failed(report, error):
+    logger.error(f"Asset report {report.asset_report_id} failed: {error}")
+    AssetReport.objects.filter(id=report.id, status='pending').update(status='failed', error=error, completed_at=timezone.now())
+
+
+def _on_ready(report):
+    # Recompute the stored decision from the report, so the PDF step finds it ready
+    from .warmup import schedule_warm_up
+
+    schedule_warm_up(report.connection_id)
+
+
+def poll_asset_report(report_id):
+    """
+    Wait for a report with exponential backoff (plus jitter) until it is
+    stored or PLAID_ASSET_REPORT_POLL_TIMEOUT passes. With webhooks set up
+    the first check waits PLAID_ASSET_REPORT_WEBHOOK_GRACE seconds, since
+    the ASSETS webhook normally gets there first.
+    """
+    webhooks = bool(getattr(settings, 'PLAID_WEBHOOK_URL', None))
+    delay = getattr(settings, 'PLAID_ASSET_REPORT_WEBHOOK_GRACE', 120.0) if webhooks \
+        else getattr(settings, 'PLAID_ASSET_REPORT_POLL_INITIAL_DELAY', 5.0)
+    max_delay = getattr(settings, 'PLAID_ASSET_REPORT_POLL_MAX_DELAY', 60.0)
+    give_up_at = time.monotonic() + getattr(settings, 'PLAID_ASSET_REPORT_POLL_TIMEOUT', 900.0)
+
+    try:
+        while True:
+            time.sleep(delay)
+            report = AssetReport.objects.filter(id=report_id, status='pending').first()
+            if report is None or fetch_asset_report(report):
+                return
+            if time.monotonic() >= give_up_at:
+                _mark_failed(report, 'Timed out waiting for the report')
+                return
+            delay = min(delay * 2, max_delay) * random.uniform(0.8, 1.2)
+            # Don't hold a DB connection while sleeping
+            connection.close()
+    except Exception as e:
+        logger.warning(f"Polling asset report {report_id} failed: {e}")
+    finally:
+        connection.close()
+
+
+def handle_asset_report_webhook(payload):
+    """ASSETS webhooks: PRODUCT_READY downloads the report in the background, ERROR marks it failed."""
+    report = AssetReport.objects.filter(asset_report_id=payload.get('asset_report_id')).first()
+    if report is None:
+        logger.warning(f"ASSETS webhook for unknown report {payload.get('asset_report_id')}")
+        return 'unknown_report'
+    if report.status != 'pending':
+        return 'ignored'
+
+    if payload.get('webhook_code') == 'PRODUCT_READY':
+        _get_fetch_executor().submit(_fetch_in_background, report.id)
+        return 'fetching'
+    if payload.get('webhook_code') == 'ERROR':
+        error = payload.get('error') or {}
+        _mark_failed(report, error.get('error_message') or error.get('error_code') or 'Plaid reported an error')
+        return 'failed'
+    return 'ignored'
+
+
+def _fetch_in_background(report_id):
+    try:
+        report = AssetReport.objects.filter(id=report_id, status='pending').first()
+        if report is not None and not fetch_asset_report(report):
+            # Ready per the webhook but not downloadable yet; fall back to polling
+            _get_poll_executor().submit(poll_asset_report, report_id)
+    except Exception as e:
+        logger.warning(f"Fetching asset report {report_id} failed: {e}")
+    finally:
+        connection.close()
+
+
+def _renew_in_background(connection_id):
+    try:
+        request_asset_report(PlaidConnection.objects.get(id=connection_id))
+    except Exception as e:
+        logger.warning(f"Renewing the asset report of Plaid connection {connection_id} failed: {e}")
+    finally:
+        connection.close()
+
+
+def latest_ready_report(plaid_connection):
+    return plaid_connection.asset_reports.filter(item_id=plaid_connection.item_id, status='ready').first()
+
+
+def report_accounts(report):
+    """Accounts in the report, shaped like /accounts/get accounts (balances as of the report)."""
+    return [
+        {name: value for name, value in account.items() if name not in ('transactions', 'historical_balances', 'owners')}
+        for item in report.report.get('items', [])
+        for account in item.get('accounts', [])
+    ]
+
+
+def report_transactions(report):
+    """All transactions in the report, newest first."""
+    transactions = [
+        transaction
+        for item in report.report.get('items', [])
+        for account in item.get('accounts', [])
+        for transaction in account.get('transactions', [])
+    ]
+    return sorted(transactions, key=lambda transaction: transaction.get('date') or '', reverse=True)
+
+
+def get_financial_data(plaid_connection, fresh=False, plaid_service=None):
+    """
+    (accounts, transactions, age_seconds) for the PDF and decision endpoints.
+    From the item's stored Asset Report while it is within PLAID_ASSET_REPORT_MAX_AGE
+    (no Plaid call); otherwise, or with `fresh`, live accounts from the account
+    snapshot and no transactions. An expired report is renewed in the background.
+    """
+    if not fresh:
+        report = latest_ready_report(plaid_connection)
+        if report is not None and _is_current(report):
+            age = round((timezone.now() - report.completed_at).total_seconds(), 1)
+            return report_accounts(report), report_transactions(report), age
+        if report is not None and getattr(settings, 'PLAID_ASSET_REPORTS', True):
+            _get_fetch_executor().submit(_renew_in_background, plaid_connection.id)
+
+    accounts, age = get_account_snapshot(plaid_connection, fresh=fresh, plaid_service=plaid_service)
+    return accounts, [], age
+
+
+def get_combined_financial_data(plaid_connections, fresh=False, plaid_service=None, deadline=None):
+    """
+    get_financial_data across all of an application's connections, fetched
+    concurrently: accounts of every item, transactions merged newest first,
+    and the age of the oldest data.
+    """
+    plaid_service = plaid_service or PlaidService()
+    results = plaid_service.fetch_per_connection(
+        plaid_connections, get_financial_data, fresh, plaid_service, deadline=deadline
+    )
+    accounts = [account for item_accounts, _, _ in results for account in item_accounts]
+    transactions = sorted(
+        (transaction for _, item_transactions, _ in results for transaction in item_transactions),
+        key=lambda transaction: transaction.get('date') or '', reverse=True,
+    )
+    return accounts, transactions, max(age for _, _, age in results)
@@ -0,0 +1,163 @@
+# Async decision/PDF views - served without blocking a worker when run under core/asgi.py
+import json
+import logging
+import os
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+
+from .account_snapshots import wants_fresh
+from .asset_reports import get_combined_financial_data
+from .aiengine import PreApprovalEngine
+from .decisions import bank_analysis_inputs, direct_analysis_inputs, stored_decision_async
+from .models import LoanApplication
+from .views import BankDataAnalysisPDFView, GeneratePDFFromBankDataView
+
+logger = logging.getLogger(__name__)
+
+
+def _json_body(request):
+    try:
+        return json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+
+
+async def _run_blocking(func, *args):
+    """Run blocking work (Plaid SDK, reportlab) in a worker thread, off the event loop."""
+    return await sync_to_async(func, thread_sensitive=False)(*args)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncBankDataAnalysisPDFView(View):
+    """
+    Async version of BankDataAnalysisPDFView.
+    Same request and response; the OpenAI call is awaited so one worker can
+    keep many decisions in flight.
+    """
+
+    async def post(self, request):
+        try:
+            data = _json_body(request)
+            if data is None:
+                return JsonResponse({'error': 'Request body must be valid JSON'}, status=400)
+
+            loan_id = data.get('loan_application_id')
+            if not loan_id:
+                return JsonResponse({'error': 'loan_application_id is required'}, status=400)
+
+            try:
+                loan = await LoanApplication.objects.aget(id=loan_id)
+            except LoanApplication.DoesNotExist:
+                return JsonResponse({'error': 'Loan application not found'}, status=404)
+
+            plaid_connections = [plaid_connection async for plaid_connection in loan.plaid_connections.all()]
+            if not plaid_connections:
+                return JsonResponse({'error': 'No Plaid connection found for this loan'}, status=404)
+
+            # Fetch Plaid data of every connected bank concurrently
+            # (stored Asset Report, else account snapshot; ?fresh=1 refetches)
+            try:
+                accounts, transactions, snapshot_age = await _run_blocking(partial(
+                    get_combined_financial_data, plaid_connections, wants_fresh(request),
+                    deadline=getattr(request, 'deadline', None),
+                ))
+            except Exception as e:
+                logger.error(f"Error fetching Plaid data: {e}")
+                return JsonResponse({'error': f'Failed to fetch Plaid data: {str(e)}'}, status=500)
+
+            user_input, plaid_data = bank_analysis_inputs(loan, accounts, transactions)
+
+            # Perform AI analysis
+            try:
+                engine = PreApprovalEngine(
+                    openai_api_key=os.getenv('OPENAI_API_KEY'),
+                    endpoint='bank_analysis_pdf'
+                )
+                decision = await stored_decision_async(
+                    loan, engine, user_input, plaid_data, deadline=getattr(request, 'deadline', None)
+                )
+            except Exception as e:
+                logger.warning(f"AI analysis failed: {e}")
+                decision = 'pending'
+
+            pdf_content = await _run_blocking(
+                BankDataAnalysisPDFView()._generate_analysis_pdf, user_input, plaid_data, decision
+            )
+
+            return HttpResponse(
+                pdf_content,
+                content_type='application/pdf',
+                headers={
+                    'Content-Disposition': f'attachment; filename="loan_analysis_{loan.id}.pdf"',
+                    'X-Snapshot-Age': str(snapshot_age),
+                }
+            )
+
+        except Exception as e:
+            logger.error(f"Error in AsyncBankDataAnalysisPDFView: {e}")
+            return JsonResponse({'error': str(e)}, status=500)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncGeneratePDFFromBankDataView(View):
+    """Async version of GeneratePDFFromBankDataView"""
+
+    async def post(self, request):
+        try:
+            data = _json_body(request)
+            if data is None:
+                return JsonResponse({'error': 'Request body must be valid JSON'}, status=400)
+
+            loan_id = data.get('loan_application_id')
+            loan_data = data.get('loan_application')
+            bank_accounts = data.get('bank_accounts', [])
+            total_balance = data.get('total_balance', '$0.00')
+
+            # Validate required fields
+            if not all([loan_id, loan_data, bank_accounts]):
+                return JsonResponse(
+                    {'error': 'Missing required fields: loan_application_id, loan_application, bank_accounts'},
+                    status=400
+                )
+
+            user_input, plaid_data = direct_analysis_inputs(loan_id, loan_data, bank_accounts, total_balance)
+
+            # Perform AI analysis
+            try:
+                api_key = os.getenv('OPENAI_API_KEY')
+                if not api_key:
+                    logger.error("OPENAI_API_KEY not found in environment!")
+                    decision = 'pending'
+                else:
+                    engine = PreApprovalEngine(
+                        openai_api_key=api_key,
+                        endpoint='generate_pdf_from_data'
+                    )
+                    # The figures are client-posted, not fetched from Plaid: decide without storing
+                    # a Decision against the loan application
+                    decision = await stored_decision_async(
+                        None, engine, user_input, plaid_data, deadline=getattr(request, 'deadline', None)
+                    )
+                    logger.info(f"✅ AI Decision for loan {loan_id}: {decision}")
+            except Exception as e:
+                logger.error(f"❌ AI analysis failed: {str(e)}", exc_info=True)
+                decision = 'pending'
+
+            pdf_content = await _run_blocking(
+                GeneratePDFFromBankDataView()._generate_analysis_pdf, user_input, plaid_data, decision
+            )
+
+            return HttpResponse(
+                pdf_content,
+                content_type='application/pdf',
+                headers={'Content-Disposition': f'attachment; filename="loan_analysis_{loan_id}.pdf"'}
+            )
+
+        except Exception as e:
+            logger.error(f"Error in AsyncGeneratePDFFromBankDataView: {e}")
+            return JsonResponse({'error': f'Failed to generate PDF: {str(e)}'}, status=500)
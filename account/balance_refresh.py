@@ -0,0 +1,155 @@
+"""
+Bulk balance refresh for every (or a filtered set of) PlaidConnection,
+used by the refresh_balances management command for portfolio reporting.
+Each connection's balances are stored as a BalanceSnapshot as soon as they
+arrive; those rows are also the checkpoint an interrupted run resumes from.
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import connection
+from django.utils import timezone
+
+from .account_snapshots import store_account_snapshot
+from .models import BalanceRefreshRun, BalanceSnapshot, PlaidConnection
+from .plaid_archive import archiving_for
+from .plaid_rate_limits import rate_limits
+from .plaid_service import PlaidService
+
+logger = logging.getLogger(__name__)
+
+BALANCE_ENDPOINTS = {True: '/accounts/balance/get', False: '/accounts/get'}
+
+
+def select_connections(filters):
+    """
+    Connections matching a run's filters, in id order:
+      loan_ids       - only these loan applications
+      created_after  - connections made on/after this ISO date
+      stale_minutes  - skip connections with a snapshot newer than this
+    The run's `limit` is applied by run_balance_refresh, after leaving out
+    connections the run has already refreshed.
+    """
+    queryset = PlaidConnection.objects.order_by('id')
+    if filters.get('loan_ids'):
+        queryset = queryset.filter(loan_application_id__in=filters['loan_ids'])
+    if filters.get('created_after'):
+        queryset = queryset.filter(created_at__date__gte=filters['created_after'])
+    if filters.get('stale_minutes'):
+        fresh_since = timezone.now() - timedelta(minutes=filters['stale_minutes'])
+        queryset = queryset.exclude(balance_snapshots__fetched_at__gte=fresh_since)
+    return queryset
+
+
+def _balances(accounts):
+    return [
+        {
+            'account_id': account['account_id'],
+            'name': account.get('name'),
+            'type': str(account.get('type')),
+            'subtype': str(account.get('subtype') or ''),
+            'mask': account.get('mask'),
+            'current': account['balances'].get('current'),
+            'available': account['balances'].get('available'),
+            'limit': account['balances'].get('limit'),
+            'iso_currency_code': account['balances'].get('iso_currency_code'),
+        }
+        for account in accounts
+    ]
+
+
+def refresh_connection(connection_id, run_id, realtime=True, rate_limit=None):
+    """
+    Fetch one connection's balances and store them as a snapshot of the run.
+    `realtime` uses /accounts/balance/get (asks the bank now); otherwise
+    /accounts/get (Plaid's cached balances, cheaper). `rate_limit` (calls per
+    minute) replaces the configured limit of that endpoint. Errors are reported, not raised.
+    """
+    started = time.perf_counter()
+    limits = {BALANCE_ENDPOINTS[realtime]: rate_limit} if rate_limit is not None else {}
+    try:
+        plaid_connection = PlaidConnection.objects.get(id=connection_id)
+        plaid_service = PlaidService()
+        with rate_limits(limits), archiving_for(plaid_connection):
+            if realtime:
+                accounts = plaid_service.get_balances(plaid_connection.access_token)
+            else:
+                accounts = plaid_service.get_accounts(plaid_connection.access_token)
+        # Also refreshes the snapshot the bank details and PDF views read
+        accounts = store_account_snapshot(plaid_connection.item_id, accounts)
+
+        balances = _balances(accounts)
+        BalanceSnapshot.objects.create(
+            connection=plaid_connection,
+            run_id=run_id,
+            accounts=balances,
+            total_balance=sum((Decimal(str(account['current'] or 0)) for account in balances), Decimal('0')),
+        )
+        return {'latency_ms': round((time.perf_counter() - started) * 1000, 1)}
+    except Exception as e:
+        logger.error(f"Balance refresh failed for Plaid connection {connection_id}: {e}")
+        return {'error': str(e)}
+    finally:
+        # Pool threads keep their own DB connections; don't leak them
+        connection.close()
+
+
+def run_balance_refresh(run, workers=8, realtime=True, on_result=None, rate_limit=None):
+    """
+    Refresh the run's connections that don't have a snapshot in it yet, with
+    at most `workers` Plaid calls in flight (each still takes a token from the
+    endpoint's shared rate limit, `rate_limit` calls per minute if given). Counters are saved as results arrive.
+    On Ctrl-C, calls in flight finish, the rest are dropped and the run is
+    left 'interrupted' for a later resume. Returns this session's latencies (ms).
+    """
+    pending = select_connections(run.filters).exclude(balance_snapshots__run=run).values_list('id', flat=True)
+    if run.filters.get('limit'):
+        # The limit covers the whole run, including what a resumed run already refreshed
+        pending = pending[:max(run.filters['limit'] - run.snapshots.count(), 0)]
+    connection_ids = list(pending)
+    if not run.total:
+        run.total = len(connection_ids)
+    # On resume: snapshots are the source of truth (calls finishing during an interrupt
+    # stored theirs without being counted), and failed connections are tried again
+    run.succeeded = run.snapshots.count()
+    run.failed = 0
+    run.status = 'running'
+    run.save(update_fields=['total', 'succeeded', 'failed', 'status'])
+
+    latencies = []
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='balance-refresh')
+    try:
+        futures = {
+            executor.submit(refresh_connection, connection_id, run.id, realtime, rate_limit): connection_id
+            for connection_id in connection_ids
+        }
+        for future in as_completed(futures):
+            result = future.result()
+            if 'error' in result:
+                run.failed += 1
+            else:
+                run.succeeded += 1
+                latencies.append(result['latency_ms'])
+            run.save(update_fields=['succeeded', 'failed'])
+            if on_result:
+                on_result(futures[future], result)
+        run.status = 'completed'
+    except KeyboardInterrupt:
+        run.status = 'interrupted'
+        raise
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        run.finished_at = timezone.now()
+        run.save(update_fields=['status', 'finished_at'])
+        logger.info(
+            f"Balance refresh {run.id} {run.status}: {run.succeeded} refreshed, "
+            f"{run.failed} failed of {run.total}, {run.throughput()} connections/s"
+        )
+    return latencies
+
+
+def latest_unfinished_run():
+    return BalanceRefreshRun.objects.exclude(status='completed').order_by('-started_at').first()
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+def decision_fingerprint(inputs: dict, model: str) -> str:
+    """
+    Stable hash of the normalized financial inputs a decision depends on.
+    Amounts are rounded to cents so '$455,000' and '455000.00' collide.
+    """
+    normalized = {
+        'annual_income': round(float(inputs.get('annual_income') or 0), 2),
+        'purchase_price': round(float(inputs.get('purchase_price') or 0), 2),
+        'down_payment': round(float(inputs.get('down_payment') or 0), 2),
+        'liquid_assets': round(float(inputs.get('liquid_assets') or 0), 2),
+        'loan_purpose': str(inputs.get('loan_purpose') or '').strip().lower(),
+        'model': model,
+    }
+    payload = json.dumps(normalized, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class BaseDecisionCache:
+    """
+    Common hit/miss accounting; subclasses implement _get and _set.
+    aget/aset are for the event loop: in-process backends answer inline,
+    backends doing I/O override _aget/_aset.
+    """
+
+    def __init__(self, ttl=3600, max_entries=1024, **options):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _record(self, value):
+        with self._stats_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+    def get(self, key):
+        value = self._get(key)
+        self._record(value)
+        return value
+
+    def set(self, key, value):
+        self._set(key, value)
+
+    async def aget(self, key):
+        value = await self._aget(key)
+        self._record(value)
+        return value
+
+    async def aset(self, key, value):
+        await self._aset(key, value)
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _set(self, key, value):
+        raise NotImplementedError
+
+    async def _aget(self, key):
+        return self._get(key)
+
+    async def _aset(self, key, value):
+        self._set(key, value)
+
+    def stats(self):
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': self.__class__.__name__,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'ttl': self.ttl,
+            }
+
+
+class MemoryDecisionCache(BaseDecisionCache):
+    """Per-worker LRU cache with a TTL on every entry."""
+
+    def __init__(self, ttl=3600, max_entries=1024, **options):
+        super().__init__(ttl=ttl, max_entries=max_entries, **options)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        stats = super().stats()
+        with self._lock:
+            stats['entries'] = len(self._entries)
+        stats['max_entries'] = self.max_entries
+        return stats
+
+
+class SharedDecisionCache(BaseDecisionCache):
+    """
+    Stores decisions in a Django cache alias (Redis, Memcached, database...)
+    so every gunicorn worker shares them. Eviction is left to the backend.
+    """
+
+    key_prefix = 'ai-decision:'
+
+    def __init__(self, ttl=3600, max_entries=1024, alias='default', **options):
+        super().__init__(ttl=ttl, max_entries=max_entries, **options)
+        from django.core.cache import caches
+        self.cache = caches[alias]
+
+    def _get(self, key):
+        return self.cache.get(self.key_prefix + key)
+
+    def _set(self, key, value):
+        self.cache.set(self.key_prefix + key, value, timeout=self.ttl)
+
+    # Database and other blocking backends must not be called from the event loop
+    async def _aget(self, key):
+        return await self.cache.aget(self.key_prefix + key)
+
+    async def _aset(self, key, value):
+        await self.cache.aset(self.key_prefix + key, value, timeout=self.ttl)
+
+
+class NullDecisionCache(BaseDecisionCache):
+    """Disables caching while keeping the same interface."""
+
+    def _get(self, key):
+        return None
+
+    def _set(self, key, value):
+        pass
+
+
+BACKENDS = {
+    'memory': MemoryDecisionCache,
+    'shared': SharedDecisionCache,
+    'none': NullDecisionCache,
+}
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_decision_cache():
+    """Process-wide decision cache configured by the AI_DECISION_CACHE_* settings."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                backend = getattr(settings, 'AI_DECISION_CACHE_BACKEND', 'memory')
+                cache_class = BACKENDS.get(backend) or import_string(backend)
+                _cache = cache_class(
+                    ttl=getattr(settings, 'AI_DECISION_CACHE_TTL', 3600),
+                    max_entries=getattr(settings, 'AI_DECISION_CACHE_MAX_ENTRIES', 1024),
+                    alias=getattr(settings, 'AI_DECISION_CACHE_ALIAS', 'default'),
+                )
+    return _cache
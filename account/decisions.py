@@ -0,0 +1,411 @@
+"""
+Shared helpers for turning loan and bank data into AI engine inputs,
+storing decisions so they are reused until the inputs change, and for
+running decisions outside a single request (batches).
+Used by both the sync DRF views and the async decision views.
+"""
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .asset_reports import get_combined_financial_data
+from .aiengine import DecisionUnavailable, PreApprovalEngine
+from .models import Decision, DecisionBatch, DecisionLock, LoanApplication
+from .singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+def bank_analysis_inputs(loan, accounts, transactions=None):
+    """Build (user_input, plaid_data) for a stored loan and its Plaid accounts."""
+    transactions = transactions or []
+
+    user_input = {
+        'full_name': loan.full_name,
+        'email': loan.email,
+        'phone': loan.phone_number,
+        'property_address': loan.property_address,
+        'property_zip': loan.property_zip_code,
+        'loan_purpose': loan.loan_purpose,
+        'purchase_price': str(loan.purchase_price),
+        'down_payment': str(loan.down_payment),
+        'annual_income': str(loan.annual_income)
+    }
+
+    # Format Plaid data
+    bank_accounts = []
+    total_balance = 0
+
+    for account in accounts:
+        balance = account.get('balances', {}).get('current', 0) or 0
+        total_balance += balance if balance else 0
+        bank_accounts.append({
+            'account_id': account.get('account_id'),
+            'name': account.get('name'),
+            'type': account.get('type'),
+            'subtype': account.get('subtype'),
+            'balance': balance,
+            'currency': account.get('balances', {}).get('iso_currency_code', 'USD')
+        })
+
+    plaid_data = {
+        'loan_application': {
+            'id': loan.id,
+            'full_name': loan.full_name,
+            'email': loan.email,
+            'annual_income': str(loan.annual_income),
+            'purchase_price': str(loan.purchase_price),
+            'down_payment': str(loan.down_payment),
+            'loan_purpose': loan.loan_purpose
+        },
+        'bank_accounts': bank_accounts,
+        'total_balance': f"${total_balance:,.2f}",
+        'transaction_count': len(transactions)
+    }
+    return user_input, plaid_data
+
+
+def direct_analysis_inputs(loan_id, loan_data, bank_accounts, total_balance):
+    """Build (user_input, plaid_data) from a /plaid/connect/ response posted back by the client."""
+    user_input = {
+        'full_name': loan_data.get('full_name', 'Unknown'),
+        'email': loan_data.get('email', 'unknown@example.com'),
+        'phone': loan_data.get('phone_number', 'N/A'),
+        'property_address': loan_data.get('property_address', 'N/A'),
+        'property_zip': loan_data.get('property_zip_code', 'N/A'),
+        'loan_purpose': loan_data.get('loan_purpose', 'N/A'),
+        'purchase_price': str(loan_data.get('purchase_price', '0')),
+        'down_payment': str(loan_data.get('down_payment', '0')),
+        'annual_income': str(loan_data.get('annual_income', '0'))
+    }
+
+    # Format Plaid data
+    formatted_accounts = []
+    for account in bank_accounts:
+        formatted_accounts.append({
+            'account_id': account.get('account_id', 'N/A'),
+            'name': account.get('name', 'Unknown Account'),
+            'type': account.get('type', 'depository'),
+            'subtype': account.get('subtype', 'checking'),
+            'balance': account.get('current_balance', 0),
+            'currency': account.get('currency', 'USD')
+        })
+
+    plaid_data = {
+        'loan_application': {
+            'id': loan_id,
+            'full_name': loan_data.get('full_name', 'Unknown'),
+            'email': loan_data.get('email', 'unknown@example.com'),
+            'annual_income': str(loan_data.get('annual_income', '0')),
+            'purchase_price': str(loan_data.get('purchase_price', '0')),
+            'down_payment': str(loan_data.get('down_payment', '0')),
+            'loan_purpose': loan_data.get('loan_purpose', 'N/A')
+        },
+        'bank_accounts': formatted_accounts,
+        'total_balance': total_balance,
+        'transaction_count': 0  # No transactions available
+    }
+    return user_input, plaid_data
+
+
+_decision_flights = SingleFlight()
+_lock_owner = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def get_coalescing_stats():
+    return _decision_flights.snapshot()
+
+
+def _acquire_decision_lock(key):
+    """Take the cross-worker lock for `key`; False if another worker holds it."""
+    now = timezone.now()
+    DecisionLock.objects.filter(key=key, expires_at__lte=now).delete()
+    ttl = getattr(settings, 'AI_DECISION_LOCK_TTL', 60)
+    try:
+        with transaction.atomic():
+            DecisionLock.objects.create(key=key, owner=_lock_owner, expires_at=now + timedelta(seconds=ttl))
+    except IntegrityError:
+        return False
+    return True
+
+
+def _release_decision_lock(key):
+    DecisionLock.objects.filter(key=key, owner=_lock_owner).delete()
+
+
+def _lock_is_held(key):
+    return DecisionLock.objects.filter(key=key, expires_at__gt=timezone.now()).exists()
+
+
+def _find_stored(loan, fingerprint):
+    return Decision.objects.filter(loan_application=loan, fingerprint=fingerprint).first()
+
+
+def _record_decision(loan, details, started):
+    return Decision.objects.create(
+        loan_application=loan,
+        fingerprint=details['fingerprint'],
+        result=details['decision'],
+        model=details['source'],
+        latency_ms=round((time.perf_counter() - started) * 1000, 1),
+    )
+
+
+def _wait_seconds(engine, deadline):
+    """How long a caller may wait on someone else's in-flight decision."""
+    return deadline.remaining() if deadline is not None else engine.timeout
+
+
+def _decide_across_workers(loan, engine, user_input, plaid_data, fingerprint, deadline):
+    """
+    Decide once across gunicorn workers: the DecisionLock holder calls the
+    model and stores the result; other workers poll for the stored decision.
+    If the holder gives up without storing one, a waiter takes over the lock.
+    """
+    key = f"{loan.id}:{fingerprint}"
+    poll_interval = getattr(settings, 'AI_DECISION_LOCK_POLL_INTERVAL', 0.1)
+    wait_until = time.monotonic() + _wait_seconds(engine, deadline)
+    waited = False
+
+    while True:
+        if _acquire_decision_lock(key):
+            try:
+                # Another worker may have stored it between our last check and taking the lock
+                stored = _find_stored(loan, fingerprint)
+                if stored is not None:
+                    return stored.result
+                started = time.perf_counter()
+                details = engine.analyze_with_details(user_input, plaid_data, deadline=deadline)
+                _record_decision(loan, details, started)
+                return details['decision']
+            finally:
+                _release_decision_lock(key)
+
+        if not waited:
+            waited = True
+            _decision_flights.record_external_wait()
+        while _lock_is_held(key):
+            if time.monotonic() >= wait_until:
+                raise DecisionUnavailable(f"Timed out waiting for the in-flight decision for loan {loan.id}")
+            time.sleep(poll_interval)
+
+        stored = _find_stored(loan, fingerprint)
+        if stored is not None:
+            return stored.result
+
+
+def stored_decision(loan, engine, user_input, plaid_data, deadline=None):
+    """
+    The loan's stored decision for these inputs, or a fresh one from the
+    engine which is then stored. Without a loan (ad-hoc data) nothing is
+    stored. Raises what engine.analyze raises; failed decisions are not stored.
+
+    Concurrent calls for the same loan and inputs are coalesced: within the
+    process they share one in-flight call, and across workers they wait on
+    the DecisionLock holder instead of calling the model again.
+    """
+    if loan is None:
+        return engine.analyze(user_input, plaid_data, deadline=deadline)
+
+    fingerprint = engine.fingerprint(user_input, plaid_data)
+    stored = _find_stored(loan, fingerprint)
+    if stored is not None:
+        logger.info(f"Reusing stored decision for loan {loan.id}: {stored.result}")
+        return stored.result
+
+    try:
+        return _decision_flights.do(
+            f"{loan.id}:{fingerprint}",
+            lambda: _decide_across_workers(loan, engine, user_input, plaid_data, fingerprint, deadline),
+            timeout=_wait_seconds(engine, deadline),
+        )
+    except TimeoutError as e:
+        raise DecisionUnavailable(str(e)) from e
+
+
+async def stored_decision_async(loan, engine, user_input, plaid_data, deadline=None):
+    """Async counterpart of stored_decision for the async views."""
+    if loan is None:
+        return await engine.analyze_async(user_input, plaid_data, deadline=deadline)
+
+    fingerprint = engine.fingerprint(user_input, plaid_data)
+    stored = await Decision.objects.filter(loan_application=loan, fingerprint=fingerprint).afirst()
+    if stored is not None:
+        logger.info(f"Reusing stored decision for loan {loan.id}: {stored.result}")
+        return stored.result
+
+    try:
+        return await _decision_flights.ado(
+            f"{loan.id}:{fingerprint}",
+            lambda: _decide_across_workers_async(loan, engine, user_input, plaid_data, fingerprint, deadline),
+            timeout=_wait_seconds(engine, deadline),
+        )
+    except TimeoutError as e:
+        raise DecisionUnavailable(str(e)) from e
+
+
+async def _decide_across_workers_async(loan, engine, user_input, plaid_data, fingerprint, deadline):
+    """Async counterpart of _decide_across_workers; the model call is awaited, lock queries run in threads."""
+    key = f"{loan.id}:{fingerprint}"
+    poll_interval = getattr(settings, 'AI_DECISION_LOCK_POLL_INTERVAL', 0.1)
+    wait_until = time.monotonic() + _wait_seconds(engine, deadline)
+    waited = False
+
+    while True:
+        if await sync_to_async(_acquire_decision_lock)(key):
+            try:
+                stored = await sync_to_async(_find_stored)(loan, fingerprint)
+                if stored is not None:
+                    return stored.result
+                started = time.perf_counter()
+                details = await engine.analyze_with_details_async(user_input, plaid_data, deadline=deadline)
+                await sync_to_async(_record_decision)(loan, details, started)
+                return details['decision']
+            finally:
+                await sync_to_async(_release_decision_lock)(key)
+
+        if not waited:
+            waited = True
+            _decision_flights.record_external_wait()
+        while await sync_to_async(_lock_is_held)(key):
+            if time.monotonic() >= wait_until:
+                raise DecisionUnavailable(f"Timed out waiting for the in-flight decision for loan {loan.id}")
+            await asyncio.sleep(poll_interval)
+
+        stored = await sync_to_async(_find_stored)(loan, fingerprint)
+        if stored is not None:
+            return stored.result
+
+
+def decide_loan(loan_id):
+    """
+    Fetch a stored loan's bank data and run it through the AI engine.
+    Returns a JSON-serializable result dict; errors are reported, not raised.
+    """
+    started = time.perf_counter()
+    try:
+        loan = LoanApplication.objects.get(id=loan_id)
+        plaid_connections = list(loan.plaid_connections.all())
+        if not plaid_connections:
+            return {'error': 'No Plaid connection found for this loan'}
+
+        accounts, transactions, _ = get_combined_financial_data(plaid_connections)
+        user_input, plaid_data = bank_analysis_inputs(loan, accounts, transactions)
+
+        engine = PreApprovalEngine(
+            openai_api_key=os.getenv('OPENAI_API_KEY'),
+            endpoint='decision_batch'
+        )
+        decision = stored_decision(loan, engine, user_input, plaid_data)
+        return {
+            'decision': decision,
+            'latency_ms': round((time.perf_counter() - started) * 1000, 1),
+        }
+    except LoanApplication.DoesNotExist:
+        return {'error': 'Loan application not found'}
+    except Exception as e:
+        logger.error(f"Batch decision failed for loan {loan_id}: {e}")
+        return {'error': str(e)}
+    finally:
+        # Pool threads keep their own DB connections; don't leak them
+        connection.close()
+
+
+def run_decision_batch(batch_id):
+    """
+    Decide every loan in a DecisionBatch with at most `batch.concurrency`
+    in flight. Results are saved as each decision finishes so clients can
+    poll for partial progress, and the heartbeat at least every
+    AI_BATCH_HEARTBEAT_SECONDS. Loans that already have a result (a resumed
+    batch) are not decided again.
+    """
+    batch = DecisionBatch.objects.get(id=batch_id)
+    batch.status = 'running'
+    batch.started_at = batch.started_at or timezone.now()
+    batch.finished_at = None
+    batch.heartbeat_at = timezone.now()
+    batch.save(update_fields=['status', 'started_at', 'finished_at', 'heartbeat_at'])
+    heartbeat = getattr(settings, 'AI_BATCH_HEARTBEAT_SECONDS', 15)
+
+    try:
+        with ThreadPoolExecutor(max_workers=batch.concurrency, thread_name_prefix='decision-batch') as executor:
+            futures = {
+                executor.submit(decide_loan, loan_id): loan_id
+                for loan_id in batch.loan_ids if str(loan_id) not in batch.results
+            }
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=heartbeat, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    batch.results[str(futures[future])] = result
+                    if 'error' in result:
+                        batch.failed_count += 1
+                    else:
+                        batch.completed_count += 1
+                batch.heartbeat_at = timezone.now()
+                batch.save(update_fields=['results', 'completed_count', 'failed_count', 'heartbeat_at'])
+
+        batch.status = 'completed'
+    except Exception as e:
+        logger.error(f"Decision batch {batch_id} failed: {e}")
+        batch.status = 'failed'
+    finally:
+        batch.finished_at = timezone.now()
+        batch.save(update_fields=['status', 'finished_at'])
+        logger.info(
+            f"Decision batch {batch_id} {batch.status}: {batch.completed_count} decided, "
+            f"{batch.failed_count} failed, {batch.throughput()} decisions/s"
+        )
+        connection.close()
+
+
+def start_decision_batch(batch):
+    """
+    Run a batch on a background thread so the HTTP request returns immediately.
+    If the worker is restarted before it finishes, resume_stalled_batches picks it up.
+    """
+    thread = threading.Thread(
+        target=run_decision_batch,
+        args=(batch.id,),
+        name=f'decision-batch-{batch.id}',
+        daemon=True,
+    )
+    thread.start()
+    return thread
+
+
+def resume_stalled_batches(fail=False):
+    """
+    Pick up batches orphaned by a restarted worker (see DecisionBatch.is_stalled) and
+    decide their remaining loans in this process, or with `fail` just mark them failed.
+    Each batch is claimed by moving its heartbeat first, so two resumers never run the
+    same one. Returns the ids of the batches handled.
+    """
+    handled = []
+    for batch in DecisionBatch.objects.filter(status__in=['pending', 'running']).order_by('id'):
+        if not batch.is_stalled():
+            continue
+        claimed = DecisionBatch.objects.filter(
+            id=batch.id, status=batch.status, heartbeat_at=batch.heartbeat_at
+        ).update(heartbeat_at=timezone.now())
+        if not claimed:
+            continue
+        handled.append(batch.id)
+        if fail:
+            logger.warning(f"Decision batch {batch.id} stalled with {len(batch.results)}/{len(batch.loan_ids)} decided; marking it failed")
+            DecisionBatch.objects.filter(id=batch.id).update(status='failed', finished_at=timezone.now())
+        else:
+            logger.info(f"Resuming stalled decision batch {batch.id}: {len(batch.loan_ids) - len(batch.results)} loans left")
+            run_decision_batch(batch.id)
+    return handled
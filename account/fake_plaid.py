@@ -0,0 +1,443 @@
+"""
+Local stand-in for the parts of the Plaid API this app calls, for load and
+latency testing without touching a real Plaid environment.
+Run it with `python manage.py fake_plaid` and point the app at it with
+PLAID_HOST=http://127.0.0.1:<port>.
+
+Responses are shaped so plaid-python deserializes them like real ones.
+Items are stateless: an item's accounts and transactions are generated from
+its item_id, so any number of server processes return the same data for it.
+"""
+import json
+import logging
+import math
+import random
+import threading
+import time
+import uuid
+import zlib
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+LATENCY_DISTRIBUTIONS = ('fixed', 'uniform', 'normal', 'lognormal')
+
+MERCHANTS = [
+    ('Starbucks', ['Food and Drink', 'Restaurants', 'Coffee Shop']),
+    ('Uber', ['Travel', 'Taxi']),
+    ('Amazon', ['Shops', 'Digital Purchase']),
+    ('Whole Foods', ['Shops', 'Supermarkets and Groceries']),
+    ('Shell', ['Travel', 'Gas Stations']),
+    ('Netflix', ['Service', 'Subscription']),
+    ('Comcast', ['Service', 'Cable']),
+    ('Payroll', ['Transfer', 'Payroll']),
+]
+
+ACCOUNT_TYPES = [
+    ('Plaid Checking', 'depository', 'checking'),
+    ('Plaid Saving', 'depository', 'savings'),
+    ('Plaid Credit Card', 'credit', 'credit card'),
+]
+
+
+class FakePlaidConfig:
+    """Knobs for one fake server; all latencies are in milliseconds."""
+
+    def __init__(self, latency_ms=100.0, latency_jitter_ms=0.0, latency_distribution='fixed',
+                 endpoint_latency_ms=None, error_rate=0.0, rate_limit_rate=0.0,
+                 accounts=2, transactions=200, days=90, asset_report_delay=10.0, seed=0):
+        if latency_distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution: {latency_distribution}")
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.latency_distribution = latency_distribution
+        self.endpoint_latency_ms = endpoint_latency_ms or {}
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.accounts = accounts
+        self.transactions = transactions
+        self.days = days
+        self.asset_report_delay = asset_report_delay
+        self.seed = seed
+
+    def latency_seconds(self, path, rng):
+        """One latency sample for `path`, around its median (endpoint override or the default)."""
+        median = self.endpoint_latency_ms.get(path, self.latency_ms)
+        jitter = self.latency_jitter_ms
+        if self.latency_distribution == 'uniform':
+            sample = rng.uniform(median - jitter, median + jitter)
+        elif self.latency_distribution == 'normal':
+            sample = rng.gauss(median, jitter)
+        elif self.latency_distribution == 'lognormal':
+            # jitter is read as the spread of log(latency): 0.5 gives a long but plausible tail
+            sample = median * math.exp(rng.gauss(0, jitter / median if median else 0))
+        else:
+            sample = median
+        return max(sample, 0) / 1000
+
+
+class FakePlaidStats:
+    """Thread-safe request/error counters per endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.errors = {}
+
+    def record(self, path, status):
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+            if status >= 400:
+                self.errors[path] = self.errors.get(path, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                path: {'requests': count, 'errors': self.errors.get(path, 0)}
+                for path, count in sorted(self.requests.items())
+            }
+
+
+class PlaidError(Exception):
+    def __init__(self, status, error_type, error_code, message):
+        super().__init__(message)
+        self.status = status
+        self.error_type = error_type
+        self.error_code = error_code
+
+    def body(self, request_id):
+        return {
+            'error_type': self.error_type,
+            'error_code': self.error_code,
+            'error_message': str(self),
+            'display_message': None,
+            'request_id': request_id,
+        }
+
+
+class FakeItemData:
+    """Accounts and transactions of one item, generated deterministically from its id."""
+
+    def __init__(self, item_id, config):
+        rng = random.Random(zlib.crc32(item_id.encode()) ^ config.seed)
+        self.item_id = item_id
+        self.accounts = [self._account(rng, index) for index in range(config.accounts)]
+
+        today = date.today()
+        self.transactions = [
+            self._transaction(rng, today - timedelta(days=rng.randrange(config.days)))
+            for _ in range(config.transactions)
+        ]
+        self.transactions.sort(key=lambda transaction: transaction['date'], reverse=True)
+
+    def _account(self, rng, index):
+        name, account_type, subtype = ACCOUNT_TYPES[index % len(ACCOUNT_TYPES)]
+        current = round(rng.uniform(100, 25000), 2)
+        return {
+            'account_id': f'{self.item_id}-acc-{index}',
+            'balances': {
+                'available': current if account_type == 'depository' else None,
+                'current': current,
+                'limit': 10000.0 if account_type == 'credit' else None,
+                'iso_currency_code': 'USD',
+                'unofficial_currency_code': None,
+            },
+            # Differs per item, so two fake items don't look like the same bank linked twice
+            'mask': f'{zlib.crc32(f"{self.item_id}-{index}".encode()) % 10000:04d}',
+            'name': name,
+            'official_name': f'{name} Account',
+            'type': account_type,
+            'subtype': subtype,
+        }
+
+    def _transaction(self, rng, day):
+        merchant, category = rng.choice(MERCHANTS)
+        account = rng.choice(self.accounts) if self.accounts else {'account_id': f'{self.item_id}-acc-0'}
+        amount = -round(rng.uniform(1500, 6000), 2) if merchant == 'Payroll' else round(rng.uniform(2, 300), 2)
+        return {
+            'transaction_id': uuid.UUID(int=rng.getrandbits(128)).hex,
+            'account_id': account['account_id'],
+            'amount': amount,
+            'iso_currency_code': 'USD',
+            'unofficial_currency_code': None,
+            'category': category,
+            'category_id': None,
+            'check_number': None,
+            'date': day.isoformat(),
+            'datetime': None,
+            'authorized_date': day.isoformat(),
+            'authorized_datetime': None,
+            'location': {
+                'address': None, 'city': None, 'region': None, 'postal_code': None,
+                'country': None, 'lat': None, 'lon': None, 'store_number': None,
+            },
+            'name': merchant.upper(),
+            'merchant_name': merchant,
+            'payment_meta': {
+                'by_order_of': None, 'payee': None, 'payer': None, 'payment_method': None,
+                'payment_processor': None, 'ppd_id': None, 'reason': None, 'reference_number': None,
+            },
+            'payment_channel': 'online',
+            'pending': False,
+            'pending_transaction_id': None,
+            'account_owner': None,
+            'transaction_code': None,
+            'transaction_type': 'place',
+        }
+
+
+class FakePlaidApp:
+    """Routes Plaid API paths to handlers; one instance is shared by all request threads."""
+
+    def __init__(self, config):
+        self.config = config
+        self.stats = FakePlaidStats()
+        self._items = {}
+        self._items_lock = threading.Lock()
+        self._rng = random.Random(config.seed)
+        self._rng_lock = threading.Lock()
+        self.routes = {
+            '/link/token/create': self.link_token_create,
+            '/item/public_token/exchange': self.item_public_token_exchange,
+            '/item/remove': self.item_remove,
+            '/accounts/get': self.accounts_get,
+            '/accounts/balance/get': self.accounts_get,
+            '/transactions/get': self.transactions_get,
+            '/transactions/sync': self.transactions_sync,
+            '/sandbox/public_token/create': self.sandbox_public_token_create,
+            '/asset_report/create': self.asset_report_create,
+            '/asset_report/get': self.asset_report_get,
+        }
+
+    def _random(self):
+        with self._rng_lock:
+            return self._rng.random()
+
+    def latency_seconds(self, path):
+        with self._rng_lock:
+            return self.config.latency_seconds(path, self._rng)
+
+    def handle(self, path, body):
+        """Returns (status, response dict) for a POSTed Plaid API call."""
+        request_id = uuid.uuid4().hex[:16]
+        try:
+            handler = self.routes.get(path)
+            if handler is None:
+                raise PlaidError(404, 'INVALID_REQUEST', 'NOT_FOUND', f"{path} is not implemented by the fake server")
+            roll = self._random()
+            if roll < self.config.rate_limit_rate:
+                raise PlaidError(429, 'RATE_LIMIT_EXCEEDED', 'RATE_LIMIT', 'rate limit exceeded (simulated)')
+            if roll < self.config.rate_limit_rate + self.config.error_rate:
+                raise PlaidError(500, 'API_ERROR', 'INTERNAL_SERVER_ERROR', 'internal server error (simulated)')
+            response = handler(body)
+            response['request_id'] = request_id
+            return 200, response
+        except PlaidError as e:
+            return e.status, e.body(request_id)
+
+    def _item(self, item_id):
+        with self._items_lock:
+            item = self._items.get(item_id)
+            if item is None:
+                item = self._items[item_id] = FakeItemData(item_id, self.config)
+            return item
+
+    def _item_for_token(self, body):
+        access_token = body.get('access_token') or ''
+        if not access_token.startswith('access-fake-'):
+            raise PlaidError(400, 'INVALID_INPUT', 'INVALID_ACCESS_TOKEN', 'provided access token is in an invalid format')
+        return self._item(access_token[len('access-fake-'):])
+
+    @staticmethod
+    def _item_metadata(item_id):
+        return {
+            'item_id': item_id,
+            'institution_id': 'ins_fake',
+            'webhook': '',
+            'error': None,
+            'available_products': ['balance', 'transactions'],
+            'billed_products': ['assets'],
+            'consent_expiration_time': None,
+            'update_type': 'background',
+        }
+
+    def link_token_create(self, body):
+        expiration = datetime.now(timezone.utc) + timedelta(hours=4)
+        return {
+            'link_token': f'link-fake-{uuid.uuid4()}',
+            'expiration': expiration.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        }
+
+    def item_public_token_exchange(self, body):
+        public_token = body.get('public_token') or ''
+        if not public_token.startswith('public-fake-'):
+            raise PlaidError(400, 'INVALID_INPUT', 'INVALID_PUBLIC_TOKEN', 'provided public token is in an invalid format')
+        item_id = public_token[len('public-fake-'):]
+        return {'access_token': f'access-fake-{item_id}', 'item_id': item_id}
+
+    def item_remove(self, body):
+        item = self._item_for_token(body)
+        with self._items_lock:
+            self._items.pop(item.item_id, None)
+        return {}
+
+    def sandbox_public_token_create(self, body):
+        return {'public_token': f'public-fake-{uuid.uuid4().hex}'}
+
+    def accounts_get(self, body):
+        item = self._item_for_token(body)
+        return {'accounts': item.accounts, 'item': self._item_metadata(item.item_id)}
+
+    def transactions_get(self, body):
+        item = self._item_for_token(body)
+        start_date, end_date = body.get('start_date'), body.get('end_date')
+        options = body.get('options') or {}
+        count = min(int(options.get('count', 100)), 500)
+        offset = int(options.get('offset', 0))
+
+        in_range = [
+            transaction for transaction in item.transactions
+            if (not start_date or transaction['date'] >= start_date) and (not end_date or transaction['date'] <= end_date)
+        ]
+        return {
+            'accounts': item.accounts,
+            'transactions': in_range[offset:offset + count],
+            'total_transactions': len(in_range),
+            'item': self._item_metadata(item.item_id),
+        }
+
+    def transactions_sync(self, body):
+        # The cursor is the number of transactions already delivered
+        item = self._item_for_token(body)
+        count = min(int(body.get('count', 100)), 500)
+        cursor = body.get('cursor') or '0'
+        if not cursor.isdigit():
+            raise PlaidError(400, 'INVALID_INPUT', 'INVALID_FIELD', 'cursor is invalid')
+        start = int(cursor)
+        end = min(start + count, len(item.transactions))
+        return {
+            'transactions_update_status': 'HISTORICAL_UPDATE_COMPLETE',
+            'accounts': item.accounts,
+            'added': item.transactions[start:end],
+            'modified': [],
+            'removed': [],
+            'next_cursor': str(end),
+            'has_more': end < len(item.transactions),
+        }
+
+    def asset_report_create(self, body):
+        # The token carries the item and creation time, so any server process can answer /asset_report/get
+        access_tokens = body.get('access_tokens') or []
+        items = [self._item_for_token({'access_token': token}) for token in access_tokens]
+        if len(items) != 1:
+            raise PlaidError(400, 'INVALID_REQUEST', 'INVALID_FIELD', 'the fake server supports one access token per report')
+        token = f'assets-fake-{items[0].item_id}:{time.time():.3f}:{int(body.get("days_requested", 60))}'
+        return {'asset_report_token': token, 'asset_report_id': self._asset_report_id(token)}
+
+    @staticmethod
+    def _asset_report_id(token):
+        return uuid.uuid5(uuid.NAMESPACE_URL, token).hex
+
+    def asset_report_get(self, body):
+        token = body.get('asset_report_token') or ''
+        if not token.startswith('assets-fake-') or token.count(':') != 2:
+            raise PlaidError(400, 'INVALID_INPUT', 'INVALID_ASSET_REPORT_TOKEN', 'asset report token is invalid')
+        item_id, created, days_requested = token[len('assets-fake-'):].split(':')
+        if time.time() < float(created) + self.config.asset_report_delay:
+            raise PlaidError(400, 'ASSET_REPORT_ERROR', 'PRODUCT_NOT_READY', 'the requested product is not yet ready')
+
+        item = self._item(item_id)
+        since = (date.today() - timedelta(days=int(days_requested))).isoformat()
+        accounts = []
+        for account in item.accounts:
+            transactions = [
+                {
+                    'account_id': transaction['account_id'],
+                    'transaction_id': transaction['transaction_id'],
+                    'amount': transaction['amount'],
+                    'iso_currency_code': 'USD',
+                    'unofficial_currency_code': None,
+                    'original_description': transaction['name'],
+                    'date': transaction['date'],
+                    'pending': False,
+                }
+                for transaction in item.transactions
+                if transaction['account_id'] == account['account_id'] and transaction['date'] >= since
+            ]
+            accounts.append({
+                **account,
+                'balances': {**account['balances'], 'margin_loan_amount': None},
+                'days_available': int(days_requested),
+                'transactions': transactions,
+                'owners': [],
+                'historical_balances': [
+                    {
+                        'date': (date.today() - timedelta(days=days_ago)).isoformat(),
+                        'current': account['balances']['current'],
+                        'iso_currency_code': 'USD',
+                        'unofficial_currency_code': None,
+                    }
+                    for days_ago in range(0, int(days_requested), 30)
+                ],
+            })
+        return {
+            'report': {
+                'asset_report_id': self._asset_report_id(token),
+                'client_report_id': None,
+                'date_generated': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'days_requested': int(days_requested),
+                'user': {},
+                'items': [{
+                    'item_id': item.item_id,
+                    'institution_name': 'Fake Bank',
+                    'institution_id': 'ins_fake',
+                    'date_last_updated': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                    'accounts': accounts,
+                }],
+            },
+            'warnings': [],
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive, so clients reuse pooled connections as they would against Plaid
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        app = self.server.app
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            body = None
+
+        time.sleep(app.latency_seconds(self.path))
+        if not isinstance(body, dict):
+            status, response = 400, PlaidError(400, 'INVALID_REQUEST', 'INVALID_BODY', 'body could not be parsed as JSON').body(None)
+        else:
+            status, response = app.handle(self.path, body)
+        app.stats.record(self.path, status)
+
+        payload = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+class FakePlaidServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        super().__init__(address, _Handler)
+        self.app = FakePlaidApp(config)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
@@ -6,14 +6,26 @@ from rest_framework.permissions import AllowAny
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 from django.shortcuts import get_object_or_404
-from .models import LoanApplication, PlaidConnection
+from .models import LoanApplication
 from .plaid_service import PlaidService
+from .plaid_archive import archiving_for
+from .account_snapshots import get_account_snapshot, wants_fresh
+from .transactions import stored_transactions, sync_if_stale
+from .plaid_items import connect_item
+from .link_tokens import get_link_token
 from .serializers import LoanApplicationSerializer, PlaidLinkSerializer
 import logging
+from itertools import islice
 
 logger = logging.getLogger(__name__)
 
 
+def _latest_transactions(plaid_connection, plaid_service, count=10):
+    """The item's `count` latest transactions straight from Plaid: one page, not the whole 30-day window."""
+    with archiving_for(plaid_connection):
+        return list(islice(plaid_service.iter_transactions(plaid_connection.access_token, page_size=count), count))
+
+
 class Step1CreateLoanWithLinkTokenView(APIView):
     """Step 1: Create loan application and get link token"""
     authentication_classes = []
@@ -45,8 +57,7 @@ class Step1CreateLoanWithLinkTokenView(APIView):
             loan = serializer.save()
             
             try:
-                plaid_service = PlaidService()
-                link_token = plaid_service.create_link_token(loan.id, loan.full_name)
+                link_token = get_link_token(loan)
                 
                 return Response({
                     'step': '1',
@@ -117,22 +128,9 @@ class Step2ExchangeTokenGetAccountsView(APIView):
             access_token = token_data['access_token']
             item_id = token_data['item_id']
             
-            # Save Plaid connection
-            plaid_connection, created = PlaidConnection.objects.get_or_create(
-                loan_application=loan,
-                defaults={
-                    'access_token': access_token,
-                    'item_id': item_id
-                }
-            )
-            
-            if not created:
-                plaid_connection.access_token = access_token
-                plaid_connection.item_id = item_id
-                plaid_connection.save()
-            
-            # Get accounts
-            accounts = plaid_service.get_accounts(access_token)
+            # Save the connection (one per bank item) and its accounts, kept as the item's snapshot
+            # for step 3; transactions and the AI decision are prepared in the background
+            plaid_connection, accounts = connect_item(loan, access_token, item_id, plaid_service)
             
             return Response({
                 'step': '2',
@@ -158,6 +156,15 @@ class Step3GetCompleteDataView(APIView):
     @swagger_auto_schema(
         operation_summary="STEP 3: Get Complete Loan + Bank Data",
         operation_description="Get complete loan application with all bank account information and balances",
+        manual_parameters=[
+            openapi.Parameter(
+                'fresh',
+                openapi.IN_QUERY,
+                description="1 to bypass the cached account snapshot and refetch from Plaid",
+                type=openapi.TYPE_STRING,
+                required=False
+            )
+        ],
         responses={
             200: openapi.Response(
                 "Complete Data",
@@ -169,6 +176,7 @@ class Step3GetCompleteDataView(APIView):
                         'bank_accounts': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_OBJECT)),
                         'total_balance': openapi.Schema(type=openapi.TYPE_STRING),
                         'transactions': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_OBJECT)),
+                        'snapshot_age_seconds': openapi.Schema(type=openapi.TYPE_NUMBER),
                     }
                 )
             )
@@ -177,14 +185,33 @@ class Step3GetCompleteDataView(APIView):
     def get(self, request, loan_id):
         try:
             loan = get_object_or_404(LoanApplication, id=loan_id)
-            plaid_connection = get_object_or_404(PlaidConnection, loan_application=loan)
+            plaid_connections = list(loan.plaid_connections.all())
+            if not plaid_connections:
+                return Response({
+                    'error': 'No Plaid connection found for this loan'
+                }, status=status.HTTP_404_NOT_FOUND)
             
             plaid_service = PlaidService()
             
-            # Get accounts with fresh data
-            accounts = plaid_service.get_accounts(plaid_connection.access_token)
+            # Accounts (snapshot; refreshed when stale or with ?fresh=1) and the transaction
+            # sync of every connected bank are independent, so all the Plaid round trips run
+            # at the same time and the wait is the slowest one, not one per bank
+            calls = {}
+            for plaid_connection in plaid_connections:
+                calls[('accounts', plaid_connection.id)] = (get_account_snapshot, plaid_connection, wants_fresh(request), plaid_service)
+                calls[('transactions', plaid_connection.id)] = (sync_if_stale, plaid_connection, plaid_service)
+            results, errors = plaid_service.fetch_concurrently(calls, deadline=getattr(request, 'deadline', None))
             
-            # Format accounts and calculate total balance
+            accounts = []
+            snapshot_age = 0.0
+            for plaid_connection in plaid_connections:
+                if ('accounts', plaid_connection.id) in errors:
+                    raise errors[('accounts', plaid_connection.id)]
+                item_accounts, item_age = results[('accounts', plaid_connection.id)]
+                accounts.extend(item_accounts)
+                snapshot_age = max(snapshot_age, item_age)
+            
+            # Format accounts and calculate total balance (all banks together)
             formatted_accounts = []
             total_balance = 0
             
@@ -207,12 +234,32 @@ class Step3GetCompleteDataView(APIView):
                 formatted_accounts.append(formatted_account)
                 total_balance += current_balance
             
-            # Get transactions
-            try:
-                transactions = plaid_service.get_transactions(plaid_connection.access_token)
-                formatted_transactions = []
-                
-                for transaction in transactions[:10]:  # Last 10 transactions
+            # Get transactions from the local store, now holding any new changes from Plaid
+            synced = [c for c in plaid_connections if ('transactions', c.id) not in errors]
+            formatted_transactions = []
+            for transaction in stored_transactions(synced, limit=10):  # Last 10 transactions
+                formatted_transactions.append({
+                    'transaction_id': transaction.transaction_id,
+                    'account_id': transaction.account_id,
+                    'amount': float(transaction.amount),
+                    'date': transaction.date,
+                    'name': transaction.name,
+                    'category': transaction.category
+                })
+            # Items whose sync failed: read their latest transactions from Plaid, in parallel and
+            # within what is left of the deadline; an item that still fails is left out
+            unsynced = [c for c in plaid_connections if c not in synced]
+            for plaid_connection in unsynced:
+                e = errors[('transactions', plaid_connection.id)]
+                logger.warning(f"Could not sync transactions of item {plaid_connection.item_id}, reading the latest from Plaid: {e}")
+            latest, latest_errors = plaid_service.fetch_concurrently({
+                plaid_connection.id: (_latest_transactions, plaid_connection, plaid_service)
+                for plaid_connection in unsynced
+            }, deadline=getattr(request, 'deadline', None)) if unsynced else ({}, {})
+            for e in latest_errors.values():
+                logger.warning(f"Could not fetch transactions: {e}")
+            for item_transactions in latest.values():
+                for transaction in item_transactions:
                     formatted_transactions.append({
                         'transaction_id': transaction['transaction_id'],
                         'account_id': transaction['account_id'],
@@ -221,10 +268,7 @@ class Step3GetCompleteDataView(APIView):
                         'name': transaction['name'],
                         'category': transaction.get('category', [])
                     })
-                    
-            except Exception as e:
-                logger.warning(f"Could not fetch transactions: {e}")
-                formatted_transactions = []
+            formatted_transactions = sorted(formatted_transactions, key=lambda t: t['date'], reverse=True)[:10]
             
             # Complete response
             return Response({
@@ -246,6 +290,7 @@ class Step3GetCompleteDataView(APIView):
                 'bank_accounts': formatted_accounts,
                 'total_balance': f"${total_balance:,.2f}",
                 'transactions': formatted_transactions,
+                'snapshot_age_seconds': snapshot_age,
                 'message': 'Complete loan and bank data retrieved successfully!'
             }, status=status.HTTP_200_OK)
             
@@ -298,15 +343,10 @@ class QuickSandboxFlowView(APIView):
             access_token = token_data['access_token']
             item_id = token_data['item_id']
             
-            # Step 4: Save connection
-            PlaidConnection.objects.create(
-                loan_application=loan,
-                access_token=access_token,
-                item_id=item_id
-            )
+            # Step 4: Save connection and get its accounts
+            plaid_connection, accounts = connect_item(loan, access_token, item_id, plaid_service)
             
-            # Step 5: Get accounts and format data
-            accounts = plaid_service.get_accounts(access_token)
+            # Step 5: Format data
             
             formatted_accounts = []
             total_balance = 0
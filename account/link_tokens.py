@@ -0,0 +1,39 @@
+"""
+Plaid link tokens stored on the loan application and reused until they
+are about to expire, so reloading the link page doesn't mint a new one
+(a Plaid round trip) every time.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .plaid_service import PlaidService
+
+logger = logging.getLogger(__name__)
+
+
+def _still_valid(loan):
+    if not loan.plaid_link_token or loan.plaid_link_token_expires_at is None:
+        return False
+    margin = timedelta(seconds=getattr(settings, 'PLAID_LINK_TOKEN_MIN_TTL', 600))
+    return loan.plaid_link_token_expires_at - timezone.now() > margin
+
+
+def get_link_token(loan, refresh=False, plaid_service=None):
+    """
+    The loan's link token: the stored one while it has more than
+    PLAID_LINK_TOKEN_MIN_TTL seconds left, otherwise (or with `refresh`)
+    a newly created one, which is saved on the loan.
+    """
+    if not refresh and _still_valid(loan):
+        return loan.plaid_link_token
+
+    plaid_service = plaid_service or PlaidService()
+    created = plaid_service.create_link_token(loan.id, loan.full_name)
+    loan.plaid_link_token = created['link_token']
+    loan.plaid_link_token_expires_at = created['expiration']
+    loan.save(update_fields=['plaid_link_token', 'plaid_link_token_expires_at'])
+    logger.info(f"Created Plaid link token for loan {loan.id}, expires {created['expiration']}")
+    return loan.plaid_link_token
@@ -0,0 +1,122 @@
+import json
+import statistics
+import time
+import tracemalloc
+from datetime import date, timedelta
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from account.fake_plaid import FakePlaidApp, FakePlaidConfig
+from account.plaid_service import PLAID_AVAILABLE, PlaidService
+
+ACCESS_TOKEN = 'access-fake-benchmark'
+
+
+def _static_plaid_client(app):
+    """PlaidApi whose HTTP layer answers from the fake app in-process, so only parsing is measured."""
+    import urllib3
+    from plaid.api import plaid_api
+    from plaid.api_client import ApiClient
+    from plaid.configuration import Configuration
+    from plaid.rest import RESTClientObject, RESTResponse
+
+    class StaticRESTClient(RESTClientObject):
+        def __init__(self, configuration):
+            super().__init__(configuration)
+            self.bodies = {}
+
+        def request(self, method, url, *args, body=None, _preload_content=True, **kwargs):
+            key = (url, json.dumps(body, sort_keys=True, default=str))
+            if key not in self.bodies:
+                # JSON-encoded once (on the warm-up run) and served as bytes after that
+                _, data = app.handle(urlsplit(url).path, json.loads(key[1]))
+                self.bodies[key] = json.dumps(data).encode()
+            response = urllib3.HTTPResponse(
+                body=self.bodies[key], status=200, headers={'Content-Type': 'application/json'}, preload_content=True
+            )
+            return RESTResponse(response) if _preload_content else response
+
+    configuration = Configuration(host='http://plaid.fake', api_key={'clientId': 'fake', 'secret': 'fake'})
+    api_client = ApiClient(configuration)
+    api_client.rest_client = StaticRESTClient(configuration)
+    return plaid_api.PlaidApi(api_client)
+
+
+def _measure(func, repeat):
+    """(median ms, peak KiB allocated during one call, KiB still held by its result)."""
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        result = func()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return statistics.median(latencies), (peak - before) / 1024, (current - before) / 1024
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare parsing Plaid account/transaction responses into plaid-python models (sdk) "
+        "with the raw JSON records of PLAID_RAW_RESPONSES (raw): latency and allocation. "
+        "Responses come from the fake Plaid app in-process; no network is involved."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--accounts', type=int, default=25, help='Accounts in the item')
+        parser.add_argument('--transactions', type=int, default=1000, help='Transactions in the item')
+        parser.add_argument('--days', type=int, default=365, help='Days of history the transactions span')
+        parser.add_argument('--repeat', type=int, default=3, help='Timed runs per case (the median is reported)')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if not PLAID_AVAILABLE:
+            raise CommandError("Plaid SDK not available. Install with: pip install plaid-python")
+        if options['repeat'] < 1:
+            raise CommandError("--repeat must be at least 1")
+
+        app = FakePlaidApp(FakePlaidConfig(
+            latency_ms=0,
+            accounts=options['accounts'],
+            transactions=options['transactions'],
+            days=options['days'],
+            seed=options['seed'],
+        ))
+        client = _static_plaid_client(app)
+        services = {}
+        for mode, raw in (('sdk', False), ('raw', True)):
+            services[mode] = PlaidService(raw=raw)
+            services[mode].client = client
+
+        start_date = date.today() - timedelta(days=options['days'])
+        cases = {
+            '/accounts/get': lambda service: service.get_accounts(ACCESS_TOKEN),
+            '/transactions/get': lambda service: service.get_transactions(ACCESS_TOKEN, start_date=start_date),
+            '/transactions/sync': lambda service: service.sync_transactions(ACCESS_TOKEN),
+        }
+
+        self.stdout.write(
+            f"{options['accounts']} accounts, {options['transactions']} transactions, "
+            f"median of {options['repeat']} runs"
+        )
+        self.stdout.write(f"{'endpoint':<20} {'mode':<5} {'latency ms':>11} {'peak KiB':>10} {'held KiB':>10}")
+        for endpoint, call in cases.items():
+            results = {}
+            for mode, service in services.items():
+                call(service)  # warm-up: imports, SDK model caches, encoded responses
+                results[mode] = _measure(lambda: call(service), options['repeat'])
+                latency, peak, held = results[mode]
+                self.stdout.write(f"{endpoint:<20} {mode:<5} {latency:>11.1f} {peak:>10.0f} {held:>10.0f}")
+            (sdk_latency, sdk_peak, _), (raw_latency, raw_peak, _) = results['sdk'], results['raw']
+            self.stdout.write(self.style.SUCCESS(
+                f"{'':<20} raw is {sdk_latency / raw_latency if raw_latency else 0:.1f}x faster, "
+                f"peaks at {raw_peak / sdk_peak if sdk_peak else 0:.0%} of the sdk's memory"
+            ))
@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from account.fake_plaid import LATENCY_DISTRIBUTIONS, FakePlaidConfig, FakePlaidServer
+
+
+def _endpoint_latency(value):
+    path, _, latency = value.partition('=')
+    if not path.startswith('/') or not latency:
+        raise ValueError(value)
+    return path, float(latency)
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a local fake Plaid API for load and latency testing. "
+        "Point the app at it with PLAID_HOST=http://<host>:<port>."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency-ms', type=float, default=100.0, help='Median response latency')
+        parser.add_argument('--latency-jitter-ms', type=float, default=0.0,
+                            help='Spread around the median (half-width for uniform, stddev for normal/lognormal)')
+        parser.add_argument('--latency-distribution', choices=LATENCY_DISTRIBUTIONS, default='fixed')
+        parser.add_argument('--endpoint-latency', action='append', default=[], metavar='PATH=MS',
+                            help='Median latency for one endpoint, e.g. /transactions/get=400 (repeatable)')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of calls answered with a 500')
+        parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Fraction of calls answered with a 429')
+        parser.add_argument('--accounts', type=int, default=2, help='Accounts per item')
+        parser.add_argument('--transactions', type=int, default=200, help='Transactions per item')
+        parser.add_argument('--days', type=int, default=90, help='Days of history the transactions span')
+        parser.add_argument('--asset-report-delay', type=float, default=10.0,
+                            help='Seconds before a created asset report can be fetched (PRODUCT_NOT_READY until then)')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        try:
+            endpoint_latency_ms = dict(_endpoint_latency(value) for value in options['endpoint_latency'])
+        except ValueError as e:
+            raise CommandError(f"--endpoint-latency expects PATH=MS, got {e}")
+        if not 0 <= options['error_rate'] + options['rate_limit_rate'] <= 1:
+            raise CommandError("--error-rate plus --rate-limit-rate must be between 0 and 1")
+
+        config = FakePlaidConfig(
+            latency_ms=options['latency_ms'],
+            latency_jitter_ms=options['latency_jitter_ms'],
+            latency_distribution=options['latency_distribution'],
+            endpoint_latency_ms=endpoint_latency_ms,
+            error_rate=options['error_rate'],
+            rate_limit_rate=options['rate_limit_rate'],
+            accounts=options['accounts'],
+            transactions=options['transactions'],
+            days=options['days'],
+            asset_report_delay=options['asset_report_delay'],
+            seed=options['seed'],
+        )
+        server = FakePlaidServer((options['host'], options['port']), config)
+        self.stdout.write(f"Fake Plaid listening on {server.url} (set PLAID_HOST={server.url})")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write("Requests served:")
+            for path, counts in server.app.stats.snapshot().items():
+                self.stdout.write(f"  {path}: {counts['requests']} ({counts['errors']} errors)")
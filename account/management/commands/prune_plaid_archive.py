@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from account.plaid_archive import prune_archive
+
+
+class Command(BaseCommand):
+    help = "Delete archived Plaid responses older than PLAID_ARCHIVE_RETENTION_DAYS (run it daily, e.g. from cron)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=getattr(settings, 'PLAID_ARCHIVE_RETENTION_DAYS', 90),
+                            help='Keep responses fetched within this many days')
+
+    def handle(self, *args, **options):
+        if options['days'] < 0:
+            raise CommandError("--days must not be negative")
+        deleted = prune_archive(options['days'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} archived Plaid responses older than {options['days']} days"))
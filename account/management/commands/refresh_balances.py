@@ -0,0 +1,96 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from account.balance_refresh import BALANCE_ENDPOINTS, latest_unfinished_run, run_balance_refresh
+from account.models import BalanceRefreshRun
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Refresh Plaid balances for all or a filtered set of connections and store them as "
+        "BalanceSnapshots. An interrupted run can be resumed with --resume."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Plaid calls in flight at once')
+        parser.add_argument('--rate-limit', type=int,
+                            help="Calls per minute to the balance endpoint (instead of PLAID_RATE_LIMITS for this command's calls)")
+        parser.add_argument('--cached', action='store_true',
+                            help="Use /accounts/get (Plaid's cached balances) instead of real-time /accounts/balance/get")
+        parser.add_argument('--loan-ids', type=int, nargs='+', help='Only these loan applications')
+        parser.add_argument('--created-after', help='Only connections made on/after this date (YYYY-MM-DD)')
+        parser.add_argument('--stale-minutes', type=int, help='Skip connections refreshed within this many minutes')
+        parser.add_argument('--limit', type=int, help='Refresh at most this many connections')
+        parser.add_argument('--resume', nargs='?', const='latest', metavar='RUN_ID',
+                            help='Continue an interrupted run (the latest one if no id is given)')
+        parser.add_argument('--every', type=float, metavar='MINUTES',
+                            help='Scheduled mode: start a new run every MINUTES until stopped')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError("--workers must be at least 1")
+        realtime = not options['cached']
+
+        run = self._resumed_run(options['resume']) if options['resume'] else self._new_run(options)
+        try:
+            while True:
+                self._run(run, options['workers'], realtime, options['rate_limit'])
+                if not options['every']:
+                    break
+                self.stdout.write(f"Next run in {options['every']:g} minutes")
+                time.sleep(options['every'] * 60)
+                run = self._new_run(options)
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING("Interrupted; continue with --resume"))
+
+    def _resumed_run(self, run_id):
+        if run_id == 'latest':
+            run = latest_unfinished_run()
+            if run is None:
+                raise CommandError("No unfinished balance refresh to resume")
+            return run
+        try:
+            return BalanceRefreshRun.objects.get(id=int(run_id))
+        except (ValueError, BalanceRefreshRun.DoesNotExist):
+            raise CommandError(f"Balance refresh run {run_id} not found")
+
+    def _new_run(self, options):
+        filters = {
+            'loan_ids': options['loan_ids'],
+            'created_after': options['created_after'],
+            'stale_minutes': options['stale_minutes'],
+            'limit': options['limit'],
+        }
+        return BalanceRefreshRun.objects.create(filters={name: value for name, value in filters.items() if value})
+
+    def _run(self, run, workers, realtime, rate_limit=None):
+        self.stdout.write(f"Balance refresh {run.id}: {workers} workers, {BALANCE_ENDPOINTS[realtime]}")
+        started = time.perf_counter()
+
+        def report(connection_id, result):
+            done = run.succeeded + run.failed
+            if 'error' in result:
+                self.stderr.write(f"  connection {connection_id}: {result['error']}")
+            if done % 100 == 0:
+                self.stdout.write(f"  {run.succeeded}/{run.total} refreshed")
+
+        try:
+            latencies = run_balance_refresh(run, workers=workers, realtime=realtime, on_result=report, rate_limit=rate_limit)
+        finally:
+            elapsed = time.perf_counter() - started
+            run.refresh_from_db()
+            self.stdout.write(
+                f"Run {run.id} {run.status}: {run.succeeded}/{run.total} refreshed, {run.failed} failed"
+            )
+
+        done = len(latencies) + run.failed
+        summary = f"  {done} connections in {elapsed:.1f}s ({done / elapsed if elapsed else 0:.1f}/s)"
+        if latencies:
+            summary += f", latency p50 {_percentile(latencies, 0.5):.0f}ms p95 {_percentile(latencies, 0.95):.0f}ms"
+        self.stdout.write(self.style.SUCCESS(summary))
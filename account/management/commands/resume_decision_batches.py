@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from account.decisions import resume_stalled_batches
+
+
+class Command(BaseCommand):
+    help = (
+        "Finish decision batches left pending/running by a restarted worker "
+        "(no heartbeat for AI_BATCH_STALE_SECONDS). Run it from cron, e.g. every few minutes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fail', action='store_true',
+                            help='Mark stalled batches failed instead of deciding their remaining loans')
+
+    def handle(self, *args, **options):
+        handled = resume_stalled_batches(fail=options['fail'])
+        action = 'Marked failed' if options['fail'] else 'Resumed'
+        self.stdout.write(self.style.SUCCESS(f"{action} {len(handled)} stalled decision batches {handled or ''}".rstrip()))
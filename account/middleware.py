@@ -0,0 +1,31 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .resilience import Deadline, deadline_scope
+
+
+class RequestDeadlineMiddleware:
+    """
+    Attach `request.deadline`, the time budget left for this request.
+    Views pass it to upstream calls (OpenAI, Plaid) so a slow dependency cannot
+    hold the worker longer than REQUEST_DEADLINE_SECONDS; it is also the
+    current_deadline() that bounds Plaid retries while the request is served.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        request.deadline = Deadline(getattr(settings, 'REQUEST_DEADLINE_SECONDS', 25.0))
+        if iscoroutinefunction(self):
+            return self._acall(request)
+        with deadline_scope(request.deadline):
+            return self.get_response(request)
+
+    async def _acall(self, request):
+        with deadline_scope(request.deadline):
+            return await self.get_response(request)
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.5 on 2026-10-17 22:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0004_decisionbatch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Decision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('result', models.CharField(choices=[('approve', 'Approve'), ('disapprove', 'Disapprove')], max_length=20)),
+                ('model', models.CharField(max_length=100)),
+                ('latency_ms', models.FloatField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('loan_application', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='decisions', to='account.loanapplication')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['loan_application', 'fingerprint'], name='account_dec_loan_ap_c802bd_idx')],
+            },
+        ),
+    ]
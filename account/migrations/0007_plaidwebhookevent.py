@@ -0,0 +1,30 @@
+# Generated by Django 5.2.5 on 2026-10-17 22:57
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0006_decisionlock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlaidWebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('body_sha256', models.CharField(max_length=64, unique=True)),
+                ('item_id', models.CharField(blank=True, max_length=255)),
+                ('webhook_type', models.CharField(max_length=50)),
+                ('webhook_code', models.CharField(max_length=50)),
+                ('received_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='plaidconnection',
+            name='item_id',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.5 on 2026-10-17 22:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0007_plaidwebhookevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plaidconnection',
+            name='transactions_cursor',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='plaidconnection',
+            name='transactions_synced_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='PlaidTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transaction_id', models.CharField(max_length=255, unique=True)),
+                ('account_id', models.CharField(max_length=255)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('iso_currency_code', models.CharField(blank=True, max_length=10, null=True)),
+                ('date', models.DateField()),
+                ('name', models.CharField(max_length=255)),
+                ('merchant_name', models.CharField(blank=True, max_length=255, null=True)),
+                ('category', models.JSONField(blank=True, default=list)),
+                ('pending', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('connection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transactions', to='account.plaidconnection')),
+            ],
+            options={
+                'ordering': ['-date'],
+                'indexes': [models.Index(fields=['connection', 'date'], name='account_pla_connect_f76916_idx')],
+            },
+        ),
+    ]
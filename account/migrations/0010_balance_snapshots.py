@@ -0,0 +1,43 @@
+# Generated by Django 5.2.5 on 2026-10-17 23:08
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0009_plaidratebucket'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceRefreshRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('running', 'Running'), ('completed', 'Completed'), ('interrupted', 'Interrupted')], default='running', max_length=20)),
+                ('filters', models.JSONField(default=dict)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('succeeded', models.PositiveIntegerField(default=0)),
+                ('failed', models.PositiveIntegerField(default=0)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('accounts', models.JSONField(default=list)),
+                ('total_balance', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('fetched_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('connection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_snapshots', to='account.plaidconnection')),
+                ('run', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='snapshots', to='account.balancerefreshrun')),
+            ],
+            options={
+                'ordering': ['-fetched_at'],
+                'indexes': [models.Index(fields=['connection', 'fetched_at'], name='account_bal_connect_080d75_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 23:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0010_balance_snapshots'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loanapplication',
+            name='plaid_link_token_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.5 on 2026-10-17 23:12
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0011_loan_link_token_expiry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AssetReport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('item_id', models.CharField(max_length=255)),
+                ('asset_report_id', models.CharField(max_length=255, unique=True)),
+                ('asset_report_token', models.CharField(max_length=255)),
+                ('days_requested', models.PositiveIntegerField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('report', models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('requested_at', models.DateTimeField(auto_now_add=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('connection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='asset_reports', to='account.plaidconnection')),
+            ],
+            options={
+                'ordering': ['-requested_at'],
+            },
+        ),
+    ]
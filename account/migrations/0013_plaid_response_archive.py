@@ -0,0 +1,38 @@
+# Generated by Django 5.2.5 on 2026-10-17 23:18
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0012_assetreport'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='plaidconnection',
+            name='access_token',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.CreateModel(
+            name='PlaidResponseArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('item_id', models.CharField(max_length=255)),
+                ('endpoint', models.CharField(max_length=100)),
+                ('params', models.JSONField(default=dict)),
+                ('request_key', models.CharField(max_length=64)),
+                ('payload', models.BinaryField()),
+                ('raw_size', models.PositiveIntegerField()),
+                ('fetched_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('connection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='response_archive', to='account.plaidconnection')),
+            ],
+            options={
+                'ordering': ['-fetched_at'],
+                'indexes': [models.Index(fields=['connection', 'endpoint', 'fetched_at'], name='account_pla_connect_f02065_idx')],
+            },
+        ),
+    ]
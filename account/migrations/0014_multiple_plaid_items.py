@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-17 23:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0013_plaid_response_archive'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='plaidconnection',
+            options={'ordering': ['created_at', 'id']},
+        ),
+        migrations.AlterField(
+            model_name='plaidconnection',
+            name='loan_application',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='plaid_connections', to='account.loanapplication'),
+        ),
+        migrations.AddConstraint(
+            model_name='plaidconnection',
+            constraint=models.UniqueConstraint(fields=('loan_application', 'item_id'), name='unique_item_per_application'),
+        ),
+    ]
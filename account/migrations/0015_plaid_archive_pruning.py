@@ -0,0 +1,17 @@
+# Generated by Django 5.2.5 on 2026-10-17 23:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0014_multiple_plaid_items'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='plaidresponsearchive',
+            index=models.Index(fields=['fetched_at'], name='account_pla_fetched_1750a8_idx'),
+        ),
+    ]
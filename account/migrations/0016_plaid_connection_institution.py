@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-17 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0015_plaid_archive_pruning'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plaidconnection',
+            name='account_masks',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='plaidconnection',
+            name='institution_id',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 00:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0016_plaid_connection_institution'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='decisionbatch',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
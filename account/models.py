@@ -1,3 +1,9 @@
+import gzip
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.utils import timezone
 
@@ -21,6 +27,8 @@ class LoanApplication(models.Model):
     
     # Store unique tokens for each loan application
     plaid_link_token = models.CharField(max_length=255, null=True, blank=True)
+    # Reused until close to this time (see link_tokens.get_link_token)
+    plaid_link_token_expires_at = models.DateTimeField(null=True, blank=True)
     plaid_public_token = models.CharField(max_length=255, null=True, blank=True)
     
     def __str__(self):
@@ -28,14 +36,258 @@ class LoanApplication(models.Model):
 
 
 class PlaidConnection(models.Model):
-    """Simple model to store Plaid connection temporarily"""
-    loan_application = models.OneToOneField(LoanApplication, on_delete=models.CASCADE)
-    access_token = models.CharField(max_length=255)
-    item_id = models.CharField(max_length=255)
+    """Simple model to store Plaid connection temporarily (one per bank item an applicant connects)"""
+    loan_application = models.ForeignKey(LoanApplication, on_delete=models.CASCADE, related_name='plaid_connections')
+    access_token = models.CharField(max_length=255, db_index=True)  # archived Plaid responses are matched by token
+    item_id = models.CharField(max_length=255, db_index=True)  # webhooks look connections up by item
+    # Bank and account masks of the item, to recognise the same bank linked again (see plaid_items)
+    institution_id = models.CharField(max_length=100, blank=True, default='')
+    account_masks = models.JSONField(default=list, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # /transactions/sync position; empty until the first sync
+    transactions_cursor = models.TextField(blank=True, default='')
+    transactions_synced_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['created_at', 'id']
+        constraints = [
+            # Reconnecting an item (e.g. Link update mode) updates its connection instead of adding one
+            models.UniqueConstraint(fields=['loan_application', 'item_id'], name='unique_item_per_application'),
+        ]
+    
+    def relink(self, access_token):
+        """Point the connection at a newly exchanged token for its item (e.g. after Link update mode)"""
+        self.access_token = access_token
+        self.save(update_fields=['access_token'])
     
     def __str__(self):
-        return f"Plaid Connection for {self.loan_application.full_name}"
+        return f"Plaid Connection for {self.loan_application.full_name} ({self.item_id})"
+
+
+class PlaidTransaction(models.Model):
+    """Local copy of an item's transactions, kept current with /transactions/sync"""
+    connection = models.ForeignKey(PlaidConnection, on_delete=models.CASCADE, related_name='transactions')
+    transaction_id = models.CharField(max_length=255, unique=True)
+    account_id = models.CharField(max_length=255)
+    amount = models.DecimalField(max_digits=14, decimal_places=2)
+    iso_currency_code = models.CharField(max_length=10, null=True, blank=True)
+    date = models.DateField()
+    name = models.CharField(max_length=255)
+    merchant_name = models.CharField(max_length=255, null=True, blank=True)
+    category = models.JSONField(default=list, blank=True)
+    pending = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-date']
+        indexes = [models.Index(fields=['connection', 'date'])]
+
+    def __str__(self):
+        return f"{self.name} {self.amount} on {self.date}"
+
+
+class AssetReport(models.Model):
+    """Plaid Asset Report for a connection's item, stored once Plaid has generated it"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
+    connection = models.ForeignKey(PlaidConnection, on_delete=models.CASCADE, related_name='asset_reports')
+    # The item the report covers; a re-linked connection needs a new report
+    item_id = models.CharField(max_length=255)
+    asset_report_id = models.CharField(max_length=255, unique=True)  # ASSETS webhooks identify reports by id
+    asset_report_token = models.CharField(max_length=255)
+    days_requested = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    # /asset_report/get 'report': items -> accounts with balances, historical balances and transactions
+    report = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    error = models.TextField(blank=True, default='')
+    requested_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-requested_at']
+
+    def __str__(self):
+        return f"Asset report {self.asset_report_id} ({self.status})"
+
+
+class PlaidResponseArchive(models.Model):
+    """
+    Raw body of one Plaid response (/accounts/get, /transactions/get, ...) for a
+    connection, gzip-compressed, so data can be re-analysed or replayed without Plaid
+    """
+    connection = models.ForeignKey(PlaidConnection, on_delete=models.CASCADE, related_name='response_archive')
+    item_id = models.CharField(max_length=255)  # the item at fetch time; a re-linked connection gets new rows
+    endpoint = models.CharField(max_length=100)
+    # Request body without the access token (dates, paging options); request_key is its sha256
+    params = models.JSONField(default=dict)
+    request_key = models.CharField(max_length=64)
+    payload = models.BinaryField()
+    raw_size = models.PositiveIntegerField()  # bytes before compression
+    fetched_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-fetched_at']
+        indexes = [
+            models.Index(fields=['connection', 'endpoint', 'fetched_at']),
+            models.Index(fields=['fetched_at']),  # pruning
+        ]
+
+    def data(self):
+        """The response as Plaid sent it, decoded from JSON"""
+        return json.loads(gzip.decompress(self.payload))
+
+    def __str__(self):
+        return f"{self.endpoint} for {self.item_id} at {self.fetched_at}"
+
+
+class PlaidWebhookEvent(models.Model):
+    """Webhook deliveries received from Plaid, kept to drop repeats within the dedup window"""
+    # sha256 of the raw request body; Plaid retries deliver identical bodies
+    body_sha256 = models.CharField(max_length=64, unique=True)
+    item_id = models.CharField(max_length=255, blank=True)
+    webhook_type = models.CharField(max_length=50)
+    webhook_code = models.CharField(max_length=50)
+    received_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.webhook_type}/{self.webhook_code} for item {self.item_id}"
+
+
+class DecisionBatch(models.Model):
+    """Bulk re-run of AI decisions for many loan applications"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    loan_ids = models.JSONField(default=list)
+    concurrency = models.PositiveIntegerField(default=8)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    # loan_id -> {"decision": ..., "latency_ms": ...} or {"error": ...}, filled in as decisions finish
+    results = models.JSONField(default=dict)
+    completed_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Bumped while a process runs the batch; it stops when that process dies (e.g. a worker restart)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    def is_stalled(self):
+        """Queued or running, but no process has worked on it for AI_BATCH_STALE_SECONDS"""
+        if self.status not in ('pending', 'running'):
+            return False
+        cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'AI_BATCH_STALE_SECONDS', 120))
+        return (self.heartbeat_at or self.created_at) < cutoff
+
+    def throughput(self):
+        """Decisions per second since the batch started"""
+        if not self.started_at:
+            return 0.0
+        end = self.finished_at or timezone.now()
+        elapsed = (end - self.started_at).total_seconds()
+        done = self.completed_count + self.failed_count
+        return round(done / elapsed, 2) if elapsed > 0 else 0.0
+
+    def __str__(self):
+        return f"Decision Batch {self.id} ({self.status})"
+
+
+class Decision(models.Model):
+    """AI decision for a loan application, reused until its financial inputs change"""
+    RESULT_CHOICES = [
+        ('approve', 'Approve'),
+        ('disapprove', 'Disapprove'),
+    ]
+
+    loan_application = models.ForeignKey(LoanApplication, on_delete=models.CASCADE, related_name='decisions')
+    # sha256 of the normalized financial inputs and model setup (see decision_cache.decision_fingerprint)
+    fingerprint = models.CharField(max_length=64)
+    result = models.CharField(max_length=20, choices=RESULT_CHOICES)
+    # 'rules', 'cache' or the 'vendor:model' that answered
+    model = models.CharField(max_length=100)
+    latency_ms = models.FloatField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [models.Index(fields=['loan_application', 'fingerprint'])]
+
+    def __str__(self):
+        return f"Decision for {self.loan_application.full_name}: {self.result}"
+
+
+class DecisionLock(models.Model):
+    """Marks a decision in flight so other workers wait for it instead of calling the model again"""
+    # '<loan id>:<input fingerprint>'
+    key = models.CharField(max_length=100, unique=True)
+    owner = models.CharField(max_length=255)
+    # A lock left behind by a crashed worker stops blocking once expired
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Decision lock {self.key} held by {self.owner}"
+
+
+class BalanceRefreshRun(models.Model):
+    """One run of the refresh_balances command; its snapshots double as the checkpoint a resumed run skips"""
+    STATUS_CHOICES = [
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('interrupted', 'Interrupted'),
+    ]
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='running')
+    # Options that selected the connections, reapplied when the run is resumed
+    filters = models.JSONField(default=dict)
+    total = models.PositiveIntegerField(default=0)
+    succeeded = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def throughput(self):
+        """Connections refreshed per second since the run started"""
+        end = self.finished_at or timezone.now()
+        elapsed = (end - self.started_at).total_seconds()
+        done = self.succeeded + self.failed
+        return round(done / elapsed, 2) if elapsed > 0 else 0.0
+
+    def __str__(self):
+        return f"Balance refresh {self.id} ({self.status}): {self.succeeded}/{self.total}"
+
+
+class BalanceSnapshot(models.Model):
+    """Balances of one connection's accounts as fetched from Plaid at `fetched_at`"""
+    connection = models.ForeignKey(PlaidConnection, on_delete=models.CASCADE, related_name='balance_snapshots')
+    run = models.ForeignKey(BalanceRefreshRun, on_delete=models.SET_NULL, null=True, blank=True, related_name='snapshots')
+    # [{'account_id', 'name', 'type', 'subtype', 'mask', 'current', 'available', 'limit', 'iso_currency_code'}]
+    accounts = models.JSONField(default=list)
+    total_balance = models.DecimalField(max_digits=14, decimal_places=2)
+    fetched_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        ordering = ['-fetched_at']
+        indexes = [models.Index(fields=['connection', 'fetched_at'])]
+
+    def __str__(self):
+        return f"Balances of {self.connection.item_id} at {self.fetched_at}"
+
+
+class PlaidRateBucket(models.Model):
+    """Token bucket for one Plaid endpoint, shared by all workers (rows are locked while taking a token)"""
+    endpoint = models.CharField(max_length=100, unique=True)
+    # Negative while callers are queued: each one reserves a token and waits for it to refill
+    tokens = models.FloatField()
+    updated_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Plaid rate bucket {self.endpoint}: {self.tokens:.1f} tokens"
 
 
 
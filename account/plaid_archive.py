@@ -0,0 +1,133 @@
+"""
+Archive of raw Plaid responses.
+Bodies of PLAID_ARCHIVE_ENDPOINTS calls made inside `archiving_for(connection)`
+are stored gzip-compressed for that connection as they come back from Plaid,
+and pruned after PLAID_ARCHIVE_RETENTION_DAYS (`manage.py prune_plaid_archive`).
+Replay mode (PLAID_REPLAY, or
+PlaidService(replay=True)) answers the same calls from the archive, so
+decisions and PDFs can be recomputed later without reaching Plaid.
+"""
+import gzip
+import hashlib
+import json
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import PlaidConnection, PlaidResponseArchive
+
+logger = logging.getLogger(__name__)
+
+# Default ranges move with the day of the call, so replay falls back to matching without them
+DATE_PARAMS = ('start_date', 'end_date')
+
+# The connection whose Plaid calls are being made; set by archiving_for
+_current_connection = ContextVar('plaid_archive_connection', default=None)
+
+
+class NotArchived(LookupError):
+    """Replay mode was asked for a Plaid response that was never archived."""
+
+
+def _params(body):
+    return {name: value for name, value in (body or {}).items() if name not in ('access_token', 'client_id', 'secret')}
+
+
+def _request_key(params):
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _undated(params):
+    return {name: value for name, value in params.items() if name not in DATE_PARAMS}
+
+
+def _connection_for(body):
+    access_token = (body or {}).get('access_token')
+    if not access_token:
+        return None
+    return PlaidConnection.objects.filter(access_token=access_token).first()
+
+
+@contextmanager
+def archiving_for(plaid_connection):
+    """Archive the responses of Plaid calls made in this block (and thread) under `plaid_connection`."""
+    token = _current_connection.set(plaid_connection)
+    try:
+        yield plaid_connection
+    finally:
+        _current_connection.reset(token)
+
+
+def is_archiving(endpoint):
+    """Whether a call to `endpoint` made here would be archived; checked before reading the response body."""
+    return _current_connection.get() is not None and endpoint in getattr(settings, 'PLAID_ARCHIVE_ENDPOINTS', [])
+
+
+def archive_response(endpoint, body, raw):
+    """
+    Store `raw`, the response bytes of a call to `endpoint` with request `body`,
+    if the endpoint is archived and the call was made inside archiving_for() for
+    the connection its access token belongs to.
+    """
+    if endpoint not in getattr(settings, 'PLAID_ARCHIVE_ENDPOINTS', []):
+        return None
+    plaid_connection = _current_connection.get()
+    if plaid_connection is None or (body or {}).get('access_token') != plaid_connection.access_token:
+        return None
+
+    params = _params(body)
+    return PlaidResponseArchive.objects.create(
+        connection=plaid_connection,
+        item_id=plaid_connection.item_id,
+        endpoint=endpoint,
+        params=params,
+        request_key=_request_key(params),
+        payload=gzip.compress(raw, compresslevel=getattr(settings, 'PLAID_ARCHIVE_COMPRESSION_LEVEL', 6)),
+        raw_size=len(raw),
+    )
+
+
+def replay_response(endpoint, body):
+    """
+    Response bytes for a call to `endpoint` with request `body`: the newest
+    archived response to the same request, or else to the same request with
+    other dates. Raises NotArchived when there is neither.
+    """
+    plaid_connection = _connection_for(body)
+    if plaid_connection is None:
+        raise NotArchived(f"No connection has this access token; cannot replay {endpoint}")
+
+    archived = plaid_connection.response_archive.filter(item_id=plaid_connection.item_id, endpoint=endpoint)
+    params = _params(body)
+    match = archived.filter(request_key=_request_key(params)).first()
+    if match is None:
+        undated = _undated(params)
+        match_id = next(
+            (archive_id for archive_id, archived_params in archived.values_list('id', 'params')
+             if _undated(archived_params) == undated),
+            None,
+        )
+        if match_id is None:
+            raise NotArchived(f"No archived {endpoint} response for item {plaid_connection.item_id}")
+        match = archived.get(id=match_id)
+
+    logger.info(f"Replaying {endpoint} for item {plaid_connection.item_id} from {match.fetched_at}")
+    return gzip.decompress(match.payload)
+
+
+def prune_archive(older_than_days=None):
+    """
+    Delete archived responses fetched more than `older_than_days` days ago
+    (PLAID_ARCHIVE_RETENTION_DAYS by default). Returns how many were deleted.
+    """
+    if older_than_days is None:
+        older_than_days = getattr(settings, 'PLAID_ARCHIVE_RETENTION_DAYS', 90)
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    deleted, _ = PlaidResponseArchive.objects.filter(fetched_at__lt=cutoff).delete()
+    if deleted:
+        logger.info(f"Pruned {deleted} archived Plaid responses fetched before {cutoff:%Y-%m-%d}")
+    return deleted
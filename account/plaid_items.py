@@ -0,0 +1,77 @@
+"""
+Connecting bank items to a loan application.
+Every connect endpoint goes through connect_item. Re-linking a bank through a
+new Link session gives a new item_id; the earlier connection to the same bank
+(same institution, overlapping account masks) is replaced rather than kept,
+so combined balances don't count those accounts twice, and its item is removed
+at Plaid so the old access token is revoked.
+"""
+import logging
+
+from django.db import transaction
+
+from .account_snapshots import invalidate_account_snapshot, store_account_snapshot
+from .models import PlaidConnection
+from .plaid_archive import archiving_for
+from .plaid_service import PlaidService
+from .warmup import schedule_warm_up
+
+logger = logging.getLogger(__name__)
+
+
+def _replaced_connections(plaid_connection):
+    """Other connections of the application to the same bank accounts as `plaid_connection`."""
+    if not plaid_connection.institution_id or not plaid_connection.account_masks:
+        return []
+    masks = set(plaid_connection.account_masks)
+    return [
+        other
+        for other in plaid_connection.loan_application.plaid_connections
+        .filter(institution_id=plaid_connection.institution_id).exclude(id=plaid_connection.id)
+        if masks & set(other.account_masks)
+    ]
+
+
+def connect_item(loan_application, access_token, item_id, plaid_service=None):
+    """
+    Store the connection for a newly exchanged item (reconnecting an item refreshes
+    its token), fetch its accounts into the item's snapshot and start the background
+    warm-up. An earlier connection to the same bank is deleted and its access token
+    revoked. Returns (plaid_connection, accounts) with the accounts as plain dicts.
+    """
+    plaid_service = plaid_service or PlaidService()
+    plaid_connection, created = PlaidConnection.objects.get_or_create(
+        loan_application=loan_application,
+        item_id=item_id,
+        defaults={'access_token': access_token},
+    )
+    if not created:
+        plaid_connection.relink(access_token)
+
+    with archiving_for(plaid_connection):
+        accounts, institution_id = plaid_service.get_item_accounts(access_token)
+    accounts = store_account_snapshot(item_id, accounts)
+
+    with transaction.atomic():
+        plaid_connection.institution_id = institution_id or ''
+        plaid_connection.account_masks = sorted({account['mask'] for account in accounts if account.get('mask')})
+        plaid_connection.save(update_fields=['institution_id', 'account_masks'])
+        replaced_connections = _replaced_connections(plaid_connection)
+        for replaced in replaced_connections:
+            logger.info(
+                f"Item {item_id} re-links {replaced.item_id} ({institution_id}) "
+                f"for loan application {loan_application.id}; removing the old connection"
+            )
+            invalidate_account_snapshot(replaced.item_id)
+            replaced.delete()
+
+    # Outside the transaction: a Plaid call must not hold it open, and the new connection stands either way
+    for replaced in replaced_connections:
+        try:
+            plaid_service.remove_item(replaced.access_token)
+        except Exception as e:
+            logger.warning(f"Could not revoke the access token of replaced item {replaced.item_id}: {e}")
+
+    # Transactions and the AI decision are prepared in the background
+    schedule_warm_up(plaid_connection.id)
+    return plaid_connection, accounts
@@ -0,0 +1,225 @@
+"""
+Rate limiting and retries for Plaid calls.
+With PLAID_RATE_LIMIT_DEFAULT / PLAID_RATE_LIMITS set, every call first takes
+a token from its endpoint's bucket (a database row, so all workers draw from
+the same quota). 429s and transient Plaid errors are retried with exponential
+backoff and jitter instead of failing the user's request on the first blip.
+"""
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import PlaidRateBucket
+from .resilience import backoff_delay, current_deadline
+
+logger = logging.getLogger(__name__)
+
+# Plaid errors that go away on their own; anything else is returned to the caller at once
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+RETRYABLE_ERROR_CODES = {'INTERNAL_SERVER_ERROR', 'PLANNED_MAINTENANCE', 'INSTITUTION_DOWN', 'INSTITUTION_NOT_RESPONDING'}
+# Client-wide rate limit. Per-item limits (ACCOUNTS_LIMIT, TRANSACTIONS_LIMIT, ...) also come as 429s
+# but only concern one item, so they are retried without slowing other callers down.
+CLIENT_RATE_LIMIT_CODE = 'RATE_LIMIT'
+# Calls that create something on Plaid's side. After a 5xx the first attempt may have gone
+# through (a spent public token, a second asset report), so only 429s - never processed - are retried.
+NON_IDEMPOTENT_ENDPOINTS = {
+    '/item/public_token/exchange', '/asset_report/create', '/link/token/create', '/sandbox/public_token/create',
+}
+
+
+class RateLimitExceeded(Exception):
+    """A Plaid call would have to queue longer than PLAID_RATE_LIMIT_MAX_WAIT for its endpoint's quota."""
+
+
+class RetryStats:
+    """Thread-safe per-endpoint counters of throttling and retries in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, endpoint, **counts):
+        with self._lock:
+            stats = self._endpoints.setdefault(endpoint, {
+                'calls': 0, 'throttled': 0, 'throttle_wait_seconds': 0.0,
+                'retries': 0, 'rate_limited': 0, 'rejected': 0, 'gave_up': 0,
+            })
+            for name, value in counts.items():
+                stats[name] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                endpoint: {**stats, 'throttle_wait_seconds': round(stats['throttle_wait_seconds'], 3)}
+                for endpoint, stats in sorted(self._endpoints.items())
+            }
+
+
+_stats = RetryStats()
+
+
+# Calls per minute by endpoint for Plaid calls made inside rate_limits(), ahead of the settings
+_limit_overrides = ContextVar('plaid_rate_limit_overrides', default={})
+
+
+@contextmanager
+def rate_limits(limits):
+    """
+    Apply `limits` ({endpoint: calls per minute}) instead of PLAID_RATE_LIMITS to the Plaid
+    calls made in this block (and thread), e.g. a command's --rate-limit, without touching settings.
+    """
+    token = _limit_overrides.set({**_limit_overrides.get(), **limits})
+    try:
+        yield
+    finally:
+        _limit_overrides.reset(token)
+
+
+def _per_minute(endpoint):
+    overrides = _limit_overrides.get()
+    if endpoint in overrides:
+        return overrides[endpoint]
+    limits = getattr(settings, 'PLAID_RATE_LIMITS', {})
+    return limits.get(endpoint, getattr(settings, 'PLAID_RATE_LIMIT_DEFAULT', 0))
+
+
+def _locked_bucket(endpoint, capacity, now):
+    bucket = PlaidRateBucket.objects.select_for_update().filter(endpoint=endpoint).first()
+    if bucket is not None:
+        return bucket
+    try:
+        with transaction.atomic():
+            return PlaidRateBucket.objects.create(endpoint=endpoint, tokens=capacity, updated_at=now)
+    except IntegrityError:
+        # Another worker created it first
+        return PlaidRateBucket.objects.select_for_update().get(endpoint=endpoint)
+
+
+def acquire(endpoint):
+    """
+    Reserve one call on `endpoint`'s bucket and return how many seconds the
+    caller must wait before making it (0 while there is quota to spare).
+    The row lock is held only for this read-modify-write, not for the wait.
+    Raises RateLimitExceeded rather than queue past PLAID_RATE_LIMIT_MAX_WAIT.
+    """
+    per_minute = _per_minute(endpoint)
+    if not per_minute:
+        return 0.0
+    rate = per_minute / 60
+    capacity = max(getattr(settings, 'PLAID_RATE_LIMIT_BURST', 10), 1)
+
+    with transaction.atomic():
+        now = timezone.now()
+        bucket = _locked_bucket(endpoint, capacity, now)
+        elapsed = max((now - bucket.updated_at).total_seconds(), 0.0)
+        tokens = min(capacity, bucket.tokens + elapsed * rate)
+        wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+        if wait > getattr(settings, 'PLAID_RATE_LIMIT_MAX_WAIT', 10.0):
+            raise RateLimitExceeded(f"Plaid {endpoint} quota exhausted; next slot in {wait:.1f}s")
+        bucket.tokens = tokens - 1
+        bucket.updated_at = now
+        bucket.save(update_fields=['tokens', 'updated_at'])
+    return wait
+
+
+def penalize(endpoint):
+    """Plaid says we are over quota: empty the bucket so every worker backs off until it refills."""
+    if not _per_minute(endpoint):
+        return
+    with transaction.atomic():
+        now = timezone.now()
+        bucket = _locked_bucket(endpoint, 0.0, now)
+        bucket.tokens = min(bucket.tokens, 0.0)
+        bucket.updated_at = now
+        bucket.save(update_fields=['tokens', 'updated_at'])
+
+
+def plaid_error(exc):
+    """The Plaid error body (error_type, error_code, ...) of an ApiException, or {}."""
+    try:
+        return json.loads(exc.body)
+    except (TypeError, ValueError, AttributeError):
+        return {}
+
+
+def _retry_after(exc):
+    headers = getattr(exc, 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def is_retryable(exc):
+    status = getattr(exc, 'status', None)
+    return status in RETRYABLE_STATUSES or plaid_error(exc).get('error_code') in RETRYABLE_ERROR_CODES
+
+
+def should_retry(endpoint, exc):
+    if endpoint in NON_IDEMPOTENT_ENDPOINTS:
+        return getattr(exc, 'status', None) == 429
+    return is_retryable(exc)
+
+
+def call_with_retries(endpoint, func, deadline=None):
+    """
+    Call `func()` (one HTTP request to Plaid's `endpoint`) under the endpoint's
+    rate limit, retrying retryable Plaid errors (only 429s for NON_IDEMPOTENT_ENDPOINTS)
+    up to PLAID_RETRY_ATTEMPTS calls in total. Waits grow exponentially with full jitter, and never undercut a
+    Retry-After header. The last error is re-raised when attempts run out, or as soon as
+    the `deadline` (default: the current request's) leaves no room for the wait plus
+    another PLAID_READ_TIMEOUT attempt.
+    """
+    from plaid import ApiException
+
+    attempts = max(getattr(settings, 'PLAID_RETRY_ATTEMPTS', 4), 1)
+    base = getattr(settings, 'PLAID_RETRY_BASE_DELAY', 0.5)
+    cap = getattr(settings, 'PLAID_RETRY_MAX_DELAY', 8.0)
+    attempt_timeout = getattr(settings, 'PLAID_READ_TIMEOUT', 20.0)
+    if deadline is None:
+        deadline = current_deadline()
+
+    for attempt in range(attempts):
+        try:
+            wait = acquire(endpoint)
+            if deadline is not None and wait >= deadline.remaining():
+                raise RateLimitExceeded(f"Plaid {endpoint} quota exhausted; next slot in {wait:.1f}s is past the request deadline")
+        except RateLimitExceeded:
+            _stats.record(endpoint, rejected=1)
+            raise
+        if wait:
+            _stats.record(endpoint, throttled=1, throttle_wait_seconds=wait)
+            time.sleep(wait)
+
+        _stats.record(endpoint, calls=1)
+        try:
+            return func()
+        except ApiException as e:
+            if not should_retry(endpoint, e):
+                raise
+            error_code = plaid_error(e).get('error_code')
+            if e.status == 429:
+                _stats.record(endpoint, rate_limited=1)
+                if error_code == CLIENT_RATE_LIMIT_CODE:
+                    penalize(endpoint)
+            delay = max(backoff_delay(attempt, base, cap), _retry_after(e))
+            if attempt == attempts - 1 or (deadline is not None and deadline.remaining() < delay + attempt_timeout):
+                _stats.record(endpoint, gave_up=1)
+                raise
+            logger.warning(
+                f"Plaid {endpoint} failed with {e.status} {error_code or ''}; "
+                f"retry {attempt + 1}/{attempts - 1} in {delay:.2f}s"
+            )
+            _stats.record(endpoint, retries=1)
+            time.sleep(delay)
+
+
+def get_plaid_retry_stats():
+    return _stats.snapshot()
@@ -0,0 +1,101 @@
+"""
+Lightweight records for the hot Plaid responses.
+In raw mode (PLAID_RAW_RESPONSES) PlaidService parses the JSON of
+/accounts/get, /accounts/balance/get, /transactions/get and
+/transactions/sync straight into these slotted classes, skipping
+plaid-python's generated models, which type-check and convert every
+field of every object. Records keep the dict-style access
+(account['name'], balances.get('current')) the callers already use; fields
+without a slot are kept unconverted, so nothing Plaid sent is lost.
+"""
+from datetime import date
+
+
+def _date(value):
+    return date.fromisoformat(value)
+
+
+class Record:
+    """
+    Read-only view of one Plaid JSON object: its known fields in slots (missing
+    ones as None), any other fields Plaid sent kept as they came in `_extra`.
+    """
+    __slots__ = ('_extra',)
+    # Field name -> function applied to non-null values (nested records, dates)
+    _convert = {}
+    _fields = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._fields = frozenset(cls.__slots__)
+
+    def __init__(self, data):
+        for name in self.__slots__:
+            value = data.get(name)
+            if value is not None and name in self._convert:
+                value = self._convert[name](value)
+            setattr(self, name, value)
+        extra = data.keys() - self._fields
+        self._extra = {name: data[name] for name in extra} if extra else None
+
+    def __getitem__(self, name):
+        if name in self._fields:
+            return getattr(self, name)
+        if self._extra and name in self._extra:
+            return self._extra[name]
+        raise KeyError(name)
+
+    def __contains__(self, name):
+        # Like the SDK models, a field counts as present only when it has a value
+        if name in self._fields:
+            return getattr(self, name) is not None
+        return bool(self._extra) and name in self._extra
+
+    def get(self, name, default=None):
+        if name in self._fields:
+            value = getattr(self, name)
+            return default if value is None else value
+        return self._extra.get(name, default) if self._extra else default
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self._extra == other._extra and all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def to_dict(self):
+        data = {
+            name: value.to_dict() if isinstance(value, Record) else value
+            for name, value in ((name, getattr(self, name)) for name in self.__slots__)
+        }
+        if self._extra:
+            data.update(self._extra)
+        return data
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+class Balances(Record):
+    __slots__ = ('available', 'current', 'limit', 'iso_currency_code', 'unofficial_currency_code')
+
+
+class Account(Record):
+    __slots__ = ('account_id', 'balances', 'mask', 'name', 'official_name', 'type', 'subtype')
+    _convert = {'balances': Balances}
+
+
+class Transaction(Record):
+    __slots__ = (
+        'transaction_id', 'account_id', 'amount', 'iso_currency_code', 'unofficial_currency_code',
+        'date', 'authorized_date', 'name', 'merchant_name', 'category', 'category_id',
+        'payment_channel', 'pending', 'pending_transaction_id', 'personal_finance_category',
+    )
+    _convert = {'date': _date, 'authorized_date': _date}
+
+
+def accounts(data):
+    return [Account(account) for account in data['accounts']]
+
+
+def transactions(items):
+    return [Transaction(transaction) for transaction in items]
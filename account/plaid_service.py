@@ -1,39 +1,143 @@
 try:
     from plaid.api import plaid_api
+    from plaid import ApiException
     from plaid.model.transactions_get_request import TransactionsGetRequest
+    from plaid.model.transactions_get_request_options import TransactionsGetRequestOptions
+    from plaid.model.transactions_sync_request import TransactionsSyncRequest
     from plaid.model.accounts_get_request import AccountsGetRequest
+    from plaid.model.accounts_balance_get_request import AccountsBalanceGetRequest
     from plaid.model.item_public_token_exchange_request import ItemPublicTokenExchangeRequest
+    from plaid.model.item_remove_request import ItemRemoveRequest
     from plaid.model.link_token_create_request import LinkTokenCreateRequest
     from plaid.model.link_token_create_request_user import LinkTokenCreateRequestUser
     from plaid.model.country_code import CountryCode
     from plaid.model.products import Products
+    from plaid.model.webhook_verification_key_get_request import WebhookVerificationKeyGetRequest
+    from plaid.model.asset_report_create_request import AssetReportCreateRequest
+    from plaid.model.asset_report_create_request_options import AssetReportCreateRequestOptions
+    from plaid.model.asset_report_get_request import AssetReportGetRequest
     from .plaid_utils import get_plaid_client
+    from . import plaid_records
     PLAID_AVAILABLE = True
 except ImportError:
     PLAID_AVAILABLE = False
     print("Plaid SDK not available. Install with: pip install plaid-python")
 
 from django.conf import settings
+from django.db import connection
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, wait
+import json
 import logging
+import threading
+
+from .resilience import current_deadline, deadline_scope
 
 logger = logging.getLogger(__name__)
 
+_fetch_executor = None
+_fetch_executor_lock = threading.Lock()
+
+
+def _get_fetch_executor():
+    """Threads shared by all concurrent Plaid fetches in this worker process."""
+    global _fetch_executor
+    if _fetch_executor is None:
+        with _fetch_executor_lock:
+            if _fetch_executor is None:
+                _fetch_executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'PLAID_FETCH_MAX_WORKERS', 16),
+                    thread_name_prefix='plaid-fetch',
+                )
+    return _fetch_executor
+
+
+def _run_in_pool(func, args, deadline):
+    try:
+        # Pool threads don't inherit the request's context; carry its deadline over
+        with deadline_scope(deadline):
+            return func(*args)
+    finally:
+        # Pool threads outlive requests; don't leave their DB connections open
+        connection.close()
+
 
 class PlaidService:
-    def __init__(self):
+    def __init__(self, replay=None, raw=None):
+        # Replay mode serves archived responses (see plaid_archive) instead of calling Plaid
+        self.replay = getattr(settings, 'PLAID_REPLAY', False) if replay is None else replay
+        # Raw mode parses accounts/transactions JSON into plaid_records instead of SDK models
+        self.raw = getattr(settings, 'PLAID_RAW_RESPONSES', True) if raw is None else raw
         if not PLAID_AVAILABLE:
             self.client = None
             return
         # Use the working Plaid client from plaid_utils
         try:
-            self.client = get_plaid_client()
+            self.client = get_plaid_client(replay=self.replay)
         except Exception as e:
             logger.error(f"Failed to initialize Plaid client: {e}")
             self.client = None
 
+    def _raw_json(self, endpoint, request):
+        """Call an SDK endpoint but skip its response model: the body parsed with json.loads."""
+        response = endpoint(request, _preload_content=False)
+        try:
+            return json.loads(response.data)
+        finally:
+            response.release_conn()
+
+    def fetch_concurrently(self, calls, deadline=None, timeout=None):
+        """
+        Run independent calls in parallel so the wait is the slowest call, not the sum.
+        `calls` maps a name to (callable, *args), e.g. {'accounts': (self.get_accounts, token)}.
+        Waits at most `timeout` seconds (PLAID_FETCH_TIMEOUT), capped by what is left of
+        the request `deadline`. Returns (results, errors) keyed by name; a call still
+        running at the deadline is reported as a TimeoutError.
+        """
+        if timeout is None:
+            timeout = getattr(settings, 'PLAID_FETCH_TIMEOUT', 25.0)
+        if deadline is None:
+            deadline = current_deadline()
+        if deadline is not None:
+            timeout = deadline.timeout(cap=timeout)
+
+        executor = _get_fetch_executor()
+        futures = {
+            executor.submit(_run_in_pool, call[0], call[1:], deadline): name
+            for name, call in calls.items()
+        }
+        _, not_done = wait(futures, timeout=timeout)
+
+        results, errors = {}, {}
+        for future, name in futures.items():
+            if future in not_done:
+                future.cancel()
+                errors[name] = TimeoutError(f"Plaid call '{name}' did not finish within {timeout:.1f}s")
+            elif future.exception() is not None:
+                errors[name] = future.exception()
+            else:
+                results[name] = future.result()
+        return results, errors
+
+    def fetch_per_connection(self, plaid_connections, func, *args, deadline=None):
+        """
+        Call `func(plaid_connection, *args)` for each of an application's connections
+        (one per bank item) in parallel via fetch_concurrently, so more banks don't
+        add up to a longer wait. Returns the results in connection order; if any
+        item fails, the first failure is raised rather than returning part of the data.
+        A single connection goes through the pool too, so the deadline still bounds it.
+        """
+        results, errors = self.fetch_concurrently({
+            plaid_connection.id: (func, plaid_connection, *args)
+            for plaid_connection in plaid_connections
+        }, deadline=deadline)
+        for plaid_connection in plaid_connections:
+            if plaid_connection.id in errors:
+                raise errors[plaid_connection.id]
+        return [results[plaid_connection.id] for plaid_connection in plaid_connections]
+
     def create_link_token(self, user_id, user_name=None):
-        """Create a link token for Plaid Link"""
+        """Create a link token for Plaid Link; returns {'link_token', 'expiration'}"""
         if not PLAID_AVAILABLE or not self.client:
             raise Exception("Plaid SDK not available. Install with: pip install plaid-python")
         try:
@@ -42,15 +146,24 @@ class PlaidService:
             # Use only assets product (single flow requirement)
             products_list = [Products('assets')]
                 
+            request_kwargs = {}
+            if getattr(settings, 'PLAID_WEBHOOK_URL', None):
+                # Plaid notifies us of item/transaction/asset changes for items linked with this token
+                request_kwargs['webhook'] = settings.PLAID_WEBHOOK_URL
+                
             request = LinkTokenCreateRequest(
                 products=products_list,
                 client_name="Mortgage Application",
                 country_codes=[CountryCode('US')],
                 language='en',
-                user=LinkTokenCreateRequestUser(client_user_id=str(user_id))
+                user=LinkTokenCreateRequestUser(client_user_id=str(user_id)),
+                **request_kwargs
             )
             response = self.client.link_token_create(request)
-            return response['link_token']
+            return {
+                'link_token': response['link_token'],
+                'expiration': response['expiration']
+            }
         except Exception as e:
             logger.error(f"Error creating link token: {e}")
             raise
@@ -70,39 +183,193 @@ class PlaidService:
             logger.error(f"Error exchanging public token: {e}")
             raise
 
+    def remove_item(self, access_token):
+        """Remove the item at Plaid, revoking `access_token` (and ending its billing)"""
+        if not PLAID_AVAILABLE or not self.client:
+            raise Exception("Plaid SDK not available. Install with: pip install plaid-python")
+        try:
+            self.client.item_remove(ItemRemoveRequest(access_token=access_token))
+        except Exception as e:
+            logger.error(f"Error removing item: {e}")
+            raise
+
     def get_accounts(self, access_token):
         """Get account information"""
+        return self.get_item_accounts(access_token)[0]
+
+    def get_item_accounts(self, access_token):
+        """Get account information and the item's institution: (accounts, institution_id)"""
         if not PLAID_AVAILABLE or not self.client:
             raise Exception("Plaid SDK not available. Install with: pip install plaid-python")
         try:
             request = AccountsGetRequest(access_token=access_token)
+            if self.raw:
+                data = self._raw_json(self.client.accounts_get, request)
+                return plaid_records.accounts(data), (data.get('item') or {}).get('institution_id')
             response = self.client.accounts_get(request)
-            return response['accounts']
+            return response['accounts'], response['item'].get('institution_id')
         except Exception as e:
             logger.error(f"Error getting accounts: {e}")
             raise
 
+    def get_balances(self, access_token):
+        """Get accounts with balances fetched from the institution now (/accounts/balance/get)"""
+        if not PLAID_AVAILABLE or not self.client:
+            raise Exception("Plaid SDK not available. Install with: pip install plaid-python")
+        try:
+            request = AccountsBalanceGetRequest(access_token=access_token)
+            if self.raw:
+                return plaid_records.accounts(self._raw_json(self.client.accounts_balance_get, request))
+            response = self.client.accounts_balance_get(request)
+            return response['accounts']
+        except Exception as e:
+            logger.error(f"Error getting balances: {e}")
+            raise
+
+    def iter_transactions(self, access_token, start_date=None, end_date=None, page_size=None):
+        """
+        Yield transactions (newest first) for the past 30 days or specified date range,
+        fetching `page_size` at a time with count/offset. Only one page is held in memory,
+        and a caller that stops iterating early stops the paging.
+        """
+        if not PLAID_AVAILABLE or not self.client:
+            raise Exception("Plaid SDK not available. Install with: pip install plaid-python")
+        if not start_date:
+            start_date = datetime.now().date() - timedelta(days=30)
+        if not end_date:
+            end_date = datetime.now().date()
+        page_size = min(page_size or getattr(settings, 'PLAID_TRANSACTIONS_PAGE_SIZE', 500), 500)  # Plaid's max
+
+        offset = 0
+        while True:
+            try:
+                request = TransactionsGetRequest(
+                    access_token=access_token,
+                    start_date=start_date,
+                    end_date=end_date,
+                    options=TransactionsGetRequestOptions(count=page_size, offset=offset)
+                )
+                if self.raw:
+                    response = self._raw_json(self.client.transactions_get, request)
+                    page = plaid_records.transactions(response['transactions'])
+                else:
+                    response = self.client.transactions_get(request)
+                    page = response['transactions']
+            except Exception as e:
+                logger.error(f"Error getting transactions: {e}")
+                raise
+
+            yield from page
+            offset += len(page)
+            if not page or offset >= response['total_transactions']:
+                return
+
     def get_transactions(self, access_token, start_date=None, end_date=None):
-        """Get transactions for the past 30 days or specified date range"""
+        """Get all transactions for the past 30 days or specified date range"""
+        return list(self.iter_transactions(access_token, start_date, end_date))
+
+    def get_webhook_verification_key(self, key_id):
+        """Get the JWK Plaid signs webhooks with, by the JWT's key id"""
         if not PLAID_AVAILABLE or not self.client:
             raise Exception("Plaid SDK not available. Install with: pip install plaid-python")
         try:
-            if not start_date:
-                start_date = datetime.now().date() - timedelta(days=30)
-            if not end_date:
-                end_date = datetime.now().date()
-            
-            request = TransactionsGetRequest(
-                access_token=access_token,
-                start_date=start_date,
-                end_date=end_date
+            request = WebhookVerificationKeyGetRequest(key_id=key_id)
+            response = self.client.webhook_verification_key_get(request)
+            return response['key'].to_dict()
+        except Exception as e:
+            logger.error(f"Error getting webhook verification key: {e}")
+            raise
+
+    def create_asset_report(self, access_token, days_requested, webhook=None):
+        """Start generating an Asset Report; returns {'asset_report_token', 'asset_report_id'}"""
+        if not PLAID_AVAILABLE or not self.client:
+            raise Exception("Plaid SDK not available. Install with: pip install plaid-python")
+        try:
+            request_kwargs = {}
+            if webhook:
+                # Plaid sends ASSETS PRODUCT_READY (or ERROR) here when the report is done
+                request_kwargs['options'] = AssetReportCreateRequestOptions(webhook=webhook)
+            request = AssetReportCreateRequest(
+                access_tokens=[access_token],
+                days_requested=days_requested,
+                **request_kwargs
             )
-            response = self.client.transactions_get(request)
-            return response['transactions']
+            response = self.client.asset_report_create(request)
+            return {
+                'asset_report_token': response['asset_report_token'],
+                'asset_report_id': response['asset_report_id']
+            }
+        except Exception as e:
+            logger.error(f"Error creating asset report: {e}")
+            raise
+
+    def get_asset_report(self, asset_report_token):
+        """Get a generated Asset Report as a dict; raises PRODUCT_NOT_READY while Plaid is still building it"""
+        if not PLAID_AVAILABLE or not self.client:
+            raise Exception("Plaid SDK not available. Install with: pip install plaid-python")
+        try:
+            request = AssetReportGetRequest(asset_report_token=asset_report_token)
+            response = self.client.asset_report_get(request)
+            return response['report'].to_dict()
+        except ApiException as e:
+            if 'PRODUCT_NOT_READY' not in str(e.body):
+                logger.error(f"Error getting asset report: {e}")
+            raise
         except Exception as e:
-            logger.error(f"Error getting transactions: {e}")
+            logger.error(f"Error getting asset report: {e}")
             raise
 
+    def _sync_transaction_pages(self, access_token, cursor):
+        added, modified, removed = [], [], []
+        next_cursor = cursor
+        has_more = True
+        while has_more:
+            request_kwargs = {'cursor': next_cursor} if next_cursor else {}
+            request = TransactionsSyncRequest(
+                access_token=access_token,
+                count=getattr(settings, 'PLAID_TRANSACTIONS_SYNC_PAGE_SIZE', 500),
+                **request_kwargs
+            )
+            if self.raw:
+                response = self._raw_json(self.client.transactions_sync, request)
+                response['added'] = plaid_records.transactions(response['added'])
+                response['modified'] = plaid_records.transactions(response['modified'])
+            else:
+                response = self.client.transactions_sync(request)
+            added.extend(transaction.to_dict() for transaction in response['added'])
+            modified.extend(transaction.to_dict() for transaction in response['modified'])
+            removed.extend(transaction['transaction_id'] for transaction in response['removed'])
+            next_cursor = response['next_cursor']
+            has_more = response['has_more']
+        return {
+            'added': added,
+            'modified': modified,
+            'removed': removed,
+            'next_cursor': next_cursor
+        }
+
+    def sync_transactions(self, access_token, cursor=''):
+        """
+        Get transaction changes since `cursor` ('' = full history) via /transactions/sync.
+        Follows has_more to the end and returns {'added', 'modified', 'removed', 'next_cursor'};
+        added/modified are dicts, removed are transaction ids.
+        """
+        if not PLAID_AVAILABLE or not self.client:
+            raise Exception("Plaid SDK not available. Install with: pip install plaid-python")
+        attempts = 3
+        for attempt in range(attempts):
+            try:
+                return self._sync_transaction_pages(access_token, cursor)
+            except ApiException as e:
+                # Plaid asks to restart from the original cursor if data changed mid-pagination
+                if 'TRANSACTIONS_SYNC_MUTATION_DURING_PAGINATION' in str(e.body) and attempt < attempts - 1:
+                    continue
+                logger.error(f"Error syncing transactions: {e}")
+                raise
+            except Exception as e:
+                logger.error(f"Error syncing transactions: {e}")
+                raise
+
     def create_sandbox_public_token(self, institution_id="ins_3", initial_products=None):
         """Create a sandbox public token for testing"""
         if not PLAID_AVAILABLE or not self.client:
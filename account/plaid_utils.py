@@ -1,33 +1,162 @@
 try:
+    import urllib3
     from plaid.api import plaid_api
     from plaid.configuration import Configuration, Environment
     from plaid.api_client import ApiClient
+    from plaid.rest import RESTClientObject, RESTResponse
     PLAID_AVAILABLE = True
 except ImportError:
     PLAID_AVAILABLE = False
 
+import logging
+import socket
+import threading
+from urllib.parse import urlsplit
+
 from django.conf import settings
 
+from .plaid_archive import archive_response, is_archiving, replay_response
+from .plaid_rate_limits import call_with_retries
+from .resilience import current_deadline
 
-def get_plaid_client():
-    """Get configured Plaid API client"""
-    if not PLAID_AVAILABLE:
-        raise Exception("Plaid SDK not available. Install with: pip install plaid-python")
-        
+logger = logging.getLogger(__name__)
+
+_client = None
+_replay_client = None
+_client_lock = threading.Lock()
+
+
+if PLAID_AVAILABLE:
+    class _TimeoutRESTClient(RESTClientObject):
+        """
+        Applies the configured (connect, read) timeouts, cut to what is left of the request
+        deadline, to calls that don't pass their own, sends every call through the
+        per-endpoint rate limit and retry policy, and archives the raw responses of
+        PLAID_ARCHIVE_ENDPOINTS.
+        """
+
+        def __init__(self, configuration, timeout):
+            super().__init__(configuration)
+            self.default_timeout = timeout
+
+        def _timeout(self, deadline):
+            if deadline is None:
+                return self.default_timeout
+            return tuple(deadline.timeout(cap=seconds) for seconds in self.default_timeout)
+
+        def request(self, method, url, *args, _request_timeout=None, **kwargs):
+            endpoint = urlsplit(url).path
+            deadline = current_deadline()
+            # The lambda runs once per attempt, so each retry gets only the time still left
+            response = call_with_retries(
+                endpoint,
+                lambda: super(_TimeoutRESTClient, self).request(
+                    method, url, *args, _request_timeout=_request_timeout or self._timeout(deadline), **kwargs
+                ),
+                deadline=deadline,
+            )
+            # Only read the body here when it is archived; otherwise the caller reads it when it wants it
+            if is_archiving(endpoint):
+                try:
+                    archive_response(endpoint, kwargs.get('body'), response.data)
+                except Exception as e:
+                    # The archive is a copy; the caller still gets its data
+                    logger.warning(f"Archiving Plaid {endpoint} response failed: {e}")
+            return response
+
+    class _ReplayRESTClient(RESTClientObject):
+        """Answers every call from the PlaidResponseArchive (replay mode); nothing is sent to Plaid."""
+
+        def request(self, method, url, *args, body=None, _preload_content=True, **kwargs):
+            response = urllib3.HTTPResponse(
+                body=replay_response(urlsplit(url).path, body),
+                status=200,
+                headers={'Content-Type': 'application/json'},
+                preload_content=True,
+            )
+            return RESTResponse(response) if _preload_content else response
+
+
+def _plaid_host():
+    if getattr(settings, 'PLAID_HOST', None):
+        return settings.PLAID_HOST
     if settings.PLAID_ENV == 'sandbox':
-        host = Environment.Sandbox
+        return Environment.Sandbox
     elif settings.PLAID_ENV == 'development':
-        host = Environment.Development
-    else:
-        host = Environment.Production
-    
+        return Environment.Development
+    return Environment.Production
+
+
+def _build_plaid_client(replay=False):
+    from urllib3.connection import HTTPConnection
+
     configuration = Configuration(
-        host=host,
+        host=_plaid_host(),
         api_key={
             'clientId': settings.PLAID_CLIENT_ID,
             'secret': settings.PLAID_SECRET
         }
     )
-    
+    # One pooled connection per concurrent Plaid call this worker can make
+    configuration.connection_pool_maxsize = getattr(settings, 'PLAID_POOL_SIZE', 16)
+    # TCP keep-alive so idle pooled connections are not silently dropped by NATs/load balancers
+    configuration.socket_options = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+
     api_client = ApiClient(configuration)
+    if replay:
+        api_client.rest_client = _ReplayRESTClient(configuration)
+    else:
+        api_client.rest_client = _TimeoutRESTClient(
+            configuration,
+            (getattr(settings, 'PLAID_CONNECT_TIMEOUT', 5.0), getattr(settings, 'PLAID_READ_TIMEOUT', 20.0)),
+        )
     return plaid_api.PlaidApi(api_client)
+
+
+def get_plaid_client(replay=False):
+    """
+    Process-wide Plaid API client, built on first use.
+    PlaidApi is thread-safe and its urllib3 pool keeps connections alive
+    between requests, so every PlaidService shares this one.
+    With `replay` it is the client that answers from the response archive.
+    """
+    global _client, _replay_client
+    if not PLAID_AVAILABLE:
+        raise Exception("Plaid SDK not available. Install with: pip install plaid-python")
+
+    if replay:
+        if _replay_client is None:
+            with _client_lock:
+                if _replay_client is None:
+                    _replay_client = _build_plaid_client(replay=True)
+        return _replay_client
+
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _build_plaid_client()
+    return _client
+
+
+def get_plaid_pool_stats():
+    """Connections opened vs. requests sent through the shared Plaid client's pools."""
+    if _client is None:
+        return {'initialized': False}
+
+    pool_manager = _client.api_client.rest_client.pool_manager
+    connections_opened = 0
+    requests_sent = 0
+    for key in pool_manager.pools.keys():
+        pool = pool_manager.pools.get(key)
+        if pool is None:
+            continue
+        connections_opened += pool.num_connections
+        requests_sent += pool.num_requests
+    return {
+        'initialized': True,
+        'pool_size': _client.api_client.configuration.connection_pool_maxsize,
+        'connections_opened': connections_opened,
+        'requests': requests_sent,
+        'reused': max(requests_sent - connections_opened, 0),
+        'reuse_ratio': round(1 - connections_opened / requests_sent, 4) if requests_sent else 0.0,
+    }
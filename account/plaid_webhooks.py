@@ -0,0 +1,161 @@
+"""
+Plaid webhook handling: signature verification, dropping repeated
+deliveries, and keeping cached item data fresh so reads can use long
+snapshot TTLs instead of re-fetching from Plaid every time.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import time
+from datetime import timedelta
+
+import jwt
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .account_snapshots import get_account_snapshot, invalidate_account_snapshot
+from .asset_reports import handle_asset_report_webhook
+from .models import PlaidConnection, PlaidWebhookEvent
+from .plaid_service import PlaidService
+from .transactions import sync_transactions
+
+logger = logging.getLogger(__name__)
+
+# Webhooks after which the item's balances have likely changed and are worth refetching
+REFRESH_WEBHOOK_TYPES = {'TRANSACTIONS', 'HOLDINGS', 'INVESTMENTS_TRANSACTIONS'}
+REFRESH_ITEM_CODES = {'NEW_ACCOUNTS_AVAILABLE', 'LOGIN_REPAIRED'}
+
+
+class WebhookVerificationError(Exception):
+    """The request is not a genuine, recent Plaid webhook."""
+
+
+_verification_keys = {}  # key id -> (JWK, time.monotonic() when fetched)
+_verification_keys_lock = threading.Lock()
+
+
+def _verification_key(key_id):
+    """
+    Plaid's JWK for `key_id`. Keys are cached per process for PLAID_WEBHOOK_KEY_TTL
+    seconds and then refetched, so a key Plaid has since rotated out (expired_at
+    set) stops being accepted.
+    """
+    ttl = getattr(settings, 'PLAID_WEBHOOK_KEY_TTL', 600)
+    with _verification_keys_lock:
+        key, fetched_at = _verification_keys.get(key_id, (None, 0))
+    if key is None or time.monotonic() - fetched_at > ttl:
+        key = PlaidService().get_webhook_verification_key(key_id)
+        with _verification_keys_lock:
+            _verification_keys[key_id] = (key, time.monotonic())
+    return key
+
+
+def verify_webhook(body: bytes, token: str):
+    """
+    Check the Plaid-Verification JWT: ES256 signature by a current Plaid key,
+    issued within PLAID_WEBHOOK_MAX_AGE seconds, over exactly this body.
+    Raises WebhookVerificationError otherwise.
+    """
+    if not token:
+        raise WebhookVerificationError("Missing Plaid-Verification header")
+
+    try:
+        header = jwt.get_unverified_header(token)
+    except jwt.PyJWTError as e:
+        raise WebhookVerificationError(f"Malformed verification token: {e}")
+    if header.get('alg') != 'ES256':
+        raise WebhookVerificationError(f"Unexpected signing algorithm: {header.get('alg')}")
+
+    try:
+        key = _verification_key(header.get('kid'))
+    except Exception as e:
+        raise WebhookVerificationError(f"Could not fetch verification key: {e}")
+    if key.get('expired_at'):
+        raise WebhookVerificationError("Verification key has expired")
+
+    try:
+        claims = jwt.decode(token, jwt.algorithms.ECAlgorithm.from_jwk(json.dumps(key)), algorithms=['ES256'])
+    except jwt.PyJWTError as e:
+        raise WebhookVerificationError(f"Invalid signature: {e}")
+
+    if time.time() - claims.get('iat', 0) > getattr(settings, 'PLAID_WEBHOOK_MAX_AGE', 300):
+        raise WebhookVerificationError("Webhook is too old")
+    if not hmac.compare_digest(claims.get('request_body_sha256', ''), hashlib.sha256(body).hexdigest()):
+        raise WebhookVerificationError("Body does not match the signed hash")
+
+
+def record_delivery(body: bytes, payload: dict) -> bool:
+    """
+    Remember this delivery; False if an identical body was already received
+    within PLAID_WEBHOOK_DEDUP_SECONDS (a retry), so it should be skipped.
+    """
+    body_sha256 = hashlib.sha256(body).hexdigest()
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            PlaidWebhookEvent.objects.create(
+                body_sha256=body_sha256,
+                item_id=payload.get('item_id') or '',
+                webhook_type=payload.get('webhook_type', ''),
+                webhook_code=payload.get('webhook_code', ''),
+                received_at=now,
+            )
+        return True
+    except IntegrityError:
+        # Seen before; outside the window an identical body is a new event
+        window_start = now - timedelta(seconds=getattr(settings, 'PLAID_WEBHOOK_DEDUP_SECONDS', 3600))
+        return PlaidWebhookEvent.objects.filter(
+            body_sha256=body_sha256, received_at__lt=window_start
+        ).update(received_at=now) > 0
+
+
+def _refresh_item(connection_id, sync=False):
+    try:
+        plaid_connection = PlaidConnection.objects.get(id=connection_id)
+        get_account_snapshot(plaid_connection, fresh=True)
+        if sync:
+            sync_transactions(plaid_connection)
+    except Exception as e:
+        logger.warning(f"Webhook refresh failed for Plaid connection {connection_id}: {e}")
+    finally:
+        connection.close()
+
+
+def handle_webhook(payload: dict) -> str:
+    """
+    Act on a verified, first-time webhook. The item's account snapshot is
+    dropped; when the webhook means balances changed it is also refetched in
+    the background so the next read is warm, and TRANSACTIONS webhooks pull
+    the new transactions into the local store. ASSETS webhooks are handed to
+    the Asset Report pipeline. Returns what was done.
+    """
+    item_id = payload.get('item_id')
+    webhook_type = payload.get('webhook_type')
+    webhook_code = payload.get('webhook_code')
+    logger.info(f"Plaid webhook {webhook_type}/{webhook_code} for item {item_id}")
+
+    if webhook_type == 'ASSETS':
+        # Asset Report webhooks name the report, not the item
+        return handle_asset_report_webhook(payload)
+    if not item_id:
+        return 'ignored'
+    plaid_connection = PlaidConnection.objects.filter(item_id=item_id).first()
+    if plaid_connection is None:
+        logger.warning(f"Plaid webhook for unknown item {item_id}")
+        return 'unknown_item'
+
+    invalidate_account_snapshot(item_id)
+
+    refresh = webhook_type in REFRESH_WEBHOOK_TYPES or (webhook_type == 'ITEM' and webhook_code in REFRESH_ITEM_CODES)
+    if refresh and getattr(settings, 'PLAID_WEBHOOK_REFRESH', True):
+        threading.Thread(
+            target=_refresh_item,
+            args=(plaid_connection.id, webhook_type == 'TRANSACTIONS'),
+            name=f'plaid-refresh-{item_id}',
+            daemon=True
+        ).start()
+        return 'refreshing'
+    return 'invalidated'
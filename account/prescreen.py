@@ -0,0 +1,111 @@
+import threading
+
+from django.conf import settings
+
+# Approval criteria, kept in sync with the prompt in aiengine.py
+MAX_DEBT_TO_INCOME = 50.0  # percent
+MIN_DOWN_PAYMENT = 3.0  # percent of purchase price
+RESERVE_MONTHS = 1
+MONTHLY_MORTGAGE_RATE = 0.005  # estimated mortgage = 0.5% of purchase price per month
+
+
+class PrescreenStats:
+    """Thread-safe counters of how many decisions the fast path answered."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.approved = 0
+        self.disapproved = 0
+        self.borderline = 0
+
+    def record(self, decision):
+        with self._lock:
+            if decision == 'approve':
+                self.approved += 1
+            elif decision == 'disapprove':
+                self.disapproved += 1
+            else:
+                self.borderline += 1
+
+    def snapshot(self):
+        with self._lock:
+            total = self.approved + self.disapproved + self.borderline
+            fast_path = self.approved + self.disapproved
+            return {
+                'evaluated': total,
+                'fast_path_approved': self.approved,
+                'fast_path_disapproved': self.disapproved,
+                'sent_to_model': self.borderline,
+                'fast_path_share': round(fast_path / total, 4) if total else 0.0,
+            }
+
+
+_stats = PrescreenStats()
+
+
+def evaluate_rules(inputs: dict) -> dict:
+    """
+    Evaluate the approval criteria locally.
+    Each check reports its value, limit and relative slack: positive slack
+    passes, negative fails, and the magnitude says how far from the limit it is.
+    """
+    annual_income = inputs.get('annual_income') or 0
+    purchase_price = inputs.get('purchase_price') or 0
+    down_payment = inputs.get('down_payment') or 0
+    liquid_assets = inputs.get('liquid_assets') or 0
+
+    monthly_income = annual_income / 12
+    monthly_mortgage = purchase_price * MONTHLY_MORTGAGE_RATE
+    required_reserves = monthly_mortgage * RESERVE_MONTHS
+
+    debt_to_income = (monthly_mortgage / monthly_income * 100) if monthly_income > 0 else float('inf')
+    down_payment_percentage = down_payment / purchase_price * 100 if purchase_price > 0 else 0.0
+
+    return {
+        'debt_to_income': {
+            'value': debt_to_income,
+            'limit': MAX_DEBT_TO_INCOME,
+            'slack': (MAX_DEBT_TO_INCOME - debt_to_income) / MAX_DEBT_TO_INCOME,
+        },
+        'down_payment_percentage': {
+            'value': down_payment_percentage,
+            'limit': MIN_DOWN_PAYMENT,
+            'slack': (down_payment_percentage - MIN_DOWN_PAYMENT) / MIN_DOWN_PAYMENT,
+        },
+        'reserves': {
+            'value': liquid_assets,
+            'limit': required_reserves,
+            'slack': (liquid_assets - required_reserves) / required_reserves if required_reserves > 0 else 0.0,
+        },
+    }
+
+
+def prescreen(inputs: dict, margin: float = None):
+    """
+    Returns 'approve' or 'disapprove' when the rules give a clear-cut answer,
+    or None when any check is within `margin` of its limit and the model
+    should decide. Every call is recorded in the fast-path share metric.
+    """
+    if margin is None:
+        margin = getattr(settings, 'AI_PRESCREEN_MARGIN', 0.10)
+
+    decision = None
+    if (inputs.get('purchase_price') or 0) > 0:
+        slacks = [check['slack'] for check in evaluate_rules(inputs).values()]
+        if any(slack <= -margin for slack in slacks):
+            decision = 'disapprove'
+        elif all(slack >= margin for slack in slacks):
+            decision = 'approve'
+
+    _stats.record(decision)
+    return decision
+
+
+def rule_lean(inputs: dict) -> str:
+    """What the rules say with no margin at all - used to sanity-check a cheap model's answer."""
+    slacks = [check['slack'] for check in evaluate_rules(inputs).values()]
+    return 'approve' if all(slack >= 0 for slack in slacks) else 'disapprove'
+
+
+def get_prescreen_stats():
+    return _stats.snapshot()
@@ -0,0 +1,160 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.utils import timezone
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+
+def backoff_delay(attempt, base, cap):
+    """Exponential backoff with full jitter: a random wait in [0, min(cap, base * 2**attempt)]."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class Deadline:
+    """
+    Absolute time budget for one request.
+    Created when the request arrives (see RequestDeadlineMiddleware) and handed
+    down so every upstream call can size its timeout from what is left.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def timeout(self, cap=None, reserve=0.0):
+        """Seconds an upstream call may take: what is left minus `reserve`, at most `cap`."""
+        available = self.remaining() - reserve
+        if cap is not None:
+            available = min(available, cap)
+        return max(available, 0.0)
+
+
+# The deadline of the request being served, for calls too deep to be handed it (e.g. Plaid retries)
+_current_deadline = ContextVar('request_deadline', default=None)
+
+
+def current_deadline():
+    """The Deadline set by the innermost deadline_scope, or None outside a request."""
+    return _current_deadline.get()
+
+
+@contextmanager
+def deadline_scope(deadline):
+    """Make `deadline` the current_deadline() of calls made in this block (and thread)."""
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    closed    - calls go through; `failure_threshold` failures in a row trip it
+    open      - calls fail fast with CircuitOpenError for `recovery_timeout` seconds
+    half_open - one probe call is let through; success closes, failure re-opens
+    """
+
+    def __init__(self, name, failure_threshold=5, recovery_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._lock = threading.Lock()
+        self._state = 'closed'
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.consecutive_failures = 0
+        self.trips = 0
+        self.short_circuited = 0
+        self.last_trip_at = None
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == 'open' and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._state = 'half_open'
+            self._probe_in_flight = False
+        return self._state
+
+    def before_call(self):
+        """Raise CircuitOpenError if the call must not go upstream."""
+        with self._lock:
+            state = self._current_state()
+            if state == 'closed':
+                return
+            if state == 'half_open' and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+            self.short_circuited += 1
+        raise CircuitOpenError(f"Circuit '{self.name}' is open")
+
+    def record_success(self):
+        with self._lock:
+            self._state = 'closed'
+            self._probe_in_flight = False
+            self.consecutive_failures = 0
+
+    def record_cancelled(self):
+        """The call was abandoned (e.g. lost a hedge race); free the half-open probe slot."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self._state == 'half_open' or self.consecutive_failures >= self.failure_threshold:
+                if self._state != 'open':
+                    self.trips += 1
+                    self.last_trip_at = timezone.now()
+                self._state = 'open'
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'state': self._current_state(),
+                'consecutive_failures': self.consecutive_failures,
+                'failure_threshold': self.failure_threshold,
+                'recovery_timeout': self.recovery_timeout,
+                'trips': self.trips,
+                'short_circuited': self.short_circuited,
+                'last_trip_at': self.last_trip_at.isoformat() if self.last_trip_at else None,
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name, failure_threshold=5, recovery_timeout=30.0):
+    """Process-wide breaker per upstream name, created on first use."""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, failure_threshold, recovery_timeout)
+            _breakers[name] = breaker
+        return breaker
+
+
+def get_breaker_stats():
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.snapshot() for breaker in breakers}
@@ -0,0 +1,97 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+
+class SingleFlight:
+    """
+    In-process request coalescing.
+    The first caller for a key (the leader) runs the work; callers arriving
+    while it is in flight wait for the leader's result or exception instead
+    of repeating the work. Sync and async callers share the same flights.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.waited_on_other_processes = 0
+
+    def _join(self, key):
+        """Returns (future, is_leader)."""
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = Future()
+            self._flights[key] = future
+            self.leaders += 1
+            return future, True
+
+    def _finish(self, key, future, result=None, error=None):
+        with self._lock:
+            self._flights.pop(key, None)
+        if future.done():
+            return
+        if error is not None:
+            if not isinstance(error, Exception):
+                # Leader cancelled or interrupted; followers get a plain error
+                error = RuntimeError(f"In-flight '{key}' was abandoned")
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key, func, timeout=None):
+        """
+        Run func() once for all concurrent callers of `key`.
+        Followers raise TimeoutError if the leader takes longer than `timeout`.
+        """
+        future, leader = self._join(key)
+        if not leader:
+            try:
+                return future.result(timeout)
+            except FutureTimeoutError:
+                raise TimeoutError(f"Timed out waiting for in-flight '{key}'")
+
+        try:
+            result = func()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result=result)
+        return result
+
+    async def ado(self, key, coro_func, timeout=None):
+        """Async counterpart of do(); `coro_func()` returns the coroutine to await."""
+        future, leader = self._join(key)
+        if not leader:
+            try:
+                # Shielded so a follower giving up does not cancel the shared future
+                return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"Timed out waiting for in-flight '{key}'")
+
+        try:
+            result = await coro_func()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result=result)
+        return result
+
+    def record_external_wait(self):
+        """A leader found the work already in flight in another process (e.g. via a lock table)."""
+        with self._lock:
+            self.waited_on_other_processes += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'waited_on_other_processes': self.waited_on_other_processes,
+            }
@@ -1,3 +1,997 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import jwt
+from cryptography.hazmat.primitives.asymmetric import ec
+from django.conf import settings
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from plaid import ApiException
+
+from . import plaid_records
+from .ai_providers import DecisionProvider
+from .aiengine import DecisionUnavailable, PreApprovalEngine
+from .balance_refresh import run_balance_refresh, select_connections
+from .decision_cache import (
+    MemoryDecisionCache, NullDecisionCache, SharedDecisionCache, decision_fingerprint, get_decision_cache,
+)
+from .decisions import resume_stalled_batches, run_decision_batch
+from .link_tokens import get_link_token
+from .models import (
+    BalanceRefreshRun, BalanceSnapshot, DecisionBatch, LoanApplication, PlaidConnection, PlaidRateBucket,
+    PlaidResponseArchive, PlaidWebhookEvent,
+)
+from .plaid_archive import NotArchived, archive_response, archiving_for, prune_archive, replay_response
+from .plaid_items import connect_item
+from .plaid_rate_limits import RateLimitExceeded, acquire, call_with_retries, penalize, rate_limits
+from .plaid_webhooks import WebhookVerificationError, record_delivery, verify_webhook
+from .prescreen import evaluate_rules, prescreen, rule_lean
+from .resilience import CircuitBreaker, CircuitOpenError, Deadline, backoff_delay, deadline_scope
+from .singleflight import SingleFlight
+from .transactions import stored_transactions, sync_if_stale, sync_transactions
+
+
+def _inputs(**overrides):
+    # 1,500/month estimated mortgage; comfortably inside every limit
+    inputs = {'annual_income': 200000, 'purchase_price': 300000, 'down_payment': 60000, 'liquid_assets': 100000}
+    inputs.update(overrides)
+    return inputs
+
+
+class PrescreenTests(SimpleTestCase):
+    def test_clear_cases_are_decided_locally(self):
+        self.assertEqual(prescreen(_inputs()), 'approve')
+        self.assertEqual(prescreen(_inputs(annual_income=20000)), 'disapprove')
+        self.assertEqual(prescreen(_inputs(liquid_assets=0)), 'disapprove')
+
+    def test_checks_within_the_margin_go_to_the_model(self):
+        # Debt-to-income 48% against a 50% limit: 4% slack
+        inputs = _inputs(annual_income=37500)
+        self.assertAlmostEqual(evaluate_rules(inputs)['debt_to_income']['slack'], 0.04)
+        self.assertIsNone(prescreen(inputs, margin=0.10))
+        self.assertEqual(prescreen(inputs, margin=0.02), 'approve')
+        self.assertEqual(rule_lean(inputs), 'approve')
+
+    def test_no_purchase_price_is_left_to_the_model(self):
+        self.assertIsNone(prescreen(_inputs(purchase_price=0)))
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('account.resilience.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker('test', failure_threshold=3, recovery_timeout=30.0)
+
+    def _trip(self):
+        for _ in range(3):
+            self.breaker.before_call()
+            self.breaker.record_failure()
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'closed')
+
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'open')
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+        self.assertEqual(self.breaker.snapshot()['short_circuited'], 1)
+        self.assertEqual(self.breaker.trips, 1)
+
+    def test_half_open_lets_one_probe_through(self):
+        self._trip()
+        self.now += 30.0
+        self.assertEqual(self.breaker.state, 'half_open')
+        self.breaker.before_call()
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, 'closed')
+        self.breaker.before_call()
+
+    def test_failed_probe_reopens(self):
+        self._trip()
+        self.now += 30.0
+        self.breaker.before_call()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'open')
+        self.assertEqual(self.breaker.trips, 2)
+
+    def test_cancelled_probe_frees_the_slot(self):
+        self._trip()
+        self.now += 30.0
+        self.breaker.before_call()
+        self.breaker.record_cancelled()
+        self.breaker.before_call()
+
+
+class BackoffTests(SimpleTestCase):
+    def test_delay_is_jittered_up_to_the_capped_exponential(self):
+        for attempt, ceiling in [(0, 0.5), (1, 1.0), (3, 4.0), (10, 8.0)]:
+            with mock.patch('account.resilience.random.uniform', side_effect=lambda low, high: high):
+                self.assertEqual(backoff_delay(attempt, 0.5, 8.0), ceiling)
+            for _ in range(50):
+                self.assertTrue(0 <= backoff_delay(attempt, 0.5, 8.0) <= ceiling)
+
+    def test_deadline_timeout_is_capped_and_reserved(self):
+        with mock.patch('account.resilience.time.monotonic', return_value=100.0):
+            deadline = Deadline(10)
+        with mock.patch('account.resilience.time.monotonic', return_value=104.0):
+            self.assertEqual(deadline.timeout(), 6.0)
+            self.assertEqual(deadline.timeout(cap=2.5), 2.5)
+            self.assertEqual(deadline.timeout(reserve=1.0), 5.0)
+        with mock.patch('account.resilience.time.monotonic', return_value=111.0):
+            self.assertTrue(deadline.expired())
+            self.assertEqual(deadline.timeout(), 0.0)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def _run_concurrently(self, flights, key, func, callers=5):
+        results, errors = [], []
+
+        def call():
+            try:
+                results.append(flights.do(key, func, timeout=5))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        return threads, results, errors
+
+    def test_concurrent_callers_share_one_call(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def work():
+            calls.append(1)
+            release.wait(5)
+            return 'approve'
+
+        threads, results, errors = self._run_concurrently(flights, 'loan:1', work)
+        while flights.snapshot()['coalesced'] < 4:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual((results, errors, len(calls)), (['approve'] * 5, [], 1))
+        self.assertEqual(flights.snapshot(), {'in_flight': 0, 'leaders': 1, 'coalesced': 4, 'waited_on_other_processes': 0})
+
+    def test_followers_get_the_leaders_error(self):
+        flights = SingleFlight()
+        release = threading.Event()
+
+        def work():
+            release.wait(5)
+            raise ValueError('upstream failed')
+
+        threads, results, errors = self._run_concurrently(flights, 'loan:1', work, callers=3)
+        while flights.snapshot()['coalesced'] < 2:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [])
+        self.assertEqual([str(e) for e in errors], ['upstream failed'] * 3)
+
+    def test_finished_flights_are_not_reused(self):
+        flights = SingleFlight()
+        self.assertEqual(flights.do('key', lambda: 1), 1)
+        self.assertEqual(flights.do('key', lambda: 2), 2)
+        self.assertEqual(flights.snapshot()['leaders'], 2)
+
+    def test_async_callers_join_the_flight(self):
+        flights = SingleFlight()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return 'disapprove'
+
+        async def main():
+            return await asyncio.gather(*(flights.ado('key', work, timeout=5) for _ in range(3)))
+
+        self.assertEqual(asyncio.run(main()), ['disapprove'] * 3)
+        self.assertEqual(len(calls), 1)
+
+
+@override_settings(PLAID_RATE_LIMIT_DEFAULT=60, PLAID_RATE_LIMITS={}, PLAID_RATE_LIMIT_BURST=2, PLAID_RATE_LIMIT_MAX_WAIT=10)
+class TokenBucketTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        patcher = mock.patch('account.plaid_rate_limits.timezone.now', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_then_wait_for_refill(self):
+        self.assertEqual(acquire('/accounts/get'), 0.0)
+        self.assertEqual(acquire('/accounts/get'), 0.0)
+        # Bucket empty: one token a second at 60/minute
+        self.assertAlmostEqual(acquire('/accounts/get'), 1.0)
+        self.assertAlmostEqual(acquire('/accounts/get'), 2.0)
+
+        self.now += timedelta(seconds=10)
+        self.assertEqual(acquire('/accounts/get'), 0.0)
+        # Refill stops at the burst size
+        self.assertAlmostEqual(PlaidRateBucket.objects.get(endpoint='/accounts/get').tokens, 1.0)
+
+    def test_endpoints_have_separate_buckets(self):
+        with override_settings(PLAID_RATE_LIMITS={'/transactions/get': 6}):
+            acquire('/transactions/get')
+            acquire('/transactions/get')
+            self.assertAlmostEqual(acquire('/transactions/get'), 10.0)
+            self.assertEqual(acquire('/accounts/get'), 0.0)
+
+    def test_scoped_limits_apply_without_changing_settings(self):
+        with rate_limits({'/accounts/get': 6}):
+            acquire('/accounts/get')
+            acquire('/accounts/get')
+            self.assertAlmostEqual(acquire('/accounts/get'), 10.0)
+        self.assertEqual(settings.PLAID_RATE_LIMITS, {})
+        # Back to PLAID_RATE_LIMIT_DEFAULT, 60/minute: two tokens short, two seconds
+        self.assertAlmostEqual(acquire('/accounts/get'), 2.0)
+
+    @override_settings(PLAID_RATE_LIMIT_MAX_WAIT=0.5)
+    def test_rejects_rather_than_queue_past_max_wait(self):
+        acquire('/accounts/get')
+        acquire('/accounts/get')
+        with self.assertRaises(RateLimitExceeded):
+            acquire('/accounts/get')
+        # A rejected call doesn't take a token
+        self.now += timedelta(seconds=1)
+        self.assertEqual(acquire('/accounts/get'), 0.0)
+
+    def test_penalize_empties_the_bucket(self):
+        acquire('/accounts/get')
+        penalize('/accounts/get')
+        self.assertAlmostEqual(acquire('/accounts/get'), 1.0)
+
+    @override_settings(PLAID_RATE_LIMIT_DEFAULT=0)
+    def test_unlimited_endpoints_skip_the_database(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(acquire('/accounts/get'), 0.0)
+
+
+@override_settings(PLAID_RATE_LIMIT_DEFAULT=0, PLAID_RETRY_ATTEMPTS=3, PLAID_RETRY_MAX_DELAY=1, PLAID_READ_TIMEOUT=20)
+class PlaidRetryTests(SimpleTestCase):
+    def setUp(self):
+        for target in ('account.plaid_rate_limits.time.sleep', 'account.plaid_rate_limits.logger'):
+            patcher = mock.patch(target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _calls(self, endpoint, status, deadline=None):
+        calls = []
+
+        def func():
+            calls.append(1)
+            error = ApiException(status=status)
+            error.body = '{}'
+            raise error
+
+        with self.assertRaises(ApiException):
+            call_with_retries(endpoint, func, deadline=deadline)
+        return len(calls)
+
+    def test_transient_errors_are_retried(self):
+        self.assertEqual(self._calls('/accounts/get', 503), 3)
+        self.assertEqual(self._calls('/accounts/get', 429), 3)
+        self.assertEqual(self._calls('/accounts/get', 400), 1)
+
+    def test_non_idempotent_calls_are_only_retried_on_429(self):
+        self.assertEqual(self._calls('/item/public_token/exchange', 500), 1)
+        self.assertEqual(self._calls('/asset_report/create', 503), 1)
+        self.assertEqual(self._calls('/item/public_token/exchange', 429), 3)
+
+    def test_returns_once_a_retry_succeeds(self):
+        outcomes = [ApiException(status=502), 'ok']
+        outcomes[0].body = '{}'
+
+        def func():
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        self.assertEqual(call_with_retries('/accounts/get', func), 'ok')
+
+    def test_retries_stop_when_the_deadline_leaves_no_room(self):
+        # A retry needs its wait (at most 1s here) plus a full 20s read timeout
+        self.assertEqual(self._calls('/accounts/get', 503, deadline=Deadline(60)), 3)
+        self.assertEqual(self._calls('/accounts/get', 503, deadline=Deadline(15)), 1)
+        with deadline_scope(Deadline(15)):
+            self.assertEqual(self._calls('/accounts/get', 503), 1)
+
+    def test_throttle_wait_past_the_deadline_is_rejected(self):
+        func = mock.Mock(return_value='ok')
+        with mock.patch('account.plaid_rate_limits.acquire', return_value=5.0):
+            with self.assertRaises(RateLimitExceeded):
+                call_with_retries('/accounts/get', func, deadline=Deadline(2))
+            self.assertEqual(call_with_retries('/accounts/get', func, deadline=Deadline(10)), 'ok')
+        self.assertEqual(func.call_count, 1)
+
+
+def _loan(**overrides):
+    fields = {
+        'full_name': 'Test Applicant', 'email': 'applicant@example.com', 'phone_number': '555-0100',
+        'property_zip_code': '10001', 'property_address': '1 Main St', 'annual_income': 120000,
+        'purchase_price': 400000, 'down_payment': 80000, 'loan_purpose': 'Purchase',
+    }
+    fields.update(overrides)
+    return LoanApplication.objects.create(**fields)
+
+
+class BalanceRefreshSelectionTests(TestCase):
+    def setUp(self):
+        self.loan = _loan()
+        self.other_loan = _loan()
+        self.connections = [
+            PlaidConnection.objects.create(
+                loan_application=self.loan if index < 5 else self.other_loan,
+                access_token=f'access-{index}', item_id=f'item-{index}',
+            )
+            for index in range(6)
+        ]
+        self.refreshed = []
+        self.rate_limits = set()
+
+        def refresh(connection_id, run_id, realtime=True, rate_limit=None):
+            self.refreshed.append(connection_id)
+            self.rate_limits.add(rate_limit)
+            return {'latency_ms': 1.0}
+
+        patcher = mock.patch('account.balance_refresh.refresh_connection', side_effect=refresh)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _ids(self, indexes):
+        return [self.connections[index].id for index in indexes]
+
+    def test_filters(self):
+        self.assertEqual(list(select_connections({'loan_ids': [self.other_loan.id]})), [self.connections[5]])
+        BalanceSnapshot.objects.create(connection=self.connections[0], total_balance=0)
+        fresh = select_connections({'loan_ids': [self.loan.id], 'stale_minutes': 60})
+        self.assertEqual(list(fresh.values_list('id', flat=True)), self._ids(range(1, 5)))
+
+    def test_limit_is_applied_after_leaving_out_refreshed_connections(self):
+        run = BalanceRefreshRun.objects.create(filters={'loan_ids': [self.loan.id], 'limit': 3})
+        run_balance_refresh(run, workers=2)
+        self.assertEqual(sorted(self.refreshed), self._ids(range(3)))
+        run.refresh_from_db()
+        self.assertEqual((run.status, run.total, run.succeeded), ('completed', 3, 3))
+
+    def test_resumed_run_refreshes_only_what_is_left_of_its_limit(self):
+        run = BalanceRefreshRun.objects.create(filters={'limit': 3}, status='interrupted', total=3)
+        BalanceSnapshot.objects.create(connection=self.connections[0], run=run, total_balance=0)
+        run_balance_refresh(run, workers=2)
+        self.assertEqual(sorted(self.refreshed), self._ids([1, 2]))
+        run.refresh_from_db()
+        self.assertEqual((run.total, run.succeeded, run.failed), (3, 3, 0))
+
+    def test_rate_limit_is_passed_to_every_refresh(self):
+        run_balance_refresh(BalanceRefreshRun.objects.create(), workers=2, rate_limit=30)
+        self.assertEqual(len(self.refreshed), 6)
+        self.assertEqual(self.rate_limits, {30})
+
+
+class PlaidRecordTests(SimpleTestCase):
+    ACCOUNTS = {
+        'accounts': [{
+            'account_id': 'acc-1',
+            'balances': {'available': None, 'current': 1250.5, 'limit': None, 'iso_currency_code': 'USD',
+                         'unofficial_currency_code': None, 'last_updated_datetime': None},
+            'mask': '0001',
+            'name': 'Checking',
+            'official_name': None,
+            'type': 'depository',
+            'subtype': 'checking',
+            'verification_status': 'automatically_verified',
+            'persistent_account_id': 'persistent-1',
+        }],
+        'item': {'item_id': 'item-1', 'institution_id': 'ins_1'},
+    }
+
+    def test_accounts_keep_dict_style_access(self):
+        [account] = plaid_records.accounts(self.ACCOUNTS)
+        self.assertEqual(account['name'], 'Checking')
+        self.assertEqual(account['balances']['current'], 1250.5)
+        self.assertIsInstance(account.balances, plaid_records.Balances)
+        with self.assertRaises(KeyError):
+            account['no_such_field']
+
+    def test_null_fields_are_absent(self):
+        [account] = plaid_records.accounts(self.ACCOUNTS)
+        self.assertIn('mask', account)
+        self.assertNotIn('official_name', account)
+        self.assertNotIn('no_such_field', account)
+        self.assertIsNone(account['official_name'])
+        self.assertEqual(account.get('official_name', ''), '')
+        self.assertEqual(account['balances'].get('available', 0), 0)
+
+    def test_fields_without_a_slot_are_kept(self):
+        [account] = plaid_records.accounts(self.ACCOUNTS)
+        self.assertIn('verification_status', account)
+        self.assertEqual(account['verification_status'], 'automatically_verified')
+        self.assertEqual(account.get('persistent_account_id'), 'persistent-1')
+        self.assertEqual(account.to_dict(), self.ACCOUNTS['accounts'][0])
+        self.assertEqual(plaid_records.Account(account.to_dict()), account)
+
+    def test_transactions_convert_dates(self):
+        [transaction] = plaid_records.transactions([{
+            'transaction_id': 'txn-1', 'account_id': 'acc-1', 'amount': 12.34, 'date': '2024-03-01',
+            'authorized_date': None, 'name': 'Coffee', 'pending': False, 'location': {'city': 'Austin'},
+        }])
+        self.assertEqual(transaction['date'], date(2024, 3, 1))
+        self.assertIsNone(transaction['authorized_date'])
+        self.assertIsNone(transaction['merchant_name'])
+        self.assertEqual(transaction['location'], {'city': 'Austin'})
+        self.assertEqual(transaction.to_dict()['date'], date(2024, 3, 1))
+
+
+def _plaid_data(inputs):
+    loan = {name: str(inputs[name]) for name in ('annual_income', 'purchase_price', 'down_payment')}
+    return {'loan_application': loan, 'total_balance': f"${inputs['liquid_assets']:,.2f}"}
+
+
+@override_settings(AI_DECISION_CACHE_BACKEND='shared', AI_DECISION_CACHE_ALIAS='default', AI_HEDGE_PROVIDERS=[])
+class AsyncDecisionCacheTests(TestCase):
+    def setUp(self):
+        # A fresh process-wide cache built from the settings above
+        patcher = mock.patch('account.decision_cache._cache', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_async_decisions_use_the_shared_cache_without_blocking(self):
+        engine = PreApprovalEngine(openai_api_key='test-key')
+        # Debt-to-income right under the limit: the pre-screen leaves it to the model
+        user_input, plaid_data = {'loan_purpose': 'Purchase'}, _plaid_data(_inputs(annual_income=37500))
+
+        with mock.patch.object(engine.provider, 'acomplete', return_value=('approve', None)) as acomplete:
+            first = await engine.analyze_with_details_async(user_input, plaid_data)
+            second = await engine.analyze_with_details_async(user_input, plaid_data)
+
+        self.assertEqual((first['decision'], first['source']), ('approve', engine.provider.name))
+        self.assertEqual((second['decision'], second['source']), ('approve', 'cache'))
+        self.assertEqual(acomplete.call_count, 1)
+        cache = get_decision_cache()
+        self.assertIsInstance(cache, SharedDecisionCache)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+
+def _signing_key():
+    private_key = ec.generate_private_key(ec.SECP256R1())
+    return private_key, json.loads(jwt.algorithms.ECAlgorithm.to_jwk(private_key.public_key()))
+
+
+@override_settings(PLAID_WEBHOOK_MAX_AGE=300, PLAID_WEBHOOK_KEY_TTL=600)
+class WebhookVerificationTests(SimpleTestCase):
+    body = b'{"webhook_type": "TRANSACTIONS", "webhook_code": "SYNC_UPDATES_AVAILABLE"}'
+
+    def setUp(self):
+        self.private_key, self.jwk = _signing_key()
+        patcher = mock.patch('account.plaid_webhooks._verification_keys', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('account.plaid_webhooks.PlaidService')
+        self.get_key = patcher.start().return_value.get_webhook_verification_key
+        self.get_key.side_effect = lambda key_id: dict(self.jwk)
+        self.addCleanup(patcher.stop)
+
+    def _token(self, body=None, iat=None, private_key=None):
+        claims = {
+            'iat': int(time.time()) if iat is None else iat,
+            'request_body_sha256': hashlib.sha256(self.body if body is None else body).hexdigest(),
+        }
+        return jwt.encode(claims, private_key or self.private_key, algorithm='ES256', headers={'kid': 'key-1'})
+
+    def test_genuine_webhook_passes(self):
+        verify_webhook(self.body, self._token())
+        self.get_key.assert_called_once_with('key-1')
+
+    def test_rejects_signature_by_another_key(self):
+        other_key, _ = _signing_key()
+        with self.assertRaisesRegex(WebhookVerificationError, 'Invalid signature'):
+            verify_webhook(self.body, self._token(private_key=other_key))
+
+    def test_rejects_stale_token(self):
+        with self.assertRaisesRegex(WebhookVerificationError, 'too old'):
+            verify_webhook(self.body, self._token(iat=int(time.time()) - 301))
+
+    def test_rejects_body_that_does_not_match_the_hash(self):
+        with self.assertRaisesRegex(WebhookVerificationError, 'Body does not match'):
+            verify_webhook(self.body, self._token(body=b'{}'))
+
+    def test_cached_key_is_refetched_after_ttl_and_expiry_is_seen(self):
+        verify_webhook(self.body, self._token())
+        verify_webhook(self.body, self._token())
+        self.assertEqual(self.get_key.call_count, 1)
+
+        # Plaid rotates the key out; the cached copy is trusted only until the TTL passes
+        self.jwk['expired_at'] = 1700000000
+        with mock.patch('account.plaid_webhooks.time.monotonic', return_value=time.monotonic() + 601):
+            with self.assertRaisesRegex(WebhookVerificationError, 'expired'):
+                verify_webhook(self.body, self._token())
+        self.assertEqual(self.get_key.call_count, 2)
+
+
+@override_settings(PLAID_WEBHOOK_DEDUP_SECONDS=3600)
+class WebhookDeliveryTests(TestCase):
+    body = b'{"item_id": "item-1", "webhook_type": "ITEM", "webhook_code": "ERROR"}'
+    payload = {'item_id': 'item-1', 'webhook_type': 'ITEM', 'webhook_code': 'ERROR'}
+
+    def test_repeated_delivery_is_dropped_within_the_window(self):
+        self.assertTrue(record_delivery(self.body, self.payload))
+        self.assertFalse(record_delivery(self.body, self.payload))
+        self.assertTrue(record_delivery(self.body.replace(b'ERROR', b'LOGIN_REPAIRED'), self.payload))
+        self.assertEqual(PlaidWebhookEvent.objects.count(), 2)
+
+    def test_identical_body_outside_the_window_is_a_new_event(self):
+        self.assertTrue(record_delivery(self.body, self.payload))
+        PlaidWebhookEvent.objects.update(received_at=timezone.now() - timedelta(seconds=3601))
+
+        self.assertTrue(record_delivery(self.body, self.payload))
+        self.assertFalse(record_delivery(self.body, self.payload))
+        self.assertEqual(PlaidWebhookEvent.objects.count(), 1)
+
+
+@override_settings(AI_BATCH_STALE_SECONDS=120, AI_BATCH_HEARTBEAT_SECONDS=1)
+class DecisionBatchLifecycleTests(TestCase):
+    def setUp(self):
+        # Loan 2's decision fails; the others are approved
+        patcher = mock.patch(
+            'account.decisions.decide_loan',
+            side_effect=lambda loan_id: {'error': 'no bank data'} if loan_id == 2 else {'decision': 'approve'},
+        )
+        self.decide_loan = patcher.start()
+        self.addCleanup(patcher.stop)
+        # The batch closes its DB connection when done; keep the test's transaction open
+        patcher = mock.patch('account.decisions.connection')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_batch_runs_to_completion(self):
+        batch = DecisionBatch.objects.create(loan_ids=[1, 2, 3], concurrency=2)
+        run_decision_batch(batch.id)
+
+        batch.refresh_from_db()
+        self.assertEqual(batch.status, 'completed')
+        self.assertEqual((batch.completed_count, batch.failed_count), (2, 1))
+        self.assertEqual(batch.results['2'], {'error': 'no bank data'})
+        self.assertIsNotNone(batch.heartbeat_at)
+        self.assertIsNotNone(batch.finished_at)
+        self.assertFalse(batch.is_stalled())
+
+    def test_stalled_batch_resumes_without_redeciding_finished_loans(self):
+        started = timezone.now() - timedelta(minutes=10)
+        batch = DecisionBatch.objects.create(
+            loan_ids=[1, 2, 3], status='running', started_at=started, heartbeat_at=started,
+            results={'1': {'decision': 'approve'}}, completed_count=1,
+        )
+        live = DecisionBatch.objects.create(loan_ids=[4], status='running', started_at=started, heartbeat_at=timezone.now())
+        self.assertTrue(batch.is_stalled())
+        self.assertFalse(live.is_stalled())
+
+        self.assertEqual(resume_stalled_batches(), [batch.id])
+        self.assertEqual(sorted(call.args[0] for call in self.decide_loan.call_args_list), [2, 3])
+        batch.refresh_from_db()
+        self.assertEqual(batch.status, 'completed')
+        self.assertEqual((batch.completed_count, batch.failed_count), (2, 1))
+        self.assertEqual(batch.started_at, started)
+        self.assertEqual(resume_stalled_batches(), [])
+
+    def test_stalled_batch_can_be_failed_instead(self):
+        batch = DecisionBatch.objects.create(loan_ids=[1])
+        DecisionBatch.objects.filter(id=batch.id).update(created_at=timezone.now() - timedelta(minutes=10))
+
+        self.assertEqual(resume_stalled_batches(fail=True), [batch.id])
+        batch.refresh_from_db()
+        self.assertEqual(batch.status, 'failed')
+        self.assertIsNotNone(batch.finished_at)
+        self.decide_loan.assert_not_called()
+
+
+class _FakeProvider(DecisionProvider):
+    """Answers (or fails) after `delay` seconds; records whether an async call was cancelled."""
+    vendor = 'fake'
+
+    def __init__(self, model, answer='approve', delay=0.0, error=None):
+        super().__init__(model, api_key=None)
+        self.answer, self.delay, self.error = answer, delay, error
+        self.cancelled = False
+
+    def complete(self, prompt, timeout, logprobs=False):
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return self.answer, None
+
+    async def acomplete(self, prompt, timeout, logprobs=False):
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error:
+            raise self.error
+        return self.answer, None
+
+
+@override_settings(AI_HEDGE_ENABLED=True, AI_HEDGE_DEFAULT_DELAY=0.05, AI_HEDGE_MIN_DELAY=0.01, AI_HEDGE_MIN_SAMPLES=1000)
+class HedgedRequestTests(SimpleTestCase):
+    def _engine(self, test, primary, *alternates):
+        # Provider names are process-wide (breakers, histograms): keep each test's apart
+        engine = PreApprovalEngine(openai_api_key='test-key', hedge_providers=[])
+        engine.provider = _FakeProvider(f'{test}-primary', **primary)
+        engine.alternates = [_FakeProvider(f'{test}-alternate-{i}', **options) for i, options in enumerate(alternates)]
+        return engine
+
+    def test_slow_primary_is_hedged_and_the_first_answer_wins(self):
+        engine = self._engine('sync-win', {'answer': 'approve', 'delay': 1.0}, {'answer': 'disapprove'})
+        self.assertEqual(engine._ask('prompt', timeout=5), ('disapprove', 'fake:sync-win-alternate-0'))
+
+    def test_fast_primary_is_not_hedged(self):
+        engine = self._engine('sync-fast', {'answer': 'approve'}, {'answer': 'disapprove', 'delay': 1.0})
+        self.assertEqual(engine._ask('prompt', timeout=5), ('approve', 'fake:sync-fast-primary'))
+
+    def test_failed_primary_hedges_at_once(self):
+        engine = self._engine('sync-fail', {'error': RuntimeError('503')}, {'answer': 'disapprove'})
+        started = time.monotonic()
+        self.assertEqual(engine._ask('prompt', timeout=5)[1], 'fake:sync-fail-alternate-0')
+        self.assertLess(time.monotonic() - started, 1.0)
+
+    def test_all_providers_failing_is_unavailable(self):
+        engine = self._engine(
+            'sync-all', {'error': RuntimeError('primary down')}, {'error': RuntimeError('alternate down')}
+        )
+        with self.assertRaisesRegex(DecisionUnavailable, 'primary down.*alternate down'):
+            engine._ask('prompt', timeout=5)
+
+    def test_async_loser_is_cancelled(self):
+        engine = self._engine('async-win', {'answer': 'approve', 'delay': 5.0}, {'answer': 'disapprove'})
+
+        async def race():
+            answer = await engine._ask_async('prompt', timeout=10)
+            await asyncio.sleep(0)  # let the cancelled primary see its CancelledError before the loop closes
+            return answer, engine.provider.cancelled
+
+        answer, primary_cancelled = asyncio.run(race())
+        self.assertEqual(answer, ('disapprove', 'fake:async-win-alternate-0'))
+        self.assertTrue(primary_cancelled)
+        self.assertFalse(engine.alternates[0].cancelled)
+
+    def test_async_all_providers_failing_is_unavailable(self):
+        engine = self._engine(
+            'async-all', {'error': RuntimeError('primary down')}, {'error': RuntimeError('alternate down')}
+        )
+        with self.assertRaisesRegex(DecisionUnavailable, 'primary down.*alternate down'):
+            asyncio.run(engine._ask_async('prompt', timeout=5))
+
+
+class DecisionCacheTests(SimpleTestCase):
+    def test_fingerprint_normalizes_amounts_and_purpose(self):
+        inputs = {'annual_income': 120000, 'purchase_price': 455000, 'down_payment': 91000,
+                  'liquid_assets': 100000, 'loan_purpose': 'Purchase'}
+        same = {'annual_income': '120000.00', 'purchase_price': 455000.001, 'down_payment': 91000.0,
+                'liquid_assets': 100000, 'loan_purpose': ' purchase '}
+        self.assertEqual(decision_fingerprint(inputs, 'gpt-4'), decision_fingerprint(same, 'gpt-4'))
+        self.assertNotEqual(decision_fingerprint(inputs, 'gpt-4'), decision_fingerprint(inputs, 'gpt-4o-mini'))
+        self.assertNotEqual(
+            decision_fingerprint(inputs, 'gpt-4'), decision_fingerprint({**inputs, 'liquid_assets': 100000.5}, 'gpt-4')
+        )
+
+    def test_memory_cache_evicts_least_recently_used(self):
+        cache = MemoryDecisionCache(ttl=60, max_entries=2)
+        cache.set('a', 'approve')
+        cache.set('b', 'disapprove')
+        cache.get('a')  # 'b' is now the least recently used
+        cache.set('c', 'approve')
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), ('approve', 'approve'))
+        self.assertEqual(cache.stats()['entries'], 2)
+
+    def test_memory_cache_entries_expire(self):
+        cache = MemoryDecisionCache(ttl=60)
+        with mock.patch('account.decision_cache.time.monotonic', return_value=1000.0):
+            cache.set('a', 'approve')
+        with mock.patch('account.decision_cache.time.monotonic', return_value=1059.0):
+            self.assertEqual(cache.get('a'), 'approve')
+        with mock.patch('account.decision_cache.time.monotonic', return_value=1061.0):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_hit_and_miss_stats(self):
+        cache = MemoryDecisionCache()
+        cache.get('a')
+        cache.set('a', 'approve')
+        cache.get('a')
+        cache.get('a')
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['hit_rate']), (2, 1, 0.6667))
+        self.assertEqual(stats['backend'], 'MemoryDecisionCache')
+
+    def test_backend_is_chosen_by_settings(self):
+        for backend, cache_class in (
+            ('memory', MemoryDecisionCache),
+            ('shared', SharedDecisionCache),
+            ('none', NullDecisionCache),
+            ('account.decision_cache.NullDecisionCache', NullDecisionCache),
+        ):
+            with self.subTest(backend=backend), \
+                    override_settings(AI_DECISION_CACHE_BACKEND=backend, AI_DECISION_CACHE_TTL=42,
+                                      AI_DECISION_CACHE_ALIAS='default'), \
+                    mock.patch('account.decision_cache._cache', None):
+                cache = get_decision_cache()
+                self.assertIs(type(cache), cache_class)
+                self.assertEqual(cache.ttl, 42)
+                self.assertIs(get_decision_cache(), cache)
+
+
+@override_settings(AI_DECISION_CACHE_BACKEND='none', AI_HEDGE_PROVIDERS=[], AI_PRESCREEN_ENABLED=True,
+                   AI_PRESCREEN_MARGIN=0.10, AI_CASCADE_MODEL='gpt-4o-mini', AI_CASCADE_MIN_CONFIDENCE=0.90)
+class CascadeEscalationTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch('account.decision_cache._cache', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.engine = PreApprovalEngine(openai_api_key='test-key', model='gpt-4', cascade=True)
+        patcher = mock.patch.object(self.engine.small_provider, 'complete')
+        self.small = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(self.engine.provider, 'complete', return_value=('disapprove', None))
+        self.large = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _decide(self, **overrides):
+        return self.engine.analyze_with_details({'loan_purpose': 'Purchase'}, _plaid_data(_inputs(**overrides)))
+
+    def test_clear_cases_never_call_a_model(self):
+        self.assertEqual(self._decide()['decision'], 'approve')
+        self.assertEqual(self._decide(annual_income=20000)['decision'], 'disapprove')
+        self.assertEqual(self._decide()['source'], 'rules')
+        self.small.assert_not_called()
+        self.large.assert_not_called()
+
+    def test_borderline_case_is_answered_by_a_confident_small_model(self):
+        # Debt-to-income 48% against a 50% limit: inside the pre-screen margin, the rules lean approve
+        self.small.return_value = ('approve', 0.98)
+        result = self._decide(annual_income=37500)
+        self.assertEqual((result['decision'], result['source']), ('approve', self.engine.small_provider.name))
+        self.small.assert_called_once()
+        self.large.assert_not_called()
+
+    def test_low_confidence_escalates_to_the_large_model(self):
+        self.small.return_value = ('approve', 0.6)
+        result = self._decide(annual_income=37500)
+        self.assertEqual((result['decision'], result['source']), ('disapprove', self.engine.provider.name))
+        self.large.assert_called_once()
+
+    def test_disagreeing_with_the_rules_escalates_to_the_large_model(self):
+        self.small.return_value = ('disapprove', 0.99)
+        self.assertEqual(self._decide(annual_income=37500)['source'], self.engine.provider.name)
+        self.large.assert_called_once()
+
+
+@override_settings(PLAID_ARCHIVE_ENDPOINTS=['/accounts/get', '/transactions/get'], PLAID_RATE_LIMIT_DEFAULT=0)
+class PlaidArchiveTests(TestCase):
+    def setUp(self):
+        self.plaid_connection = PlaidConnection.objects.create(
+            loan_application=_loan(), access_token='access-archive', item_id='item-archive'
+        )
+
+    def _body(self, **params):
+        return {'access_token': 'access-archive', 'client_id': 'client', 'secret': 'secret', **params}
+
+    def test_archived_response_is_replayed(self):
+        raw = b'{"accounts": [{"account_id": "acc-1"}]}'
+        with archiving_for(self.plaid_connection):
+            archived = archive_response('/accounts/get', self._body(), raw)
+        self.assertEqual(archived.params, {})
+        self.assertEqual(archived.data(), {'accounts': [{'account_id': 'acc-1'}]})
+
+        self.assertEqual(replay_response('/accounts/get', self._body()), raw)
+        with self.assertRaises(NotArchived):
+            replay_response('/transactions/get', self._body())
+
+    def test_replay_falls_back_to_other_dates(self):
+        with archiving_for(self.plaid_connection):
+            archive_response('/transactions/get', self._body(start_date='2024-01-01', end_date='2024-01-31', count=100), b'{"old": 1}')
+        self.assertEqual(
+            replay_response('/transactions/get', self._body(start_date='2024-02-01', end_date='2024-02-29', count=100)),
+            b'{"old": 1}',
+        )
+        with self.assertRaises(NotArchived):
+            replay_response('/transactions/get', self._body(start_date='2024-02-01', count=500))
+
+    def test_only_archived_endpoints_of_the_current_connection_are_stored(self):
+        self.assertIsNone(archive_response('/accounts/get', self._body(), b'{}'))
+        with archiving_for(self.plaid_connection):
+            self.assertIsNone(archive_response('/item/get', self._body(), b'{}'))
+            self.assertIsNone(archive_response('/accounts/get', {'access_token': 'other-token'}, b'{}'))
+        self.assertFalse(PlaidResponseArchive.objects.exists())
+
+    def test_response_body_is_not_read_unless_archived(self):
+        from plaid.configuration import Configuration
+        from .plaid_utils import _TimeoutRESTClient
+
+        response = mock.Mock()
+        type(response).data = data = mock.PropertyMock(return_value=b'{}')
+        client = _TimeoutRESTClient(Configuration(host='http://plaid.test'), (1, 1))
+        with mock.patch('plaid.rest.RESTClientObject.request', return_value=response):
+            self.assertIs(client.request('POST', 'http://plaid.test/accounts/get', body=self._body()), response)
+            with archiving_for(self.plaid_connection):
+                self.assertIs(client.request('POST', 'http://plaid.test/item/get', body=self._body()), response)
+            data.assert_not_called()
+
+            with archiving_for(self.plaid_connection):
+                client.request('POST', 'http://plaid.test/accounts/get', body=self._body())
+            data.assert_called_once()
+        self.assertEqual(PlaidResponseArchive.objects.count(), 1)
+
+    def test_prune_deletes_only_old_responses(self):
+        with archiving_for(self.plaid_connection):
+            old = archive_response('/accounts/get', self._body(), b'{}')
+            archive_response('/accounts/get', self._body(), b'{}')
+        PlaidResponseArchive.objects.filter(id=old.id).update(fetched_at=timezone.now() - timedelta(days=91))
+
+        self.assertEqual(prune_archive(90), 1)
+        self.assertEqual(PlaidResponseArchive.objects.count(), 1)
+        stdout = StringIO()
+        call_command('prune_plaid_archive', days=0, stdout=stdout)
+        self.assertIn('Deleted 1 archived Plaid responses', stdout.getvalue())
+        self.assertFalse(PlaidResponseArchive.objects.exists())
+
+
+class ConnectItemTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch('account.plaid_items.schedule_warm_up')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.loan = _loan()
+        self.plaid_service = mock.Mock()
+        self.plaid_service.get_item_accounts.return_value = (
+            [{'account_id': 'acc-1', 'mask': '0000'}, {'account_id': 'acc-2', 'mask': '1111'}], 'ins_1'
+        )
+
+    def test_relinking_the_same_bank_replaces_the_item_and_revokes_its_token(self):
+        old, _ = connect_item(self.loan, 'access-old', 'item-old', self.plaid_service)
+        other_bank = PlaidConnection.objects.create(
+            loan_application=self.loan, access_token='access-other', item_id='item-other',
+            institution_id='ins_2', account_masks=['0000'],
+        )
+
+        new, accounts = connect_item(self.loan, 'access-new', 'item-new', self.plaid_service)
+
+        self.assertEqual([account['account_id'] for account in accounts], ['acc-1', 'acc-2'])
+        self.assertEqual((new.institution_id, new.account_masks), ('ins_1', ['0000', '1111']))
+        self.assertEqual(
+            set(self.loan.plaid_connections.values_list('item_id', flat=True)), {'item-new', other_bank.item_id}
+        )
+        self.assertFalse(PlaidConnection.objects.filter(id=old.id).exists())
+        self.plaid_service.remove_item.assert_called_once_with('access-old')
+
+    def test_failed_revocation_still_replaces_the_connection(self):
+        connect_item(self.loan, 'access-old', 'item-old', self.plaid_service)
+        self.plaid_service.remove_item.side_effect = RuntimeError('Plaid down')
+
+        connect_item(self.loan, 'access-new', 'item-new', self.plaid_service)
+        self.assertEqual(list(self.loan.plaid_connections.values_list('item_id', flat=True)), ['item-new'])
+
+    def test_reconnecting_an_item_refreshes_its_token_without_revoking(self):
+        connect_item(self.loan, 'access-old', 'item-1', self.plaid_service)
+        plaid_connection, _ = connect_item(self.loan, 'access-new', 'item-1', self.plaid_service)
+
+        self.assertEqual(plaid_connection.access_token, 'access-new')
+        self.assertEqual(self.loan.plaid_connections.count(), 1)
+        self.plaid_service.remove_item.assert_not_called()
+
+
+def _transaction(transaction_id, amount, day=1, **fields):
+    return {'transaction_id': transaction_id, 'account_id': 'acc-1', 'amount': amount,
+            'date': date(2024, 3, day), 'name': f'Purchase {transaction_id}', **fields}
+
+
+class TransactionSyncTests(TestCase):
+    def setUp(self):
+        self.plaid_connection = PlaidConnection.objects.create(
+            loan_application=_loan(), access_token='access-sync', item_id='item-sync'
+        )
+        self.plaid_service = mock.Mock()
+
+    def _sync(self, cursor, added=(), modified=(), removed=()):
+        self.plaid_service.sync_transactions.return_value = {
+            'added': list(added), 'modified': list(modified), 'removed': list(removed), 'next_cursor': cursor,
+        }
+        return sync_transactions(self.plaid_connection, self.plaid_service)
+
+    def test_changes_are_applied_from_the_stored_cursor(self):
+        result = self._sync('cursor-1', added=[_transaction('t1', 12.5), _transaction('t2', 40, day=2)])
+        self.assertEqual(result, {'added': 2, 'modified': 0, 'removed': 0, 'skipped': False})
+        self.plaid_service.sync_transactions.assert_called_with('access-sync', '')
+
+        result = self._sync(
+            'cursor-2', added=[_transaction('t3', 7, day=3)], modified=[_transaction('t1', 13.75, pending=True)],
+            removed=['t2'],
+        )
+        self.assertEqual(result, {'added': 1, 'modified': 1, 'removed': 1, 'skipped': False})
+        self.plaid_service.sync_transactions.assert_called_with('access-sync', 'cursor-1')
+
+        stored = stored_transactions([self.plaid_connection])
+        self.assertEqual([t.transaction_id for t in stored], ['t3', 't1'])
+        self.assertEqual((stored[1].amount, stored[1].pending), (Decimal('13.75'), True))
+        self.plaid_connection.refresh_from_db()
+        self.assertEqual(self.plaid_connection.transactions_cursor, 'cursor-2')
+        self.assertIsNotNone(self.plaid_connection.transactions_synced_at)
+
+    def test_concurrent_sync_that_committed_first_wins(self):
+        def fetch_while_another_worker_syncs(access_token, cursor):
+            PlaidConnection.objects.filter(id=self.plaid_connection.id).update(transactions_cursor='cursor-other')
+            return {'added': [_transaction('t1', 5)], 'modified': [], 'removed': [], 'next_cursor': 'cursor-mine'}
+
+        self.plaid_service.sync_transactions.side_effect = fetch_while_another_worker_syncs
+        result = sync_transactions(self.plaid_connection, self.plaid_service)
+
+        self.assertTrue(result['skipped'])
+        self.assertEqual(stored_transactions([self.plaid_connection]), [])
+        self.plaid_connection.refresh_from_db()
+        self.assertEqual(self.plaid_connection.transactions_cursor, 'cursor-other')
+
+    @override_settings(PLAID_TRANSACTIONS_MAX_AGE=3600)
+    def test_recent_sync_is_not_repeated(self):
+        self._sync('cursor-1', added=[_transaction('t1', 5)])
+        self.assertIsNone(sync_if_stale(self.plaid_connection, self.plaid_service))
+        self.assertEqual(self.plaid_service.sync_transactions.call_count, 1)
+
+        self.plaid_connection.transactions_synced_at = timezone.now() - timedelta(hours=2)
+        self.assertFalse(sync_if_stale(self.plaid_connection, self.plaid_service)['skipped'])
+        self.assertEqual(self.plaid_service.sync_transactions.call_count, 2)
+
+
+@override_settings(PLAID_LINK_TOKEN_MIN_TTL=600)
+class LinkTokenTests(TestCase):
+    def setUp(self):
+        self.loan = _loan()
+        self.plaid_service = mock.Mock()
+        self.plaid_service.create_link_token.side_effect = lambda user_id, user_name: {
+            'link_token': f'link-{self.plaid_service.create_link_token.call_count}',
+            'expiration': timezone.now() + timedelta(hours=4),
+        }
+
+    def test_unexpired_token_is_reused(self):
+        self.assertEqual(get_link_token(self.loan, plaid_service=self.plaid_service), 'link-1')
+        self.assertEqual(get_link_token(self.loan, plaid_service=self.plaid_service), 'link-1')
+        self.plaid_service.create_link_token.assert_called_once_with(self.loan.id, self.loan.full_name)
+
+        self.loan.refresh_from_db()
+        self.assertEqual(self.loan.plaid_link_token, 'link-1')
+
+    def test_token_close_to_expiry_is_replaced(self):
+        self.loan.plaid_link_token = 'link-old'
+        self.loan.plaid_link_token_expires_at = timezone.now() + timedelta(seconds=599)
+        self.assertEqual(get_link_token(self.loan, plaid_service=self.plaid_service), 'link-1')
+
+        self.loan.plaid_link_token_expires_at = None
+        self.assertEqual(get_link_token(self.loan, plaid_service=self.plaid_service), 'link-2')
+
+    def test_refresh_always_creates_a_token(self):
+        get_link_token(self.loan, plaid_service=self.plaid_service)
+        self.assertEqual(get_link_token(self.loan, refresh=True, plaid_service=self.plaid_service), 'link-2')
@@ -0,0 +1,113 @@
+"""
+Local transaction store kept current with Plaid's /transactions/sync.
+After the first sync only deltas are fetched, and endpoints read
+transactions from the database instead of re-downloading them.
+"""
+import logging
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import PlaidConnection, PlaidTransaction
+from .plaid_archive import archiving_for
+from .plaid_service import PlaidService
+
+logger = logging.getLogger(__name__)
+
+UPDATED_FIELDS = ['account_id', 'amount', 'iso_currency_code', 'date', 'name', 'merchant_name', 'category', 'pending']
+
+
+def _transaction_fields(data):
+    return {
+        'account_id': data['account_id'],
+        'amount': Decimal(str(data['amount'])),
+        'iso_currency_code': data.get('iso_currency_code'),
+        'date': data['date'],
+        'name': (data.get('name') or '')[:255],
+        'merchant_name': data.get('merchant_name'),
+        'category': data.get('category') or [],
+        'pending': bool(data.get('pending')),
+    }
+
+
+def _upsert(plaid_connection, transactions):
+    """Insert or update transactions in bulk (the first sync can return thousands)."""
+    rows = {data['transaction_id']: data for data in transactions}
+    existing = {
+        stored.transaction_id: stored
+        for stored in PlaidTransaction.objects.filter(transaction_id__in=list(rows))
+    }
+    now = timezone.now()
+    to_create, to_update = [], []
+    for transaction_id, data in rows.items():
+        fields = _transaction_fields(data)
+        stored = existing.get(transaction_id)
+        if stored is None:
+            to_create.append(PlaidTransaction(connection=plaid_connection, transaction_id=transaction_id, **fields))
+            continue
+        for name, value in fields.items():
+            setattr(stored, name, value)
+        stored.updated_at = now
+        to_update.append(stored)
+
+    PlaidTransaction.objects.bulk_create(to_create, batch_size=500)
+    if to_update:
+        PlaidTransaction.objects.bulk_update(to_update, [*UPDATED_FIELDS, 'updated_at'], batch_size=500)
+
+
+def sync_transactions(plaid_connection, plaid_service=None):
+    """
+    Pull changes since the connection's cursor and apply them.
+    Returns counts of added/modified/removed transactions. If another sync
+    of the same item committed while this one was fetching, its result wins
+    and this one's changes are dropped (they would be the same or older).
+    """
+    plaid_service = plaid_service or PlaidService()
+    start_cursor = plaid_connection.transactions_cursor
+    with archiving_for(plaid_connection):
+        changes = plaid_service.sync_transactions(plaid_connection.access_token, start_cursor)
+
+    with transaction.atomic():
+        locked = PlaidConnection.objects.select_for_update().get(id=plaid_connection.id)
+        if locked.transactions_cursor != start_cursor:
+            logger.info(f"Transactions for item {locked.item_id} were synced concurrently; skipping")
+            return {'added': 0, 'modified': 0, 'removed': 0, 'skipped': True}
+
+        _upsert(locked, changes['added'] + changes['modified'])
+        if changes['removed']:
+            PlaidTransaction.objects.filter(connection=locked, transaction_id__in=changes['removed']).delete()
+
+        locked.transactions_cursor = changes['next_cursor']
+        locked.transactions_synced_at = timezone.now()
+        locked.save(update_fields=['transactions_cursor', 'transactions_synced_at'])
+
+    plaid_connection.transactions_cursor = locked.transactions_cursor
+    plaid_connection.transactions_synced_at = locked.transactions_synced_at
+    return {
+        'added': len(changes['added']),
+        'modified': len(changes['modified']),
+        'removed': len(changes['removed']),
+        'skipped': False,
+    }
+
+
+def sync_if_stale(plaid_connection, plaid_service=None):
+    """Sync unless the last sync is newer than PLAID_TRANSACTIONS_MAX_AGE seconds."""
+    max_age = timedelta(seconds=getattr(settings, 'PLAID_TRANSACTIONS_MAX_AGE', 3600))
+    synced_at = plaid_connection.transactions_synced_at
+    if synced_at is not None and timezone.now() - synced_at < max_age:
+        return None
+    return sync_transactions(plaid_connection, plaid_service)
+
+
+def stored_transactions(plaid_connections, since=None, limit=None):
+    """Transactions of the given connections' items from the local table, newest first."""
+    queryset = PlaidTransaction.objects.filter(connection__in=plaid_connections)
+    if since is not None:
+        queryset = queryset.filter(date__gte=since)
+    if limit is not None:
+        queryset = queryset[:limit]
+    return list(queryset)
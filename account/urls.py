@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import views, async_views
 
 urlpatterns = [
     path('contact/', views.ContactUsView.as_view(), name='contact'),
@@ -7,8 +7,12 @@ urlpatterns = [
     #path('loan-application/<int:loan_id>/', views.GetLoanApplicationWithBankDataView.as_view(), name='loan-application-detail'),
     path('plaid/link-token/', views.PlaidLinkTokenView.as_view(), name='plaid-link-token'),
     path('plaid/connect/', views.PlaidConnectView.as_view(), name='plaid-connect'),
+    path('plaid/webhook/', views.PlaidWebhookView.as_view(), name='plaid-webhook'),
     path('bank-analysis-pdf/', views.BankDataAnalysisPDFView.as_view(), name='bank-analysis-pdf'),
     path('generate-pdf-from-data/', views.GeneratePDFFromBankDataView.as_view(), name='generate-pdf-from-data'),
+    # Non-blocking variants of the decision/PDF endpoints (run under core/asgi.py to benefit)
+    path('async/bank-analysis-pdf/', async_views.AsyncBankDataAnalysisPDFView.as_view(), name='async-bank-analysis-pdf'),
+    path('async/generate-pdf-from-data/', async_views.AsyncGeneratePDFFromBankDataView.as_view(), name='async-generate-pdf-from-data'),
     #path('plaid/connect-all/', views.PlaidConnectAndGetAllInfoView.as_view(), name='plaid-connect-all'),
     #path('loan-decision-pdf/<int:loan_id>/', views.LoanDecisionPDFView.as_view(), name='loan-decision-pdf'),
     #path('loan-decision-test/', views.LoanDecisionTestPageView.as_view(), name='loan-decision-test-page'),
@@ -22,4 +26,7 @@ urlpatterns = [
     # New endpoints for individual user bank details and sandbox stats
     path('user/<int:loan_id>/bank-details/', views.UserBankDetailsView.as_view(), name='user-bank-details'),
     path('sandbox/stats/', views.SandboxStatsView.as_view(), name='sandbox-stats'),
+    path('ai-engine/stats/', views.AIEngineStatsView.as_view(), name='ai-engine-stats'),
+    path('decision-batches/', views.DecisionBatchView.as_view(), name='decision-batches'),
+    path('decision-batches/<int:batch_id>/', views.DecisionBatchDetailView.as_view(), name='decision-batch-detail'),
 ]
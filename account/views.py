@@ -2,8 +2,15 @@ from django.shortcuts import render, get_object_or_404
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from .serializers import ContactSerializer, LoanApplicationSerializer, PlaidLinkSerializer
-from .models import LoanApplication, PlaidConnection
+from .models import LoanApplication, PlaidConnection, DecisionBatch
 from .plaid_service import PlaidService
+from .plaid_utils import get_plaid_pool_stats
+from .plaid_rate_limits import get_plaid_retry_stats
+from .account_snapshots import get_combined_account_snapshot, get_snapshot_stats, wants_fresh
+from .plaid_items import connect_item
+from .asset_reports import get_combined_financial_data
+from .link_tokens import get_link_token
+from .plaid_webhooks import WebhookVerificationError, handle_webhook, record_delivery, verify_webhook
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 from rest_framework import status
@@ -21,9 +28,11 @@ from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
 import io
+import json
 import os
 from dotenv import load_dotenv
 from .aiengine import PreApprovalEngine
+from .decisions import bank_analysis_inputs, direct_analysis_inputs, get_coalescing_stats, start_decision_batch, stored_decision
 
 # Load environment variables
 load_dotenv()
@@ -177,7 +186,7 @@ class LoanApplicationCreateView(APIView):
             # Create Plaid link token for step 2
             try:
                 plaid_service = PlaidService()
-                link_token = plaid_service.create_link_token(loan.id, loan.full_name)
+                link_token = get_link_token(loan, plaid_service=plaid_service)
                 
                 # Only create sandbox public token in non-production environments
                 if settings.PLAID_ENV in ['sandbox', 'development']:
@@ -185,10 +194,9 @@ class LoanApplicationCreateView(APIView):
                         public_token_data = plaid_service.create_sandbox_public_token()
                         public_token = public_token_data['public_token']
                         
-                        # Save both tokens to the loan application
-                        loan.plaid_link_token = link_token
+                        # Save the public token too (the link token is saved by get_link_token)
                         loan.plaid_public_token = public_token
-                        loan.save()
+                        loan.save(update_fields=['plaid_public_token'])
                         
                         return Response({
                             'id': loan.id,
@@ -203,9 +211,6 @@ class LoanApplicationCreateView(APIView):
                     except Exception as pub_e:
                         logger.warning(f"Could not create sandbox public token: {pub_e}")
                         # Fall back to link token only
-                        loan.plaid_link_token = link_token
-                        loan.save()
-                        
                         return Response({
                             'id': loan.id,
                             'full_name': loan.full_name,
@@ -216,9 +221,6 @@ class LoanApplicationCreateView(APIView):
                         }, status=status.HTTP_201_CREATED)
                 else:
                     # Production environment - only provide link token
-                    loan.plaid_link_token = link_token
-                    loan.save()
-                    
                     # Create URL with pre-filled link token
                     plaid_ui_url = f'http://localhost:5173/plaid-link-page?token={link_token}&loan_id={loan.id}'
                     
@@ -371,22 +373,10 @@ class PlaidConnectView(APIView):
             access_token = token_data['access_token']
             item_id = token_data['item_id']
             
-            # Store Plaid connection
-            plaid_connection, created = PlaidConnection.objects.get_or_create(
-                loan_application=loan_application,
-                defaults={
-                    'access_token': access_token,
-                    'item_id': item_id
-                }
-            )
-            
-            if not created:
-                plaid_connection.access_token = access_token
-                plaid_connection.item_id = item_id
-                plaid_connection.save()
-            
-            # Get accounts information
-            accounts = plaid_service.get_accounts(access_token)
+            # Store the connection (one per bank item) and its accounts, kept as the item's snapshot
+            # for the views that read it next; transactions and the AI decision are prepared in the
+            # background for the PDF step
+            plaid_connection, accounts = connect_item(loan_application, access_token, item_id, plaid_service)
             
             # Format account data
             formatted_accounts = []
@@ -461,11 +451,14 @@ class GetLoanApplicationWithBankDataView(APIView):
             
             # Check if Plaid is connected
             try:
-                plaid_connection = PlaidConnection.objects.get(loan_application=loan_application)
-                plaid_service = PlaidService()
+                plaid_connections = list(loan_application.plaid_connections.all())
+                if not plaid_connections:
+                    raise PlaidConnection.DoesNotExist
                 
-                # Get fresh account data
-                accounts = plaid_service.get_accounts(plaid_connection.access_token)
+                # Get fresh account data from every connected bank at once
+                accounts, _ = get_combined_account_snapshot(
+                    plaid_connections, fresh=True, deadline=getattr(request, 'deadline', None)
+                )
                 
                 formatted_accounts = []
                 total_balance = 0
@@ -645,6 +638,13 @@ class PlaidLinkTokenView(APIView):
                 description="Loan Application ID",
                 type=openapi.TYPE_INTEGER,
                 required=True
+            ),
+            openapi.Parameter(
+                'refresh',
+                openapi.IN_QUERY,
+                description="1 to create a new link token even if the stored one is still valid",
+                type=openapi.TYPE_STRING,
+                required=False
             )
         ],
         responses={
@@ -654,6 +654,7 @@ class PlaidLinkTokenView(APIView):
                     type=openapi.TYPE_OBJECT,
                     properties={
                         'link_token': openapi.Schema(type=openapi.TYPE_STRING),
+                        'expires_at': openapi.Schema(type=openapi.TYPE_STRING, format=openapi.FORMAT_DATETIME),
                         'loan_application_id': openapi.Schema(type=openapi.TYPE_INTEGER)
                     }
                 )
@@ -673,11 +674,13 @@ class PlaidLinkTokenView(APIView):
         
         try:
             loan_application = get_object_or_404(LoanApplication, id=loan_application_id)
-            plaid_service = PlaidService()
-            link_token = plaid_service.create_link_token(loan_application.id, loan_application.full_name)
+            # Stored token while it is valid; a new one on expiry or with ?refresh=1
+            refresh = request.query_params.get('refresh', '').lower() in ('1', 'true', 'yes')
+            link_token = get_link_token(loan_application, refresh=refresh)
             
             return Response({
                 'link_token': link_token,
+                'expires_at': loan_application.plaid_link_token_expires_at,
                 'loan_application_id': loan_application.id,
                 'instructions': 'Use this link_token with Plaid Link to connect bank account'
             }, status=status.HTTP_200_OK)
@@ -723,23 +726,15 @@ class PlaidConnectAndGetAllInfoView(APIView):
             access_token = token_data['access_token']
             item_id = token_data['item_id']
             
-            # Store Plaid connection
-            plaid_connection, created = PlaidConnection.objects.get_or_create(
-                loan_application=loan_application,
-                defaults={
-                    'access_token': access_token,
-                    'item_id': item_id
-                }
+            # Store the connection (one per bank item) the same way PlaidConnectView does
+            connect_item(loan_application, access_token, item_id, plaid_service)
+            # All info covers every bank connected to the application; the new item's accounts
+            # come from the snapshot just stored
+            accounts, _ = get_combined_account_snapshot(
+                list(loan_application.plaid_connections.all()),
+                plaid_service=plaid_service, deadline=getattr(request, 'deadline', None)
             )
             
-            if not created:
-                plaid_connection.access_token = access_token
-                plaid_connection.item_id = item_id
-                plaid_connection.save()
-            
-            # Get accounts information from Plaid
-            accounts = plaid_service.get_accounts(access_token)
-            
             # Format bank account data
             bank_accounts = []
             total_balance = 0
@@ -872,6 +867,15 @@ class UserBankDetailsView(APIView):
     @swagger_auto_schema(
         operation_summary="Get User's Bank Details",
         operation_description="Get bank account details for a specific user by loan application ID",
+        manual_parameters=[
+            openapi.Parameter(
+                'fresh',
+                openapi.IN_QUERY,
+                description="1 to bypass the cached account snapshot and refetch from Plaid",
+                type=openapi.TYPE_STRING,
+                required=False
+            )
+        ],
         responses={
             200: openapi.Response(
                 "User's bank details",
@@ -886,6 +890,7 @@ class UserBankDetailsView(APIView):
                         ),
                         'total_balance': openapi.Schema(type=openapi.TYPE_STRING),
                         'plaid_connected': openapi.Schema(type=openapi.TYPE_BOOLEAN),
+                        'snapshot_age_seconds': openapi.Schema(type=openapi.TYPE_NUMBER),
                     }
                 )
             ),
@@ -900,11 +905,15 @@ class UserBankDetailsView(APIView):
             
             # Check if user has connected bank account
             try:
-                plaid_connection = PlaidConnection.objects.get(loan_application=loan_application)
-                plaid_service = PlaidService()
+                plaid_connections = list(loan_application.plaid_connections.all())
+                if not plaid_connections:
+                    raise PlaidConnection.DoesNotExist
                 
-                # Get fresh account data from Plaid
-                accounts = plaid_service.get_accounts(plaid_connection.access_token)
+                # Account snapshots of all connected banks, fetched concurrently;
+                # refreshed from Plaid when stale or with ?fresh=1
+                accounts, snapshot_age = get_combined_account_snapshot(
+                    plaid_connections, fresh=wants_fresh(request), deadline=getattr(request, 'deadline', None)
+                )
                 
                 # Format bank account data
                 formatted_accounts = []
@@ -950,6 +959,7 @@ class UserBankDetailsView(APIView):
                         'account_count': len(formatted_accounts)
                     },
                     'plaid_connected': True,
+                    'snapshot_age_seconds': snapshot_age,
                     'message': f'Bank details for {loan_application.full_name}'
                 }, status=status.HTTP_200_OK)
                 
@@ -1021,9 +1031,7 @@ class SandboxStatsView(APIView):
             loan_applications = LoanApplication.objects.all()
             
             for loan_app in loan_applications:
-                has_connection = PlaidConnection.objects.filter(
-                    loan_application=loan_app
-                ).exists()
+                has_connection = loan_app.plaid_connections.exists()
                 
                 user_info = {
                     'loan_id': loan_app.id,
@@ -1056,6 +1064,171 @@ class SandboxStatsView(APIView):
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+class AIEngineStatsView(APIView):
+    """Runtime metrics for the AI pre-approval engine in this worker"""
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    @swagger_auto_schema(
+        operation_summary="Get AI Engine Statistics",
+        operation_description="Connection pool reuse (OpenAI and Plaid) and other runtime counters for the AI pre-approval engine. Counters are per worker process.",
+        responses={
+            200: openapi.Response("AI engine statistics")
+        }
+    )
+    def get(self, request):
+        stats = PreApprovalEngine.stats()
+        stats['coalescing'] = get_coalescing_stats()
+        stats['plaid_pool'] = get_plaid_pool_stats()
+        stats['plaid_retries'] = get_plaid_retry_stats()
+        stats['plaid_account_snapshots'] = get_snapshot_stats()
+        return Response(stats, status=status.HTTP_200_OK)
+
+
+class DecisionBatchView(APIView):
+    """Re-run AI decisions for many loan applications at once"""
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    @swagger_auto_schema(
+        operation_summary="Start Batch Loan Decisions",
+        operation_description="""
+        Queue AI decisions for a list of loan applications (e.g. after a policy change).
+        
+        - Decisions run in the background with at most `concurrency` in flight
+        - Returns immediately with a batch id
+        - Poll GET /api/decision-batches/{batch_id}/ for progress, results and throughput
+        """,
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'loan_ids': openapi.Schema(
+                    type=openapi.TYPE_ARRAY,
+                    items=openapi.Schema(type=openapi.TYPE_INTEGER),
+                    example=[57, 58, 59]
+                ),
+                'concurrency': openapi.Schema(
+                    type=openapi.TYPE_INTEGER,
+                    description="Max decisions in flight (capped by AI_BATCH_MAX_CONCURRENCY)",
+                    example=8
+                ),
+            },
+            required=['loan_ids']
+        ),
+        responses={
+            202: openapi.Response("Batch queued"),
+            400: openapi.Response("Bad request")
+        }
+    )
+    def post(self, request):
+        loan_ids = request.data.get('loan_ids')
+        if not isinstance(loan_ids, list) or not loan_ids:
+            return Response({'error': 'loan_ids must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+
+        max_loans = getattr(settings, 'AI_BATCH_MAX_LOANS', 1000)
+        if len(loan_ids) > max_loans:
+            return Response({'error': f'At most {max_loans} loan_ids per batch'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            loan_ids = list(dict.fromkeys(int(loan_id) for loan_id in loan_ids))
+            max_concurrency = getattr(settings, 'AI_BATCH_MAX_CONCURRENCY', 16)
+            concurrency = int(request.data.get('concurrency') or max_concurrency)
+        except (TypeError, ValueError):
+            return Response({'error': 'loan_ids and concurrency must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+
+        batch = DecisionBatch.objects.create(
+            loan_ids=loan_ids,
+            concurrency=max(1, min(concurrency, max_concurrency))
+        )
+        start_decision_batch(batch)
+
+        return Response({
+            'batch_id': batch.id,
+            'status': batch.status,
+            'total': len(loan_ids),
+            'concurrency': batch.concurrency,
+            'status_url': f'/api/decision-batches/{batch.id}/'
+        }, status=status.HTTP_202_ACCEPTED)
+
+
+class DecisionBatchDetailView(APIView):
+    """Progress and results of a batch decision run"""
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    @swagger_auto_schema(
+        operation_summary="Get Batch Loan Decisions",
+        operation_description="Results are filled in as each decision finishes, so partial results are returned while the batch is running.",
+        responses={
+            200: openapi.Response("Batch progress and results"),
+            404: openapi.Response("Batch not found")
+        }
+    )
+    def get(self, request, batch_id):
+        batch = get_object_or_404(DecisionBatch, id=batch_id)
+        done = batch.completed_count + batch.failed_count
+        return Response({
+            'batch_id': batch.id,
+            'status': batch.status,
+            'total': len(batch.loan_ids),
+            'completed': batch.completed_count,
+            'failed': batch.failed_count,
+            'pending': len(batch.loan_ids) - done,
+            'concurrency': batch.concurrency,
+            'throughput_per_second': batch.throughput(),
+            'started_at': batch.started_at.isoformat() if batch.started_at else None,
+            'finished_at': batch.finished_at.isoformat() if batch.finished_at else None,
+            # No progress for AI_BATCH_STALE_SECONDS: its worker is gone until resume_decision_batches runs it
+            'stalled': batch.is_stalled(),
+            'results': batch.results
+        }, status=status.HTTP_200_OK)
+
+
+class PlaidWebhookView(APIView):
+    """Receives Plaid item, transaction and asset webhooks"""
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    @swagger_auto_schema(
+        operation_summary="Plaid Webhook",
+        operation_description="""
+        Called by Plaid, not by clients. The Plaid-Verification JWT is checked against the raw body,
+        repeated deliveries within the dedup window are acknowledged and skipped, and the item's
+        cached account data is invalidated (and refetched in the background when balances changed).
+        """,
+        responses={
+            200: openapi.Response("Webhook accepted"),
+            400: openapi.Response("Body is not valid JSON"),
+            401: openapi.Response("Verification failed")
+        }
+    )
+    def post(self, request):
+        # Verification hashes the exact bytes Plaid sent, so read them before DRF parses the body
+        body = request.body
+        if getattr(settings, 'PLAID_WEBHOOK_VERIFY', True):
+            try:
+                verify_webhook(body, request.headers.get('Plaid-Verification'))
+            except WebhookVerificationError as e:
+                logger.warning(f"Rejected Plaid webhook: {e}")
+                return Response({'error': str(e)}, status=status.HTTP_401_UNAUTHORIZED)
+
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return Response({'error': 'Body must be valid JSON'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not record_delivery(body, payload):
+            return Response({'status': 'duplicate'}, status=status.HTTP_200_OK)
+
+        try:
+            outcome = handle_webhook(payload)
+        except Exception as e:
+            # Acknowledge anyway: a 5xx makes Plaid retry a webhook we cannot act on
+            logger.error(f"Error handling Plaid webhook: {e}")
+            outcome = 'error'
+        return Response({'status': outcome}, status=status.HTTP_200_OK)
+
+
 # Import the new flow views
 from .flow_views import (
     Step1CreateLoanWithLinkTokenView,
@@ -1087,19 +1260,23 @@ class LoanDecisionPDFView(APIView):
             loan_app = get_object_or_404(LoanApplication, id=loan_id)
             
             # Get Plaid connection and data
-            plaid_connection = PlaidConnection.objects.filter(loan_application=loan_app).first()
+            plaid_connections = list(loan_app.plaid_connections.all())
+            snapshot_age = None
+            bank_data = None  # (accounts, transactions) once fetched from Plaid
             
-            if not plaid_connection:
+            if not plaid_connections:
                 # Use fallback data when no Plaid connection exists
                 logger.warning(f"No Plaid connection found for loan {loan_id}, using fallback data")
                 plaid_data = self._get_fallback_plaid_data(loan_app)
             else:
-                # Get Plaid financial data
-                plaid_service = PlaidService()
+                # Plaid financial data of every connected bank, fetched concurrently (stored Asset Report,
+                # else account snapshot; ?fresh=1 refetches)
                 try:
-                    accounts_data = plaid_service.get_accounts(plaid_connection.access_token)
-                    # Transactions and income products not authorized - skip
-                    transactions_data = []
+                    accounts_data, transactions_data, snapshot_age = get_combined_financial_data(
+                        plaid_connections, fresh=wants_fresh(request), deadline=getattr(request, 'deadline', None)
+                    )
+                    bank_data = (accounts_data, transactions_data)
+                    # Income product not authorized - skip
                     income_data = {}
                     
                     # Format data for AI engine
@@ -1115,34 +1292,36 @@ class LoanDecisionPDFView(APIView):
                 "full_name": loan_app.full_name,
                 "email": loan_app.email,
                 "phone": loan_app.phone_number,
-                "property_zip": loan_app.property_zip,
+                "property_zip": loan_app.property_zip_code,
                 "property_address": loan_app.property_address,
                 "loan_purpose": loan_app.loan_purpose,
                 "purchase_price": loan_app.purchase_price,
                 "down_payment": loan_app.down_payment or "$0"
             }
 
-            # Use AI engine to make decision
-            try:
-                logger.info(f"Making loan decision for {user_input['full_name']}")
-                logger.info(f"Plaid data: {plaid_data}")
-                
-                # Use the real AI engine from aiengine.py
-                engine = PreApprovalEngine(
-                    openai_api_key=os.getenv('OPENAI_API_KEY')
-                )
-                decision = engine.analyze(user_input, plaid_data)
-                
-                # Fallback logic if AI engine fails
-                if decision not in ["approve", "disapprove"]:
-                    down_payment_str = plaid_data.get('analysis', {}).get('down_payment_percentage', '0%')
-                    down_payment_pct = float(down_payment_str.replace('%', ''))
-                    decision = "approve" if down_payment_pct >= 20 else "disapprove"
+            # Use AI engine to make decision. Without bank data (no connection, or Plaid failed) liquid
+            # assets would read as zero, so the down-payment fallback below decides and nothing is stored
+            decision = None
+            if bank_data is not None:
+                try:
+                    logger.info(f"Making loan decision for {user_input['full_name']}")
+                    logger.info(f"Plaid data: {plaid_data}")
                     
-                logger.info(f"AI Decision: {decision}")
-                
-            except Exception as e:
-                logger.error(f"AI Engine error: {e}")
+                    # Use the real AI engine from aiengine.py
+                    engine = PreApprovalEngine(
+                        openai_api_key=os.getenv('OPENAI_API_KEY'),
+                        endpoint='loan_decision_pdf'
+                    )
+                    # The engine reads the loan and liquid assets as bank_analysis_inputs lays them out
+                    # (plaid_data above is shaped for the PDF), which also gives the decision its fingerprint
+                    decision_input, decision_data = bank_analysis_inputs(loan_app, *bank_data)
+                    decision = stored_decision(loan_app, engine, decision_input, decision_data, deadline=getattr(request, 'deadline', None))
+                    logger.info(f"AI Decision: {decision}")
+                    
+                except Exception as e:
+                    logger.error(f"AI Engine error: {e}")
+
+            if decision not in ["approve", "disapprove"]:
                 # Fallback to simple logic
                 down_payment_str = plaid_data.get('analysis', {}).get('down_payment_percentage', '0%')
                 down_payment_pct = float(down_payment_str.replace('%', ''))
@@ -1158,6 +1337,8 @@ class LoanDecisionPDFView(APIView):
                 # Send sorry SMS (placeholder)
                 self._send_sorry_sms(user_input['phone'], user_input['full_name'])
 
+            if snapshot_age is not None:
+                pdf_response['X-Snapshot-Age'] = str(snapshot_age)
             return pdf_response
 
         except Exception as e:
@@ -1555,25 +1736,29 @@ class AILoanDecisionView(APIView):
                 user_input = request_user_input
                 plaid_data = request_plaid_data
                 loan = None  # We don't need loan object for custom data
+                snapshot_age = None
                 logger.info("Using custom data from request body for AI processing")
             else:
                 # Use database lookup (original functionality)
                 loan = LoanApplication.objects.get(id=loan_id)
                 
                 # Get Plaid connection and data
-                plaid_connection = PlaidConnection.objects.filter(loan_application=loan).first()
+                plaid_connections = list(loan.plaid_connections.all())
+                snapshot_age = None
+                bank_data = None  # (accounts, transactions) once fetched from Plaid
                 
-                if not plaid_connection:
+                if not plaid_connections:
                     # Use fallback data when no Plaid connection exists
                     logger.warning(f"No Plaid connection found for loan {loan_id}, using fallback data")
                     plaid_data = self._get_fallback_plaid_data_for_ai(loan)
                 else:
-                    # Get Plaid financial data
-                    plaid_service = PlaidService()
+                    # Plaid financial data of every connected bank, fetched concurrently (stored Asset Report,
+                    # else account snapshot; ?fresh=1 refetches)
                     try:
-                        accounts_data = plaid_service.get_accounts(plaid_connection.access_token)
-                        # Transactions product not authorized - skip
-                        transactions_data = []
+                        accounts_data, transactions_data, snapshot_age = get_combined_financial_data(
+                            plaid_connections, fresh=wants_fresh(request), deadline=getattr(request, 'deadline', None)
+                        )
+                        bank_data = (accounts_data, transactions_data)
                         
                         # Format data for AI engine
                         plaid_data = self._format_plaid_data_for_ai(accounts_data, transactions_data, loan)
@@ -1601,27 +1786,34 @@ class AILoanDecisionView(APIView):
                     "down_payment": str(loan.down_payment) if loan.down_payment else "$0"
                 }
 
-            # Use AI engine to make decision
-            try:
-                logger.info(f"Making loan decision for {user_input['full_name']}")
-                logger.info(f"Plaid data: {plaid_data}")
-                
-                # Use the real AI engine from aiengine.py
-                engine = PreApprovalEngine(
-                    openai_api_key=os.getenv('OPENAI_API_KEY')
-                )
-                decision = engine.analyze(user_input, plaid_data)
-                
-                # Fallback logic if AI engine fails
-                if decision not in ["approve", "disapprove"]:
-                    down_payment_str = plaid_data.get('analysis', {}).get('down_payment_percentage', '0%')
-                    down_payment_pct = float(down_payment_str.replace('%', ''))
-                    decision = "approve" if down_payment_pct >= 20 else "disapprove"
+            # Use AI engine to make decision. For a stored loan without bank data (no connection, or
+            # Plaid failed) liquid assets would read as zero, so the down-payment fallback below
+            # decides and nothing is stored
+            decision = None
+            if loan is None or bank_data is not None:
+                try:
+                    logger.info(f"Making loan decision for {user_input['full_name']}")
+                    logger.info(f"Plaid data: {plaid_data}")
                     
-                logger.info(f"AI Decision: {decision}")
-                
-            except Exception as e:
-                logger.error(f"AI Engine error: {e}")
+                    # Use the real AI engine from aiengine.py
+                    engine = PreApprovalEngine(
+                        openai_api_key=os.getenv('OPENAI_API_KEY'),
+                        endpoint='ai_loan_decision'
+                    )
+                    # For a stored loan the engine reads the loan and liquid assets as bank_analysis_inputs
+                    # lays them out (plaid_data above is shaped for the response), which also gives the
+                    # decision its fingerprint; custom request data is decided but never stored
+                    decision_input, decision_data = (
+                        bank_analysis_inputs(loan, *bank_data) if loan is not None
+                        else (user_input, plaid_data)
+                    )
+                    decision = stored_decision(loan, engine, decision_input, decision_data, deadline=getattr(request, 'deadline', None))
+                    logger.info(f"AI Decision: {decision}")
+                    
+                except Exception as e:
+                    logger.error(f"AI Engine error: {e}")
+
+            if decision not in ["approve", "disapprove"]:
                 # Fallback to simple logic
                 down_payment_str = plaid_data.get('analysis', {}).get('down_payment_percentage', '0%')
                 down_payment_pct = float(down_payment_str.replace('%', ''))
@@ -1669,6 +1861,8 @@ class AILoanDecisionView(APIView):
             # Return PDF as download
             response = HttpResponse(pdf_buffer.getvalue(), content_type='application/pdf')
             response['Content-Disposition'] = f'attachment; filename="{filename}"'
+            if snapshot_age is not None:
+                response['X-Snapshot-Age'] = str(snapshot_age)
             return response
             
         except LoanApplication.DoesNotExist:
@@ -2082,21 +2276,20 @@ class BankDataAnalysisPDFView(APIView):
             # Get loan application
             loan = get_object_or_404(LoanApplication, id=loan_id)
             
-            # Get Plaid connection
-            plaid_connection = PlaidConnection.objects.filter(loan_application=loan).first()
+            # Get Plaid connections (one per connected bank)
+            plaid_connections = list(loan.plaid_connections.all())
             
-            if not plaid_connection:
+            if not plaid_connections:
                 return Response(
                     {'error': 'No Plaid connection found for this loan'},
                     status=status.HTTP_404_NOT_FOUND
                 )
             
-            # Fetch Plaid data
-            plaid_service = PlaidService()
+            # Fetch Plaid data (stored Asset Report, else account snapshot; ?fresh=1 refetches)
             try:
-                accounts = plaid_service.get_accounts(plaid_connection.access_token)
-                # Transactions product not authorized - skip transaction fetching
-                transactions = []
+                accounts, transactions, snapshot_age = get_combined_financial_data(
+                    plaid_connections, fresh=wants_fresh(request), deadline=getattr(request, 'deadline', None)
+                )
             except Exception as e:
                 logger.error(f"Error fetching Plaid data: {e}")
                 return Response(
@@ -2105,55 +2298,15 @@ class BankDataAnalysisPDFView(APIView):
                 )
             
             # Prepare data for AI analysis
-            user_input = {
-                'full_name': loan.full_name,
-                'email': loan.email,
-                'phone': loan.phone_number,
-                'property_address': loan.property_address,
-                'property_zip': loan.property_zip_code,
-                'loan_purpose': loan.loan_purpose,
-                'purchase_price': str(loan.purchase_price),
-                'down_payment': str(loan.down_payment),
-                'annual_income': str(loan.annual_income)
-            }
-            
-            # Format Plaid data
-            bank_accounts = []
-            total_balance = 0
-            
-            for account in accounts:
-                balance = account.get('balances', {}).get('current', 0) or 0
-                total_balance += balance if balance else 0
-                bank_accounts.append({
-                    'account_id': account.get('account_id'),
-                    'name': account.get('name'),
-                    'type': account.get('type'),
-                    'subtype': account.get('subtype'),
-                    'balance': balance,
-                    'currency': account.get('balances', {}).get('iso_currency_code', 'USD')
-                })
-            
-            plaid_data = {
-                'loan_application': {
-                    'id': loan.id,
-                    'full_name': loan.full_name,
-                    'email': loan.email,
-                    'annual_income': str(loan.annual_income),
-                    'purchase_price': str(loan.purchase_price),
-                    'down_payment': str(loan.down_payment),
-                    'loan_purpose': loan.loan_purpose
-                },
-                'bank_accounts': bank_accounts,
-                'total_balance': f"${total_balance:,.2f}",
-                'transaction_count': len(transactions)
-            }
+            user_input, plaid_data = bank_analysis_inputs(loan, accounts, transactions)
             
             # Perform AI analysis
             try:
                 engine = PreApprovalEngine(
-                    openai_api_key=os.getenv('OPENAI_API_KEY')
+                    openai_api_key=os.getenv('OPENAI_API_KEY'),
+                    endpoint='bank_analysis_pdf'
                 )
-                decision = engine.analyze(user_input, plaid_data)
+                decision = stored_decision(loan, engine, user_input, plaid_data, deadline=getattr(request, 'deadline', None))
             except Exception as e:
                 logger.warning(f"AI analysis failed: {e}")
                 decision = 'pending'
@@ -2164,7 +2317,10 @@ class BankDataAnalysisPDFView(APIView):
             return HttpResponse(
                 pdf_content,
                 content_type='application/pdf',
-                headers={'Content-Disposition': f'attachment; filename="loan_analysis_{loan.id}.pdf"'}
+                headers={
+                    'Content-Disposition': f'attachment; filename="loan_analysis_{loan.id}.pdf"',
+                    'X-Snapshot-Age': str(snapshot_age),
+                }
             )
             
         except Exception as e:
@@ -2487,45 +2643,8 @@ class GeneratePDFFromBankDataView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            # Prepare user input for AI engine
-            user_input = {
-                'full_name': loan_data.get('full_name', 'Unknown'),
-                'email': loan_data.get('email', 'unknown@example.com'),
-                'phone': loan_data.get('phone_number', 'N/A'),
-                'property_address': loan_data.get('property_address', 'N/A'),
-                'property_zip': loan_data.get('property_zip_code', 'N/A'),
-                'loan_purpose': loan_data.get('loan_purpose', 'N/A'),
-                'purchase_price': str(loan_data.get('purchase_price', '0')),
-                'down_payment': str(loan_data.get('down_payment', '0')),
-                'annual_income': str(loan_data.get('annual_income', '0'))
-            }
-            
-            # Format Plaid data
-            formatted_accounts = []
-            for account in bank_accounts:
-                formatted_accounts.append({
-                    'account_id': account.get('account_id', 'N/A'),
-                    'name': account.get('name', 'Unknown Account'),
-                    'type': account.get('type', 'depository'),
-                    'subtype': account.get('subtype', 'checking'),
-                    'balance': account.get('current_balance', 0),
-                    'currency': account.get('currency', 'USD')
-                })
-            
-            plaid_data = {
-                'loan_application': {
-                    'id': loan_id,
-                    'full_name': loan_data.get('full_name', 'Unknown'),
-                    'email': loan_data.get('email', 'unknown@example.com'),
-                    'annual_income': str(loan_data.get('annual_income', '0')),
-                    'purchase_price': str(loan_data.get('purchase_price', '0')),
-                    'down_payment': str(loan_data.get('down_payment', '0')),
-                    'loan_purpose': loan_data.get('loan_purpose', 'N/A')
-                },
-                'bank_accounts': formatted_accounts,
-                'total_balance': total_balance,
-                'transaction_count': 0  # No transactions available
-            }
+            # Prepare user input and Plaid data for AI engine
+            user_input, plaid_data = direct_analysis_inputs(loan_id, loan_data, bank_accounts, total_balance)
             
             # Perform AI analysis
             try:
@@ -2535,9 +2654,12 @@ class GeneratePDFFromBankDataView(APIView):
                     decision = 'pending'
                 else:
                     engine = PreApprovalEngine(
-                        openai_api_key=api_key
+                        openai_api_key=api_key,
+                        endpoint='generate_pdf_from_data'
                     )
-                    decision = engine.analyze(user_input, plaid_data)
+                    # The figures are client-posted, not fetched from Plaid: decide without storing
+                    # a Decision against the loan application
+                    decision = stored_decision(None, engine, user_input, plaid_data, deadline=getattr(request, 'deadline', None))
                     logger.info(f"✅ AI Decision for loan {loan_id}: {decision}")
             except Exception as e:
                 logger.error(f"❌ AI analysis failed: {str(e)}", exc_info=True)
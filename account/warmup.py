@@ -0,0 +1,89 @@
+"""
+Background warm-up after a bank is connected.
+The connect response returns right away; meanwhile the item's Asset Report
+is requested and its accounts and transactions (and, with PLAID_WARMUP_DECISION,
+the AI decision) are loaded into storage so the PDF and decision endpoints
+that usually follow find them ready.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .account_snapshots import get_account_snapshot
+from .asset_reports import get_combined_financial_data, request_asset_report
+from .aiengine import PreApprovalEngine
+from .decisions import bank_analysis_inputs, stored_decision
+from .models import PlaidConnection
+from .plaid_service import PlaidService
+from .transactions import sync_if_stale
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'PLAID_WARMUP_MAX_WORKERS', 4),
+                    thread_name_prefix='plaid-warmup',
+                )
+    return _executor
+
+
+def warm_up(connection_id):
+    """Load one connection's data into storage; failures are logged, the next read just fetches live."""
+    started = time.perf_counter()
+    try:
+        plaid_connection = PlaidConnection.objects.select_related('loan_application').get(id=connection_id)
+        plaid_service = PlaidService()
+
+        if getattr(settings, 'PLAID_ASSET_REPORTS', True):
+            try:
+                # Plaid takes a while to build it, so ask first; no-op once the item has one.
+                # When it is ready, warm-up runs again to decide from the report.
+                request_asset_report(plaid_connection, plaid_service)
+            except Exception as e:
+                logger.warning(f"Asset report request failed for item {plaid_connection.item_id}: {e}")
+
+        # Usually already stored by the connect view, in which case this is a cache read
+        get_account_snapshot(plaid_connection, plaid_service=plaid_service)
+
+        try:
+            sync_if_stale(plaid_connection, plaid_service)
+        except Exception as e:
+            logger.warning(f"Warm-up transaction sync failed for item {plaid_connection.item_id}: {e}")
+
+        if getattr(settings, 'PLAID_WARMUP_DECISION', False):
+            # Same inputs (all of the applicant's banks) and endpoint as BankDataAnalysisPDFView,
+            # so that view reuses this decision
+            loan = plaid_connection.loan_application
+            accounts, transactions, _ = get_combined_financial_data(
+                list(loan.plaid_connections.all()), plaid_service=plaid_service
+            )
+            user_input, plaid_data = bank_analysis_inputs(loan, accounts, transactions)
+            engine = PreApprovalEngine(
+                openai_api_key=os.getenv('OPENAI_API_KEY'),
+                endpoint='bank_analysis_pdf'
+            )
+            stored_decision(loan, engine, user_input, plaid_data)
+
+        logger.info(f"Warm-up for item {plaid_connection.item_id} done in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        logger.warning(f"Warm-up failed for Plaid connection {connection_id}: {e}")
+    finally:
+        connection.close()
+
+
+def schedule_warm_up(connection_id):
+    """Queue warm_up once the connection row is committed, so the worker thread can see it."""
+    transaction.on_commit(lambda: _get_executor().submit(warm_up, connection_id))
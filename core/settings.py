@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
+import json
 import os
 from dotenv import load_dotenv
 
@@ -51,6 +52,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'account.middleware.RequestDeadlineMiddleware',  # Per-request time budget for upstream calls
     'corsheaders.middleware.CorsMiddleware',  # CORS middleware (must be before CommonMiddleware)
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -94,6 +96,24 @@ DATABASES = {
     }
 }
 
+# Caches shared by all worker processes (account snapshots, AI decisions, ...).
+# The database cache by default (entrypoint.sh runs `manage.py createcachetable`);
+# REDIS_URL switches to Redis, which needs the redis package.
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'django_cache',
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -162,6 +182,158 @@ PLAID_CLIENT_ID = '68b1be404904f40022b28f70'
 PLAID_SECRET = '6a0c03818bcb00404b4a150b0a4468'  
 PLAID_ENV = 'production' 
 #PLAID_ENV = 'sandbox'
+# Overrides PLAID_ENV's host, e.g. http://127.0.0.1:8765 for `manage.py fake_plaid` load tests
+PLAID_HOST = os.getenv('PLAID_HOST')
+
+# Stored link tokens are reused until less than this many seconds are left (Plaid's last 4 hours)
+PLAID_LINK_TOKEN_MIN_TTL = int(os.getenv('PLAID_LINK_TOKEN_MIN_TTL', '600'))
+
+# Shared Plaid client (one per worker process): pool size should cover the most
+# concurrent Plaid calls a worker makes (batch/async threads)
+PLAID_POOL_SIZE = int(os.getenv('PLAID_POOL_SIZE', '16'))
+PLAID_CONNECT_TIMEOUT = float(os.getenv('PLAID_CONNECT_TIMEOUT', '5'))
+PLAID_READ_TIMEOUT = float(os.getenv('PLAID_READ_TIMEOUT', '20'))
+# PlaidService.fetch_concurrently: independent Plaid calls of one request run in parallel
+PLAID_FETCH_MAX_WORKERS = int(os.getenv('PLAID_FETCH_MAX_WORKERS', '16'))
+PLAID_FETCH_TIMEOUT = float(os.getenv('PLAID_FETCH_TIMEOUT', '25'))
+# Parse account/transaction responses straight from JSON into slotted records (plaid_records)
+# instead of plaid-python's models; `manage.py benchmark_plaid_parsing` compares the two
+PLAID_RAW_RESPONSES = os.getenv('PLAID_RAW_RESPONSES', 'True') == 'True'
+# Retries of Plaid 429s and transient errors (5xx, institution down): exponential backoff
+# with full jitter from PLAID_RETRY_BASE_DELAY up to PLAID_RETRY_MAX_DELAY seconds.
+# Calls that create something (token exchange, asset report creation) are only retried on 429s.
+PLAID_RETRY_ATTEMPTS = int(os.getenv('PLAID_RETRY_ATTEMPTS', '4'))  # calls in total, including the first
+PLAID_RETRY_BASE_DELAY = float(os.getenv('PLAID_RETRY_BASE_DELAY', '0.5'))
+PLAID_RETRY_MAX_DELAY = float(os.getenv('PLAID_RETRY_MAX_DELAY', '8'))
+# Client-side token buckets per Plaid endpoint, shared by all workers through the database
+# (each limited call takes a row lock on its PlaidRateBucket). Off by default.
+# Calls per minute (0 = unlimited); PLAID_RATE_LIMITS overrides single paths as JSON,
+# e.g. '{"/transactions/get": 300}'. Keep these under the quota agreed with Plaid.
+PLAID_RATE_LIMIT_DEFAULT = int(os.getenv('PLAID_RATE_LIMIT_DEFAULT', '0'))
+PLAID_RATE_LIMITS = json.loads(os.getenv('PLAID_RATE_LIMITS', '{}'))
+PLAID_RATE_LIMIT_BURST = int(os.getenv('PLAID_RATE_LIMIT_BURST', '20'))  # calls allowed back to back
+PLAID_RATE_LIMIT_MAX_WAIT = float(os.getenv('PLAID_RATE_LIMIT_MAX_WAIT', '10'))  # fail rather than queue longer
+# Raw responses of these Plaid endpoints are kept gzip-compressed per connection
+# (PlaidResponseArchive; off unless set, e.g. '/accounts/get,/accounts/balance/get,/transactions/get').
+# With PLAID_REPLAY every PlaidService answers from that archive instead of calling Plaid,
+# e.g. to re-run decisions offline. `manage.py prune_plaid_archive` (run it daily) deletes
+# responses older than PLAID_ARCHIVE_RETENTION_DAYS.
+PLAID_ARCHIVE_ENDPOINTS = [path for path in os.getenv('PLAID_ARCHIVE_ENDPOINTS', '').split(',') if path]
+PLAID_ARCHIVE_COMPRESSION_LEVEL = int(os.getenv('PLAID_ARCHIVE_COMPRESSION_LEVEL', '6'))  # gzip 1-9
+PLAID_ARCHIVE_RETENTION_DAYS = int(os.getenv('PLAID_ARCHIVE_RETENTION_DAYS', '90'))
+PLAID_REPLAY = os.getenv('PLAID_REPLAY', 'False') == 'True'
+
+# Plaid webhooks (POST /api/plaid/webhook/). PLAID_WEBHOOK_URL is the public URL of that
+# endpoint; it is set on new link tokens so Plaid reports item/transaction/asset changes.
+PLAID_WEBHOOK_URL = os.getenv('PLAID_WEBHOOK_URL')
+PLAID_WEBHOOK_VERIFY = os.getenv('PLAID_WEBHOOK_VERIFY', 'True') == 'True'
+PLAID_WEBHOOK_MAX_AGE = int(os.getenv('PLAID_WEBHOOK_MAX_AGE', '300'))  # seconds since the JWT was issued
+PLAID_WEBHOOK_KEY_TTL = int(os.getenv('PLAID_WEBHOOK_KEY_TTL', '600'))  # seconds a verification key is cached
+PLAID_WEBHOOK_DEDUP_SECONDS = int(os.getenv('PLAID_WEBHOOK_DEDUP_SECONDS', '3600'))
+PLAID_WEBHOOK_REFRESH = os.getenv('PLAID_WEBHOOK_REFRESH', 'True') == 'True'  # refetch accounts when balances changed
+
+# Background warm-up after a bank is connected: transactions and (optionally) the AI decision.
+# Warming the decision makes a paid model call per connect, whether or not the applicant
+# ever opens the PDF, so it is off unless enabled.
+PLAID_WARMUP_MAX_WORKERS = int(os.getenv('PLAID_WARMUP_MAX_WORKERS', '4'))
+PLAID_WARMUP_DECISION = os.getenv('PLAID_WARMUP_DECISION', 'False') == 'True'
+
+# Asset Reports: requested during warm-up and stored when Plaid has built them; the PDF and
+# decision endpoints then read accounts/transactions from the report. Completion comes via the
+# ASSETS webhook (if PLAID_WEBHOOK_URL is set; the poller then starts after the grace period)
+# or a poller backing off from the initial delay up to the max delay until the timeout.
+PLAID_ASSET_REPORTS = os.getenv('PLAID_ASSET_REPORTS', 'True') == 'True'
+PLAID_ASSET_REPORT_DAYS = int(os.getenv('PLAID_ASSET_REPORT_DAYS', '60'))  # history to include (max 731)
+# Reports older than this (seconds) are not used for decisions; a new one is requested instead
+PLAID_ASSET_REPORT_MAX_AGE = int(os.getenv('PLAID_ASSET_REPORT_MAX_AGE', '86400'))
+PLAID_ASSET_REPORT_POLL_WORKERS = int(os.getenv('PLAID_ASSET_REPORT_POLL_WORKERS', '4'))
+PLAID_ASSET_REPORT_FETCH_WORKERS = int(os.getenv('PLAID_ASSET_REPORT_FETCH_WORKERS', '2'))  # webhook downloads
+PLAID_ASSET_REPORT_POLL_INITIAL_DELAY = float(os.getenv('PLAID_ASSET_REPORT_POLL_INITIAL_DELAY', '5'))
+PLAID_ASSET_REPORT_POLL_MAX_DELAY = float(os.getenv('PLAID_ASSET_REPORT_POLL_MAX_DELAY', '60'))
+PLAID_ASSET_REPORT_POLL_TIMEOUT = float(os.getenv('PLAID_ASSET_REPORT_POLL_TIMEOUT', '900'))
+PLAID_ASSET_REPORT_WEBHOOK_GRACE = float(os.getenv('PLAID_ASSET_REPORT_WEBHOOK_GRACE', '120'))
+
+# Local transaction store (/transactions/sync): Step 3 syncs when the last sync is older
+# than this; TRANSACTIONS webhooks sync as soon as Plaid has changes
+PLAID_TRANSACTIONS_MAX_AGE = int(os.getenv('PLAID_TRANSACTIONS_MAX_AGE', '21600' if PLAID_WEBHOOK_URL else '3600'))
+PLAID_TRANSACTIONS_SYNC_PAGE_SIZE = int(os.getenv('PLAID_TRANSACTIONS_SYNC_PAGE_SIZE', '500'))
+PLAID_TRANSACTIONS_PAGE_SIZE = int(os.getenv('PLAID_TRANSACTIONS_PAGE_SIZE', '500'))  # /transactions/get paging (max 500)
+
+# Account snapshots: Plaid account data cached per item for this many seconds in the
+# PLAID_SNAPSHOT_CACHE_ALIAS cache (see CACHES; '?fresh=1' on the reading views bypasses it). Webhooks invalidate
+# snapshots when the item changes, so with them configured and a cache every worker
+# shares (an invalidation must reach all of them) the TTL can be long.
+PLAID_SNAPSHOT_CACHE_ALIAS = os.getenv('PLAID_SNAPSHOT_CACHE_ALIAS', 'default')
+_snapshot_cache_shared = CACHES.get(PLAID_SNAPSHOT_CACHE_ALIAS, {}).get('BACKEND') not in (
+    None, 'django.core.cache.backends.locmem.LocMemCache', 'django.core.cache.backends.dummy.DummyCache'
+)
+PLAID_SNAPSHOT_TTL = int(os.getenv('PLAID_SNAPSHOT_TTL', '3600' if PLAID_WEBHOOK_URL and _snapshot_cache_shared else '300'))
+
+# OpenAI settings - one pooled client is shared per worker process
+OPENAI_POOL_SIZE = int(os.getenv('OPENAI_POOL_SIZE', '10'))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv('OPENAI_KEEPALIVE_EXPIRY', '60'))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv('OPENAI_CONNECT_TIMEOUT', '5'))
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', '30'))
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '0'))  # the circuit breaker handles failures
+# Same for the Anthropic client (hedge/cascade providers)
+ANTHROPIC_POOL_SIZE = int(os.getenv('ANTHROPIC_POOL_SIZE', '10'))
+ANTHROPIC_KEEPALIVE_EXPIRY = float(os.getenv('ANTHROPIC_KEEPALIVE_EXPIRY', '60'))
+ANTHROPIC_CONNECT_TIMEOUT = float(os.getenv('ANTHROPIC_CONNECT_TIMEOUT', '5'))
+ANTHROPIC_TIMEOUT = float(os.getenv('ANTHROPIC_TIMEOUT', '30'))
+ANTHROPIC_MAX_RETRIES = int(os.getenv('ANTHROPIC_MAX_RETRIES', '0'))
+
+# Time budget per request; upstream calls get what is left minus the reserve
+# needed to build the response (gunicorn kills workers after 30s)
+REQUEST_DEADLINE_SECONDS = float(os.getenv('REQUEST_DEADLINE_SECONDS', '25'))
+AI_DEADLINE_RESERVE_SECONDS = float(os.getenv('AI_DEADLINE_RESERVE_SECONDS', '2'))
+
+# Hedged model requests: when the primary OpenAI model has not answered within its
+# recent p95 latency (or fails), the same prompt is sent to these 'vendor:model'
+# alternates and the first answer wins. Empty disables hedging.
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY')
+AI_HEDGE_PROVIDERS = [spec for spec in os.getenv('AI_HEDGE_PROVIDERS', '').split(',') if spec.strip()]
+AI_HEDGE_ENABLED = os.getenv('AI_HEDGE_ENABLED', 'True') == 'True'
+AI_HEDGE_DEFAULT_DELAY = float(os.getenv('AI_HEDGE_DEFAULT_DELAY', '2.0'))  # until enough latency samples exist
+AI_HEDGE_MIN_DELAY = float(os.getenv('AI_HEDGE_MIN_DELAY', '0.25'))
+AI_HEDGE_MIN_SAMPLES = int(os.getenv('AI_HEDGE_MIN_SAMPLES', '20'))
+AI_HEDGE_MAX_WORKERS = int(os.getenv('AI_HEDGE_MAX_WORKERS', '32'))
+
+# Circuit breaker for model calls: open after N consecutive failures/timeouts, probe again after the recovery time
+AI_BREAKER_FAILURE_THRESHOLD = int(os.getenv('AI_BREAKER_FAILURE_THRESHOLD', '5'))
+AI_BREAKER_RECOVERY_SECONDS = float(os.getenv('AI_BREAKER_RECOVERY_SECONDS', '30'))
+
+# AI decision cache - 'memory' (per worker), 'shared' (the AI_DECISION_CACHE_ALIAS cache
+# in CACHES, seen by all workers) or a dotted class path
+AI_DECISION_CACHE_BACKEND = os.getenv('AI_DECISION_CACHE_BACKEND', 'memory')
+AI_DECISION_CACHE_TTL = int(os.getenv('AI_DECISION_CACHE_TTL', '3600'))
+AI_DECISION_CACHE_MAX_ENTRIES = int(os.getenv('AI_DECISION_CACHE_MAX_ENTRIES', '1024'))
+AI_DECISION_CACHE_ALIAS = os.getenv('AI_DECISION_CACHE_ALIAS', 'default')
+
+# Rule-based pre-screen: cases within this relative margin of a limit go to the model
+AI_PRESCREEN_ENABLED = os.getenv('AI_PRESCREEN_ENABLED', 'True') == 'True'
+AI_PRESCREEN_MARGIN = float(os.getenv('AI_PRESCREEN_MARGIN', '0.10'))
+
+# Model cascade: on these endpoints a small model answers first and the request only
+# escalates to the primary model when its first-token confidence is below the threshold
+# or its answer disagrees with the rule check. Endpoint names: loan_decision_pdf,
+# ai_loan_decision, bank_analysis_pdf, generate_pdf_from_data, decision_batch.
+AI_CASCADE_ENDPOINTS = [name.strip() for name in os.getenv('AI_CASCADE_ENDPOINTS', '').split(',') if name.strip()]
+AI_CASCADE_MODEL = os.getenv('AI_CASCADE_MODEL', 'gpt-4o-mini')
+AI_CASCADE_MIN_CONFIDENCE = float(os.getenv('AI_CASCADE_MIN_CONFIDENCE', '0.90'))
+AI_CASCADE_TIMEOUT = float(os.getenv('AI_CASCADE_TIMEOUT', '5'))
+
+# Coalescing of identical in-flight decisions across workers (DecisionLock table)
+AI_DECISION_LOCK_TTL = int(os.getenv('AI_DECISION_LOCK_TTL', '60'))  # > OPENAI_TIMEOUT, so only crashed holders expire
+AI_DECISION_LOCK_POLL_INTERVAL = float(os.getenv('AI_DECISION_LOCK_POLL_INTERVAL', '0.1'))
+
+# Batch decisioning
+AI_BATCH_MAX_CONCURRENCY = int(os.getenv('AI_BATCH_MAX_CONCURRENCY', '16'))
+AI_BATCH_MAX_LOANS = int(os.getenv('AI_BATCH_MAX_LOANS', '1000'))
+# A running batch saves a heartbeat every AI_BATCH_HEARTBEAT_SECONDS; one silent for AI_BATCH_STALE_SECONDS
+# was orphaned by a worker restart and is picked up by `manage.py resume_decision_batches` (run it from cron)
+AI_BATCH_HEARTBEAT_SECONDS = float(os.getenv('AI_BATCH_HEARTBEAT_SECONDS', '15'))
+AI_BATCH_STALE_SECONDS = int(os.getenv('AI_BATCH_STALE_SECONDS', '120'))
 
 # CORS settings - Allow frontend to make requests
 CORS_ALLOWED_ORIGINS = [
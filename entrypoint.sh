@@ -17,6 +17,8 @@ fi
 # Run migrations
 echo "Running database migrations..."
 python manage.py migrate --noinput
+# Table of the shared database cache (CACHES); a no-op once it exists
+python manage.py createcachetable
 
 # Collect static files
 echo "Collecting static files..."
@@ -26,6 +28,19 @@ python manage.py collectstatic --noinput
 # python manage.py shell -c "from django.contrib.auth.models import User; User.objects.filter(username='admin').exists() or User.objects.create_superuser('admin', 'admin@example.com', 'admin123')"
 
 # Start Gunicorn
+# SERVER_INTERFACE=asgi serves core/asgi.py with uvicorn workers so the async
+# decision views can keep many OpenAI calls in flight per worker.
+if [ "${SERVER_INTERFACE:-wsgi}" = "asgi" ]; then
+    echo "Starting Gunicorn server (ASGI)..."
+    exec gunicorn core.asgi:application \
+        --bind 0.0.0.0:8005 \
+        --workers 4 \
+        --worker-class uvicorn.workers.UvicornWorker \
+        --access-logfile - \
+        --error-logfile - \
+        --log-level info
+fi
+
 echo "Starting Gunicorn server..."
 gunicorn core.wsgi:application \
     --bind 0.0.0.0:8005 \